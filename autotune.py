@@ -0,0 +1,284 @@
+import argparse
+import glob
+import json
+import math
+import os
+import re
+import logging
+from typing import Optional, List, Dict, Any, Tuple, NamedTuple
+
+import telemetry
+from convergence import Z_95, DEFAULT_CI_HALF_WIDTH, DEFAULT_MIN_PROBLEMS, DEFAULT_MAX_PROBLEMS
+from mdtext import count_visible_chars, detect_language
+from runstore import PARAMS_FILE, RAW_FILES
+
+logger = logging.getLogger("DeepSeekAPI")
+
+# 与 gen.py 的默认参数一致；没有历史运行时原样返回
+DEFAULT_PARAMS = {"geniter": 3, "valiter": 2, "valproblems": 5, "maxwait": 300}
+# 可选的参数范围
+GEN_ITER_RANGE = range(2, 5)
+VAL_ITER_RANGE = range(1, 6)
+MIN_MAX_WAIT = 120
+# 同语言的历史运行不少于该数量时只用同语言的运行
+MIN_SIMILAR_RUNS = 3
+# 选择参数时要求历史上达到目标（正确率、字数）的运行比例
+REQUIRED_SUCCESS = 0.8
+# 最终摘要不超过字数限制的该倍数即视为符合
+LENGTH_TOLERANCE = 1.05
+# maxwait 取历史单次调用耗时 P99 的该倍数
+MAX_WAIT_FACTOR = 1.5
+# 每轮验证的调用阶段；出题的多个请求并行，按一次调用计
+LOOP_STAGES = ("question", "solve", "parse", "refine")
+_RESULT_FILE = re.compile(r'result(\d+)\.json$')
+
+class RunHistory(NamedTuple):
+    """一次历史运行中与调参有关的数据"""
+    run_dir: str
+    params: Dict[str, Any]
+    input_chars: int
+    language: Optional[str]
+    calls: List[Dict[str, Any]]
+    accuracies: List[float]
+    final_chars: Optional[int]
+
+def _final_limit(params: Dict[str, Any]) -> Optional[int]:
+    limit = params.get("maxtoken")
+    if isinstance(limit, list):
+        limit = limit[0] if limit else None
+    return limit
+
+def load_run(run_dir: str) -> Optional[RunHistory]:
+    """读取一个输出目录；缺少参数、原文或调用记录时返回 None"""
+    params_path = os.path.join(run_dir, PARAMS_FILE)
+    if not os.path.exists(params_path):
+        return None
+    try:
+        with open(params_path, "r", encoding="utf-8") as f:
+            params = json.load(f)
+    except (OSError, ValueError):
+        return None
+    content = None
+    for name in RAW_FILES:
+        path = os.path.join(run_dir, name)
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                content = f.read()
+            break
+    calls = telemetry.load_records(os.path.join(run_dir, "telemetry.jsonl"))
+    if content is None or not calls:
+        return None
+
+    scores = []
+    for path in glob.glob(os.path.join(run_dir, "result*.json")):
+        match = _RESULT_FILE.search(os.path.basename(path))
+        if not match:
+            continue
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                result = json.load(f)
+        except (OSError, ValueError):
+            continue
+        total = len(result.get("details") or [])
+        if total:
+            scores.append((int(match.group(1)), int(result.get("correct_count") or 0) / total))
+    final_chars = None
+    final_path = os.path.join(run_dir, "final_summary.txt")
+    if os.path.exists(final_path):
+        with open(final_path, "r", encoding="utf-8") as f:
+            final_chars = count_visible_chars(f.read())
+    return RunHistory(run_dir, params, count_visible_chars(content), detect_language(content),
+                      calls, [acc for _, acc in sorted(scores)], final_chars)
+
+def load_history(pattern: str) -> List[RunHistory]:
+    """读取匹配通配符的所有输出目录（如 output/output_*），跳过无法使用的目录"""
+    runs = []
+    for run_dir in sorted(glob.glob(pattern)):
+        if os.path.isdir(run_dir):
+            run = load_run(run_dir)
+            if run is not None:
+                runs.append(run)
+    return runs
+
+def _fit(points: List[Tuple[float, float]]) -> Tuple[float, float]:
+    """最小二乘拟合 y = a + b·x；点太少或 x 无变化时退化为均值，斜率不为负"""
+    if not points:
+        return 0.0, 0.0
+    n = len(points)
+    mean_x = sum(x for x, _ in points) / n
+    mean_y = sum(y for _, y in points) / n
+    var = sum((x - mean_x) ** 2 for x, _ in points)
+    if n < 3 or var == 0:
+        return mean_y, 0.0
+    slope = max(0.0, sum((x - mean_x) * (y - mean_y) for x, y in points) / var)
+    return mean_y - slope * mean_x, slope
+
+class StageModel:
+    """各阶段单次调用的耗时与 token 用量，按输入原文字数线性拟合"""
+
+    def __init__(self, runs: List[RunHistory]):
+        latency: Dict[str, List[Tuple[float, float]]] = {}
+        tokens: Dict[str, List[Tuple[float, float]]] = {}
+        self.latencies: List[float] = []
+        for run in runs:
+            for r in run.calls:
+                stage = r.get("stage") or "-"
+                if r.get("latency") is None:
+                    continue
+                self.latencies.append(float(r["latency"]))
+                latency.setdefault(stage, []).append((run.input_chars, float(r["latency"])))
+                used = int(r.get("prompt_tokens") or 0) + int(r.get("completion_tokens") or 0)
+                tokens.setdefault(stage, []).append((run.input_chars, used))
+        self._latency = {stage: _fit(points) for stage, points in latency.items()}
+        self._tokens = {stage: _fit(points) for stage, points in tokens.items()}
+
+    def latency(self, stage: str, input_chars: int) -> float:
+        a, b = self._latency.get(stage, (0.0, 0.0))
+        return a + b * input_chars
+
+    def tokens(self, stage: str, input_chars: int) -> float:
+        a, b = self._tokens.get(stage, (0.0, 0.0))
+        return a + b * input_chars
+
+    def latency_quantile(self, q: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def loops_to_target(run: RunHistory, target: float) -> Optional[int]:
+    """该运行第几轮验证首次达到目标正确率；从未达到时为 None"""
+    for i, acc in enumerate(run.accuracies, start=1):
+        if acc >= target:
+            return i
+    return None
+
+class Tuner:
+    """
+    由历史运行推荐参数并预测耗时
+
+    耗时 = geniter × 压缩耗时 + 预期验证轮数 × (出题 + 解答 + 解析 + 优化耗时)，各阶段耗时按原文字数
+    线性拟合；预期验证轮数取历史运行达到目标正确率所需轮数（未达到的按 valiter 计）的平均。
+    """
+
+    def __init__(self, runs: List[RunHistory], language: Optional[str] = None):
+        similar = [r for r in runs if language and r.language == language]
+        self.runs = similar if len(similar) >= MIN_SIMILAR_RUNS else runs
+        self.model = StageModel(self.runs)
+        self.scored = [r for r in self.runs if r.accuracies]
+
+    def expected_loops(self, val_iter: int, target: float) -> float:
+        if not self.scored:
+            return float(val_iter)
+        loops = [min(loops_to_target(r, target) or val_iter, val_iter) for r in self.scored]
+        return sum(loops) / len(loops)
+
+    def reach_rate(self, val_iter: int, target: float) -> Optional[float]:
+        """历史运行在 val_iter 轮内达到目标正确率的比例"""
+        if not self.scored:
+            return None
+        hits = [(loops_to_target(r, target) or val_iter + 1) <= val_iter for r in self.scored]
+        return sum(hits) / len(hits)
+
+    def length_rate(self, gen_iter: int) -> Optional[float]:
+        """历史上 geniter 相同的运行中最终摘要符合字数限制的比例"""
+        done = [r for r in self.runs if r.params.get("geniter") == gen_iter
+                and r.final_chars is not None and _final_limit(r.params)]
+        if not done:
+            return None
+        ok = [r.final_chars <= _final_limit(r.params) * LENGTH_TOLERANCE for r in done]
+        return sum(ok) / len(ok)
+
+    def predict(self, params: Dict[str, Any], input_chars: int, target: float = 1.0) -> Dict[str, float]:
+        """预测给定参数的墙钟耗时（秒）和 token 用量"""
+        gen_iter, val_iter = int(params["geniter"]), int(params["valiter"])
+        loops = self.expected_loops(val_iter, target)
+        seconds = gen_iter * self.model.latency("compress", input_chars)
+        tokens = gen_iter * self.model.tokens("compress", input_chars)
+        for stage in LOOP_STAGES:
+            seconds += loops * self.model.latency(stage, input_chars)
+            tokens += loops * self.model.tokens(stage, input_chars)
+        return {"seconds": seconds, "tokens": tokens, "loops": loops}
+
+    def recommend(self, input_chars: int, final_limit: int, target: float = 1.0) -> Dict[str, Any]:
+        """
+        推荐 geniter、valiter、valproblems 和 maxwait
+
+        在历史上达到目标正确率、最终字数符合限制的比例不低于 REQUIRED_SUCCESS 的组合中，
+        选预测耗时最短者（耗时相同时 token 少者优先）；没有组合满足时选达成比例最高者。
+        """
+        if not self.runs:
+            return dict(DEFAULT_PARAMS, predicted=None, runs=0,
+                        basis="没有可用的历史运行，使用默认参数")
+        candidates = []
+        for gen_iter in GEN_ITER_RANGE:
+            length = self.length_rate(gen_iter)
+            if length is None:
+                # 没有该 geniter 的记录时按压缩计划判断：原文超过 2 倍限制时需要第三轮压缩到最终限制
+                length = 1.0 if gen_iter >= 3 or input_chars <= 2 * final_limit else 0.0
+            for val_iter in VAL_ITER_RANGE:
+                reach = self.reach_rate(val_iter, target)
+                reach = 1.0 if reach is None else reach
+                params = {"geniter": gen_iter, "valiter": val_iter}
+                predicted = self.predict(params, input_chars, target)
+                success = min(length, reach)
+                candidates.append((success >= REQUIRED_SUCCESS, success, -predicted["seconds"],
+                                   -predicted["tokens"], params, predicted))
+        feasible = [c for c in candidates if c[0]]
+        if feasible and not self.scored:
+            best = max(feasible, key=lambda c: (c[2], c[3]))
+            basis = "历史运行没有验证得分，取符合字数限制的最快设置"
+        elif feasible:
+            best = max(feasible, key=lambda c: (c[2], c[3]))
+            basis = f"历史上 {best[1]:.0%} 的运行在该设置下达到目标"
+        else:
+            best = max(candidates, key=lambda c: (c[1], c[2], c[3]))
+            basis = f"没有设置能使 {REQUIRED_SUCCESS:.0%} 的历史运行达到目标，选达成比例最高者（{best[1]:.0%}）"
+        params = dict(best[4])
+
+        # 题目数：使正确率 95% 置信区间半宽约为 DEFAULT_CI_HALF_WIDTH
+        accuracies = [acc for r in self.scored for acc in r.accuracies]
+        if accuracies:
+            p = min(max(sum(accuracies) / len(accuracies), 0.05), 0.95)
+            problems = math.ceil(Z_95 ** 2 * p * (1 - p) / DEFAULT_CI_HALF_WIDTH ** 2)
+            params["valproblems"] = min(max(problems, DEFAULT_MIN_PROBLEMS), DEFAULT_MAX_PROBLEMS)
+        else:
+            params["valproblems"] = DEFAULT_PARAMS["valproblems"]
+
+        p99 = self.model.latency_quantile(0.99)
+        params["maxwait"] = max(MIN_MAX_WAIT, math.ceil(p99 * MAX_WAIT_FACTOR)) if p99 else DEFAULT_PARAMS["maxwait"]
+        return dict(params, predicted=best[5], runs=len(self.runs), basis=basis)
+
+def format_duration(seconds: float) -> str:
+    if seconds < 90:
+        return f"{seconds:.0f} 秒"
+    return f"{seconds / 60:.0f} 分钟"
+
+def main():
+    parser = argparse.ArgumentParser(description="根据历史运行推荐 gen.py 的参数并预测耗时")
+    parser.add_argument("--filename", required=True, help="输入文件（已修复的 TXT，或 PDF）")
+    parser.add_argument("--maxtoken", type=int, required=True, help="字数限制")
+    parser.add_argument("--targetacc", type=float, default=1.0, help="目标验证正确率 (默认: 1.0)")
+    parser.add_argument("--history", default=os.path.join("output", "output_*"),
+                        help="历史运行的输出目录通配符 (默认: output/output_*)")
+    args = parser.parse_args()
+
+    if args.filename.lower().endswith(".pdf"):
+        from fix import extract_text_from_pdf
+        content = extract_text_from_pdf(args.filename)
+    else:
+        with open(args.filename, "r", encoding="utf-8") as f:
+            content = f.read()
+    input_chars = count_visible_chars(content)
+    tuner = Tuner(load_history(args.history), detect_language(content))
+    rec = tuner.recommend(input_chars, args.maxtoken, args.targetacc)
+    print(f"输入: {input_chars} 字, 历史运行: {rec['runs']} 次")
+    print(f"推荐参数: --geniter {rec['geniter']} --valiter {rec['valiter']} "
+          f"--valproblems {rec['valproblems']} --maxwait {rec['maxwait']}")
+    print(f"依据: {rec['basis']}")
+    if rec["predicted"]:
+        print(f"预计耗时: {format_duration(rec['predicted']['seconds'])}, "
+              f"预计 token: {rec['predicted']['tokens']:.0f}, 预期验证轮数: {rec['predicted']['loops']:.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+流式输出接收端的微基准
+
+模拟 100k 个增量块的流式响应（正文与思考过程交替），分别用旧的逐块拼接/刷新方式
+和 sinks 框架处理，按窗口统计每块平均耗时，检查后段与前段的耗时比是否保持平稳。
+
+用法:
+    python benchmarks/bench_sinks.py [--tokens 100000] [--windows 10]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sinks import (StreamChunk, FileSink, ConsoleSink, GuiSink, CollectSink, MetricsSink,
+                   HashSink, CONTENT, REASONING, drain)
+
+def make_stream(tokens: int):
+    """生成模拟的增量块；前 1/4 为思考过程，其余为正文"""
+    words = ["公式", "定理", "证明", "**关键术语**", "$x^2$", "example", "\n", "。"]
+    for i in range(tokens):
+        kind = REASONING if i < tokens // 4 else CONTENT
+        yield StreamChunk(kind, words[i % len(words)])
+
+def timed(stream, windows: int, tokens: int, marks: list):
+    """包装生成器，把各窗口结束时刻追加到 marks，用于统计每个窗口的耗时（包括下游接收端的处理时间）"""
+    size = max(tokens // windows, 1)
+    marks.append(time.perf_counter())
+    for i, chunk in enumerate(stream, 1):
+        yield chunk
+        if i % size == 0:
+            marks.append(time.perf_counter())
+
+def legacy(stream, path: str, console) -> str:
+    """旧实现：字符串累加、逐块 write+flush、逐块打印"""
+    full_response = ""
+    with open(path, "w", encoding="utf-8") as f:
+        for kind, chunk_str in stream:
+            if kind != CONTENT:
+                continue
+            print(chunk_str, end='', flush=True, file=console)
+            f.write(chunk_str)
+            f.flush()
+            full_response += chunk_str
+    return full_response
+
+def with_sinks(stream, path: str, console) -> str:
+    """与旧实现功能相同的接收端组合"""
+    collector = CollectSink(kinds=(CONTENT,))
+    drain(stream, [collector, FileSink(path, kinds=(CONTENT,)),
+                   ConsoleSink(kinds=(CONTENT,), stream=console)])
+    return collector.text(CONTENT)
+
+def with_all_sinks(stream, path: str, console) -> str:
+    """全部接收端：另存思考过程、GUI 回调、统计和哈希"""
+    collector = CollectSink(kinds=(CONTENT,))
+    gui_updates = []
+    sinks = [
+        collector,
+        FileSink(path, kinds=(CONTENT,)),
+        FileSink(path + ".reasoning", kinds=(REASONING,)),
+        ConsoleSink(stream=console),
+        GuiSink(lambda text, kind: gui_updates.append(len(text))),
+        MetricsSink(),
+        HashSink(),
+    ]
+    drain(stream, sinks)
+    return collector.text(CONTENT)
+
+def run(name, fn, tokens, windows, tmpdir):
+    console = open(os.devnull, "w", encoding="utf-8")
+    try:
+        path = os.path.join(tmpdir, f"{name}.txt")
+        marks = []
+        start = time.perf_counter()
+        text = fn(timed(make_stream(tokens), windows, tokens, marks), path, console)
+        total = time.perf_counter() - start
+    finally:
+        console.close()
+    per_chunk = [(b - a) / (tokens / windows) * 1e6 for a, b in zip(marks, marks[1:])]
+    return total, per_chunk, len(text)
+
+def main():
+    parser = argparse.ArgumentParser(description="流式输出接收端微基准")
+    parser.add_argument("--tokens", type=int, default=100000, help="模拟的增量块数")
+    parser.add_argument("--windows", type=int, default=10, help="统计窗口数")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        print(f"{'实现':<8} {'总耗时(s)':>10} {'首窗口(us/块)':>14} {'末窗口(us/块)':>14} {'末/首':>8}")
+        for name, fn in (("legacy", legacy), ("sinks", with_sinks),
+                         ("all", with_all_sinks)):
+            total, per_chunk, length = run(name, fn, args.tokens, args.windows, tmpdir)
+            # 第一个窗口全是思考过程，旧实现会跳过，取正文开始后的窗口比较
+            first = per_chunk[args.windows // 4 + 1] if len(per_chunk) > args.windows // 4 + 1 else per_chunk[0]
+            last = per_chunk[-1]
+            print(f"{name:<8} {total:>10.3f} {first:>14.2f} {last:>14.2f} {last / first:>8.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+"""
+本地文本处理热点的微基准
+
+用合成的中文、英文课程讲义（Markdown，10KB~50MB）和由其生成的 PDF，测量每轮迭代都会
+执行的本地处理：strip_markdown、count_visible_chars、detect_language、解答状态 JSON 的
+兜底解析（parse_results_json）、generate_visualization 和 extract_text_from_pdf。
+报告吞吐量（MB/s，按输入的 UTF-8 字节计）和 tracemalloc 统计的内存峰值，并与保存的
+基线比较：吞吐量下降或内存峰值上升超过阈值时以退出码 1 结束。
+
+内存峰值只包含 Python 分配的内存，PyMuPDF 在 C 层的分配不计入。基线与机器有关，
+更换机器或有意改变性能特征后，用 --savebaseline 重新生成。比较时按固定校准负载的
+速度换算基线吞吐量，抵消同一台机器上负载波动造成的整体快慢。
+
+用法:
+    python benchmarks/bench_textproc.py [--sizes 10KB 1MB 50MB] [--pdfsizes 10KB 1MB]
+                                        [--only strip_markdown detect_language]
+                                        [--baseline benchmarks/baseline_textproc.json]
+                                        [--threshold 0.3] [--memthreshold 0.3] [--savebaseline]
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fitz
+
+from fix import extract_text_from_pdf
+from gen import parse_results_json, generate_visualization
+from mdtext import strip_markdown, count_visible_chars, detect_language
+
+DEFAULT_SIZES = ("10KB", "100KB", "1MB", "10MB", "50MB")
+DEFAULT_PDF_SIZES = ("10KB", "100KB", "1MB")
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline_textproc.json")
+DEFAULT_THRESHOLD = 0.3
+# 很小的输入上内存峰值的绝对波动，低于该值的增加不算回归
+MEM_SLACK_KB = 64
+# 单次运行超过该时间（秒）时不再重复测量
+LONG_RUN = 2.0
+# 小输入至少重复到累计该时间（秒），减少计时噪声
+MIN_BENCH_TIME = 0.5
+
+ZH_TERMS = ["特征值", "线性变换", "正交矩阵", "行列式", "梯度下降", "贝叶斯公式", "极大似然", "拉格朗日乘子"]
+EN_TERMS = ["eigenvalue", "linear map", "orthogonal matrix", "determinant", "gradient descent",
+            "Bayes' rule", "maximum likelihood", "Lagrange multiplier"]
+ZH_FILLER = "本节介绍{t}的定义、性质与常见证明思路，并给出典型例题和易错点分析。"
+EN_FILLER = "This section introduces the definition and properties of {t}, with worked examples and common pitfalls. "
+
+def parse_size(text: str) -> int:
+    units = {"KB": 1 << 10, "MB": 1 << 20, "GB": 1 << 30}
+    for unit, scale in units.items():
+        if text.upper().endswith(unit):
+            return int(float(text[:-len(unit)]) * scale)
+    return int(text)
+
+def make_corpus(lang: str, size: int, seed: int = 0) -> str:
+    """生成约 size 字节（UTF-8）的合成讲义，包含标题、加粗、列表、引用、行内代码、代码块和链接"""
+    rng = random.Random(seed)
+    terms, filler = (ZH_TERMS, ZH_FILLER) if lang == "zh" else (EN_TERMS, EN_FILLER)
+    parts, total, chapter = [], 0, 0
+    while total < size:
+        chapter += 1
+        t = rng.choice(terms)
+        block = [f"# {chapter}. {t}\n"]
+        for _ in range(rng.randint(2, 5)):
+            u = rng.choice(terms)
+            block.append(f"## {u}\n" + filler.format(t=f"**{u}**") * rng.randint(2, 6) + "\n")
+            block.append(f"- ~~{rng.choice(terms)}~~ `{u}` 与 [{t}](https://example.com/{chapter})\n"
+                         f"> {filler.format(t=u)}\n")
+            if rng.random() < 0.3:
+                block.append("```python\nx = solve(A, b)\n```\n")
+        text = "\n".join(block) + "\n"
+        parts.append(text)
+        total += len(text.encode("utf-8"))
+    return "".join(parts)
+
+def make_results(size: int, seed: int = 0) -> list:
+    """生成序列化后约 size 字节的解答状态列表"""
+    rng = random.Random(seed)
+    statuses = ["正确", "错误", "无法解答"]
+    results, total, i = [], 0, 0
+    while total < size:
+        i += 1
+        item = {"question": f"{i}. 关于{rng.choice(ZH_TERMS)}的说法哪项正确？", "status": rng.choice(statuses)}
+        results.append(item)
+        total += len(json.dumps(item, ensure_ascii=False).encode("utf-8")) + 2
+    return results
+
+def make_pdf(text: str, path: str) -> None:
+    """把文本按页写入 PDF；使用内置 CJK 字体，中英文都能提取"""
+    doc = fitz.open()
+    lines = text.splitlines()
+    per_page = 45
+    for i in range(0, len(lines), per_page):
+        page = doc.new_page()
+        page.insert_textbox(fitz.Rect(36, 36, 576, 806), "\n".join(lines[i:i + per_page]),
+                            fontsize=8, fontname="china-s")
+    doc.save(path)
+    doc.close()
+
+def calibrate(rounds: int = 20) -> float:
+    """固定的正则替换负载的吞吐量（MB/s），取最快的一次，作为机器当前速度的参照"""
+    text = ("**术语** 与 `code` 以及 [链接](https://example.com) " * 20000)
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        re.sub(r'(\*\*|__)(.*?)\1', r'\2', re.sub(r'\[([^\]]+)\]\([^\)]+\)', r'\1', text))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(text.encode("utf-8")) / (1 << 20) / best
+
+def measure(fn, arg, repeat: int):
+    """
+    返回 (最短耗时秒, 内存峰值 KB)；耗时与内存分开测量，避免 tracemalloc 拖慢计时
+
+    至少运行 repeat 次且累计 MIN_BENCH_TIME 秒；单次超过 LONG_RUN 秒时只运行一次。
+    """
+    best, total, runs = None, 0.0, 0
+    while runs < repeat or total < MIN_BENCH_TIME:
+        start = time.perf_counter()
+        fn(arg)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+        total += elapsed
+        runs += 1
+        if elapsed > LONG_RUN:
+            break
+    tracemalloc.start()
+    try:
+        base = tracemalloc.get_traced_memory()[0]
+        fn(arg)
+        peak = tracemalloc.get_traced_memory()[1] - base
+    finally:
+        tracemalloc.stop()
+    return best, peak / 1024
+
+def cases(sizes, pdf_sizes, tmpdir):
+    """产出 (名称, 语言, 大小标签, 输入字节数, 函数, 参数)"""
+    vis_dir = os.path.join(tmpdir, "vis")
+    os.makedirs(vis_dir, exist_ok=True)
+    for label in sizes:
+        size = parse_size(label)
+        for lang in ("zh", "en"):
+            corpus = make_corpus(lang, size)
+            nbytes = len(corpus.encode("utf-8"))
+            yield "strip_markdown", lang, label, nbytes, strip_markdown, corpus
+            yield "count_visible_chars", lang, label, nbytes, count_visible_chars, corpus
+            yield "detect_language", lang, label, nbytes, detect_language, corpus
+            del corpus
+        results = make_results(size)
+        payload = json.dumps(results, ensure_ascii=False)
+        # 模型常在 JSON 前后附带说明，触发兜底的数组提取
+        wrapped = f"解析结果如下：\n```json\n{payload}\n```\n以上为全部题目。"
+        yield "parse_results_json", "zh", label, len(wrapped.encode("utf-8")), parse_results_json, wrapped
+        yield ("generate_visualization", "zh", label, len(payload.encode("utf-8")),
+               lambda r: generate_visualization(r, vis_dir, 0), results)
+    for label in pdf_sizes:
+        size = parse_size(label)
+        for lang in ("zh", "en"):
+            path = os.path.join(tmpdir, f"{lang}_{label}.pdf")
+            make_pdf(make_corpus(lang, size), path)
+            yield "extract_text_from_pdf", lang, label, os.path.getsize(path), extract_text_from_pdf, path
+
+def compare(results, baseline, threshold, mem_threshold, speed=1.0):
+    """与基线比较，返回回归说明列表；speed 为本次与基线的校准速度之比"""
+    regressions = []
+    for key, r in results.items():
+        base = baseline.get(key)
+        if not base:
+            continue
+        expected = base["mb_per_s"] * speed
+        if r["mb_per_s"] < expected * (1 - threshold):
+            regressions.append(f"{key}: 吞吐量 {r['mb_per_s']:.2f} MB/s，"
+                               f"基线换算后 {expected:.2f} MB/s")
+        limit = base["peak_kb"] * (1 + mem_threshold) + MEM_SLACK_KB
+        if r["peak_kb"] > limit:
+            regressions.append(f"{key}: 内存峰值 {r['peak_kb']:.0f} KB，基线 {base['peak_kb']:.0f} KB")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="本地文本处理热点微基准")
+    parser.add_argument("--sizes", nargs="+", default=list(DEFAULT_SIZES), help="文本语料大小，如 10KB 1MB 50MB")
+    parser.add_argument("--pdfsizes", nargs="+", default=list(DEFAULT_PDF_SIZES), help="生成 PDF 所用文本的大小")
+    parser.add_argument("--only", nargs="+", help="只运行这些基准（按函数名）")
+    parser.add_argument("--repeat", type=int, default=3, help="每项至少重复次数，取最短耗时")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="基线文件路径")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help=f"吞吐量允许下降的比例 (默认: {DEFAULT_THRESHOLD})")
+    parser.add_argument("--memthreshold", type=float, default=DEFAULT_THRESHOLD,
+                        help=f"内存峰值允许上升的比例 (默认: {DEFAULT_THRESHOLD})")
+    parser.add_argument("--savebaseline", action="store_true", help="把本次结果写入基线文件（与已有基线合并）")
+    parser.add_argument("--json", help="另将本次结果写入该 JSON 文件")
+    args = parser.parse_args()
+
+    baseline, base_calibration = {}, None
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        baseline, base_calibration = data.get("results", {}), data.get("calibration_mb_per_s")
+
+    calibration = calibrate()
+    speed = calibration / base_calibration if base_calibration else 1.0
+    print(f"校准负载: {calibration:.2f} MB/s" +
+          (f"（基线 {base_calibration:.2f} MB/s，换算系数 {speed:.2f}）" if base_calibration else ""))
+
+    results = {}
+    print(f"{'基准':<24} {'语言':<4} {'大小':>6} {'MB/s':>10} {'峰值(KB)':>12} {'基线(换算)':>10}")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for name, lang, label, nbytes, fn, arg in cases(args.sizes, args.pdfsizes, tmpdir):
+            if args.only and name not in args.only:
+                continue
+            # generate_visualization 会打印统计，测量时丢弃
+            stdout, sys.stdout = sys.stdout, open(os.devnull, "w", encoding="utf-8")
+            try:
+                elapsed, peak_kb = measure(fn, arg, args.repeat)
+            finally:
+                sys.stdout.close()
+                sys.stdout = stdout
+            key = f"{name}/{lang}/{label}"
+            mb_per_s = nbytes / (1 << 20) / max(elapsed, 1e-9)
+            results[key] = {"bytes": nbytes, "seconds": round(elapsed, 6),
+                            "mb_per_s": round(mb_per_s, 3), "peak_kb": round(peak_kb, 1)}
+            base = baseline.get(key, {}).get("mb_per_s")
+            base = f"{base * speed:.2f}" if base is not None else "-"
+            print(f"{name:<24} {lang:<4} {label:>6} {mb_per_s:>10.2f} {peak_kb:>12.0f} {base:>10}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"results": results}, f, ensure_ascii=False, indent=2)
+    if args.savebaseline:
+        # 合并进已有基线时按其校准速度换算，使各项基线可以相互比较
+        merged = dict(baseline, **{key: dict(r, mb_per_s=round(r["mb_per_s"] / speed, 3))
+                                   for key, r in results.items()})
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"machine": platform.platform(), "python": platform.python_version(),
+                       "calibration_mb_per_s": round(calibration, 3) if base_calibration is None
+                       else base_calibration, "results": merged}, f, ensure_ascii=False, indent=2)
+        print(f"基线已保存至 {args.baseline}（{len(merged)} 项）")
+        return
+
+    regressions = compare(results, baseline, args.threshold, args.memthreshold, speed)
+    if regressions:
+        print("\n性能回归：")
+        for line in regressions:
+            print(f"  {line}")
+        sys.exit(1)
+    if baseline:
+        print("\n未发现超过阈值的回归")
+
+if __name__ == "__main__":
+    main()
@@ -4,21 +4,33 @@ import logging
 import os
 import sys
 import argparse
+import inspect
+import time
+import errors
+import ratelimit
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from sinks import StreamChunk, FileSink, ConsoleSink, CollectSink, CONTENT, REASONING, drain, close_sinks
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
-from typing import Optional, Union, List, Dict, Generator
+from typing import Optional, Union, List, Dict, Generator, Iterable, Iterator, Tuple, TextIO
 
 # 设置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("DeepSeekAPI")
 
+# 批处理模式的默认并发数与可重试错误的重试次数
+DEFAULT_BATCH_CONCURRENCY = 4
+DEFAULT_BATCH_RETRIES = 3
+DEFAULT_BATCH_RETRY_DELAY = 2
+
 def create_retry_session(
     retries: int = 3,
     backoff_factor: float = 0.3,
     status_forcelist: tuple = (500, 502, 504),
     session: Optional[requests.Session] = None,
+    pool_maxsize: int = 10,
 ) -> requests.Session:
-    """创建带有重试机制的请求会话"""
+    """创建带有重试机制的请求会话；pool_maxsize 为每个主机保留的连接数"""
     session = session or requests.Session()
     retry = Retry(
         total=retries,
@@ -27,7 +39,7 @@ def create_retry_session(
         backoff_factor=backoff_factor,
         status_forcelist=status_forcelist,
     )
-    adapter = HTTPAdapter(max_retries=retry)
+    adapter = HTTPAdapter(max_retries=retry, pool_maxsize=pool_maxsize)
     session.mount('http://', adapter)
     session.mount('https://', adapter)
     return session
@@ -57,8 +69,16 @@ def call_deepseek_api(
     session: Optional[requests.Session] = None,
     retries: int = 3,
     backoff_factor: float = 0.3,
+    include_reasoning: bool = False,
     **kwargs
-) -> Union[str, List[str], Generator[str, None, None]]:
+) -> Union[str, List[str], Generator[Union[str, StreamChunk], None, None]]:
+    """
+    调用 DeepSeek 对话接口
+
+    stream=True 时返回生成器，默认只产出正文字符串；include_reasoning=True 时
+    产出 StreamChunk，思考过程（reasoning_content）与正文分开标记。
+    传入 session 时直接复用其连接池和重试设置，retries 与 backoff_factor 不再生效。
+    """
     
     url = "https://api.deepseek.com/v1/chat/completions"
     
@@ -116,12 +136,12 @@ def call_deepseek_api(
     data.update(kwargs)
     
     try:
-        # 创建带重试机制的会话
-        session = create_retry_session(
-            retries=retries,
-            backoff_factor=backoff_factor,
-            session=session
-        )
+        if session is None:
+            # 创建带重试机制的会话；传入的会话（如批处理共用的连接池）直接复用
+            session = create_retry_session(
+                retries=retries,
+                backoff_factor=backoff_factor
+            )
         
         if stream:
             # 流式处理 - 返回生成器
@@ -148,6 +168,8 @@ def call_deepseek_api(
                                 chunk = json.loads(json_str)
                                 if "choices" in chunk and len(chunk["choices"]) > 0:
                                     delta = chunk["choices"][0].get("delta", {})
+                                    if include_reasoning and delta.get("reasoning_content"):
+                                        yield StreamChunk(REASONING, str(delta["reasoning_content"]))
                                     if "content" in delta:
                                         content = delta["content"]
                                         # 确保内容始终是字符串且不为None
@@ -155,7 +177,10 @@ def call_deepseek_api(
                                             logger.debug("收到空内容块，跳过")
                                             continue
                                         content_str = str(content)
-                                        yield content_str
+                                        if include_reasoning:
+                                            yield StreamChunk(CONTENT, content_str)
+                                        else:
+                                            yield content_str
                             except json.JSONDecodeError:
                                 logger.warning("JSON解析错误，跳过数据块")
                                 continue
@@ -193,13 +218,13 @@ def call_deepseek_api(
             
     except requests.exceptions.RequestException as e:
         logger.error(f"API请求错误: {str(e)}")
-        return f"API请求错误: {str(e)}"
-    except (KeyError, IndexError):
+        raise errors.from_request_exception(e) from e
+    except (KeyError, IndexError) as e:
         logger.error("响应解析错误: 无效的API响应格式")
-        return "响应解析错误: 无效的API响应格式"
-    except json.JSONDecodeError:
+        raise errors.MalformedResponseError("响应解析错误: 无效的API响应格式") from e
+    except json.JSONDecodeError as e:
         logger.error("JSON解析错误: 无效的API响应格式")
-        return "JSON解析错误: 无效的API响应格式"
+        raise errors.MalformedResponseError("JSON解析错误: 无效的API响应格式") from e
 
 def save_file(path: str, content: str) -> None:
     """保存内容到文件"""
@@ -215,47 +240,46 @@ def save_file(path: str, content: str) -> None:
         f.write(content)
     logger.info(f"内容已保存至 {path}")
 
-def save_stream_thoughts(path: str, generator: Generator[str, None, None]) -> str:
+def save_stream_thoughts(
+    path: str,
+    generator: Generator[Union[str, StreamChunk], None, None],
+    reasoning_path: Optional[str] = None,
+    echo: bool = True,
+) -> str:
     """
     保存流式输出的思考过程
     
     参数:
-        path: 保存思考过程的文件路径
-        generator: 流式响应生成器
+        path: 保存流式输出的文件路径
+        generator: 流式响应生成器（字符串或 StreamChunk）
+        reasoning_path: 单独保存思考过程的文件路径；为 None 时思考过程与正文写入同一文件
+        echo: 是否同时打印到控制台
         
     返回:
-        完整响应内容（不含None）
+        完整响应正文（不含思考过程）
     """
-    # 确保目录存在
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    
-    full_response = ""
+    collector = CollectSink(kinds=(CONTENT,))
+    sinks = [collector]
     try:
-        # 打开文件用于实时写入思考过程
-        with open(path, "w", encoding="utf-8") as f_thoughts:
-            for chunk in generator:
-                # 确保chunk是字符串且不为None
-                if chunk is None:
-                    logger.debug("收到空块，跳过")
-                    continue
-                    
-                chunk_str = str(chunk)
-                
-                # 打印到控制台（可选）
-                print(chunk_str, end='', flush=True)
-                
-                # 写入思考过程文件（仅写入当前块）
-                f_thoughts.write(chunk_str)
-                f_thoughts.flush()  # 确保实时写入
-                
-                # 拼接完整响应
-                full_response += chunk_str
-                
+        if reasoning_path:
+            sinks.append(FileSink(path, kinds=(CONTENT,)))
+            sinks.append(FileSink(reasoning_path, kinds=(REASONING,)))
+        else:
+            sinks.append(FileSink(path))
+        if echo:
+            sinks.append(ConsoleSink())
+    except Exception as e:
+        # 某个接收端打开失败时关闭已打开的接收端，避免文件句柄泄漏
+        close_sinks(sinks)
+        logger.error(f"打开输出文件时出错: {str(e)}")
+        return collector.text(CONTENT)
+    try:
+        drain(generator, sinks)
     except Exception as e:
         logger.error(f"保存思考过程时出错: {str(e)}")
     
     logger.info(f"思考过程已保存至 {path}")
-    return full_response
+    return collector.text(CONTENT)
 
 def save_stream_result(path: str, content: str) -> None:
     """
@@ -277,6 +301,139 @@ def save_stream_result(path: str, content: str) -> None:
         f.write(content)
     logger.info(f"最终结果已保存至 {path}")
 
+def _batch_keys() -> set:
+    """批处理输入中允许的键：call_deepseek_api 的参数（session 由批处理统一提供）和 id"""
+    keys = set(inspect.signature(call_deepseek_api).parameters)
+    keys.discard("session")
+    return keys | {"id"}
+
+def read_batch(lines: Iterable[str]) -> Iterator[Tuple[int, Union[Dict, Exception]]]:
+    """
+    逐行读取批处理输入，产出 (序号, 请求参数)
+
+    每行为一个 JSON 对象（至少包含 prompt，其余键为 call_deepseek_api 的参数）或一个
+    JSON 字符串（仅 prompt）。空行跳过且不占序号；无法解析或含有不支持的键的行产出
+    对应的异常，由调用方作为该条的错误结果输出。
+    """
+    index = 0
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+            if isinstance(record, str):
+                record = {"prompt": record}
+            if not isinstance(record, dict) or not isinstance(record.get("prompt"), str):
+                raise ValueError("每行需为包含 prompt 字段的 JSON 对象或 JSON 字符串")
+            if record.get("stream"):
+                raise ValueError("批处理模式不支持 stream")
+            unknown = set(record) - _batch_keys()
+            if unknown:
+                raise ValueError(f"不支持的参数: {', '.join(sorted(unknown))}")
+            yield index, record
+        except ValueError as e:
+            yield index, e
+        index += 1
+
+def _call_with_retries(
+    params: Dict,
+    session: requests.Session,
+    limiter: Optional[ratelimit.RateLimiter],
+    api_retries: int,
+) -> Tuple[Union[str, List[str]], int]:
+    """按限流器发送一次请求，可重试的错误按 Retry-After 或指数退避重试；返回 (结果, 尝试次数)"""
+    attempt = 0
+    while True:
+        try:
+            if limiter is not None:
+                with limiter.slot():
+                    return call_deepseek_api(session=session, **params), attempt + 1
+            return call_deepseek_api(session=session, **params), attempt + 1
+        except errors.DeepSeekAPIError as e:
+            if not e.retryable or attempt >= api_retries:
+                raise
+            delay = e.retry_after or DEFAULT_BATCH_RETRY_DELAY * (2 ** attempt)
+            attempt += 1
+            logger.warning(f"{type(e).__name__}: {str(e)}，{delay:.0f} 秒后重试（{attempt}/{api_retries}）")
+            time.sleep(delay)
+
+def run_batch(
+    records: Iterable[Tuple[int, Union[Dict, Exception]]],
+    defaults: Dict,
+    concurrency: int = DEFAULT_BATCH_CONCURRENCY,
+    requests_per_minute: Optional[float] = None,
+    api_retries: int = DEFAULT_BATCH_RETRIES,
+) -> Iterator[Dict]:
+    """
+    并发执行批量请求，按完成顺序产出结果
+
+    所有请求共用一个连接池会话；输入按需读取，同时在途的请求不超过 concurrency 的两倍，
+    stdin 等长输入不会被一次读入内存。每条结果带有输入序号 index（以及输入中的 id），
+    成功时含 content、elapsed、attempts，失败时含 error 和 message。
+    """
+    session = create_retry_session(pool_maxsize=concurrency)
+    limiter = ratelimit.RateLimiter(requests_per_minute) if requests_per_minute else None
+
+    def run_one(index: int, record: Dict) -> Dict:
+        params = dict(defaults, **record)
+        params.pop("id", None)
+        start = time.time()
+        result = {"index": index}
+        if "id" in record:
+            result["id"] = record["id"]
+        try:
+            content, attempts = _call_with_retries(params, session, limiter, api_retries)
+            result.update(ok=True, content=content, attempts=attempts)
+        except Exception as e:
+            # 单条请求的任何异常（包括参数值无效）只记为该条的错误结果，不中断整个批处理
+            result.update(ok=False, error=type(e).__name__, message=str(e))
+        result["elapsed"] = round(time.time() - start, 3)
+        return result
+
+    records = iter(records)
+    pending = set()
+    exhausted = False
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while pending or not exhausted:
+            while not exhausted and len(pending) < concurrency * 2:
+                item = next(records, None)
+                if item is None:
+                    exhausted = True
+                    break
+                index, record = item
+                if isinstance(record, Exception):
+                    yield {"index": index, "ok": False, "error": "InvalidRequestError",
+                           "message": str(record)}
+                    continue
+                pending.add(executor.submit(run_one, index, record))
+            if not pending:
+                continue
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+def _batch_main(args, defaults: Dict) -> int:
+    """批处理模式入口：结果逐行写入 JSONL，返回失败条数"""
+    source: TextIO = sys.stdin if args.batch == "-" else open(args.batch, "r", encoding="utf-8")
+    out: TextIO = (sys.stdout if args.batch_output in (None, "-")
+                   else open(args.batch_output, "w", encoding="utf-8"))
+    total = failed = 0
+    try:
+        for result in run_batch(read_batch(source), defaults, args.concurrency,
+                                args.rpm, args.api_retries):
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            out.flush()
+            total += 1
+            failed += not result["ok"]
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if out is not sys.stdout:
+            out.close()
+    logger.info(f"批处理完成: {total} 条, 失败 {failed} 条")
+    return failed
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     
@@ -303,6 +460,7 @@ if __name__ == "__main__":
     parser.add_argument('--logprobs', type=str_to_bool)
     parser.add_argument('--enable_web_search', type=str_to_bool)
     parser.add_argument('--deep_thought', type=str_to_bool)
+    parser.add_argument('--include_reasoning', type=str_to_bool)
     
     # 修复数字参数
     parser.add_argument('--max_tokens', type=int)
@@ -340,10 +498,29 @@ if __name__ == "__main__":
     parser.add_argument('--timeout', type=float)
     parser.add_argument('--stream_timeout', type=float)
     
+    # 批处理模式：从 JSONL 文件或标准输入读取多条请求，上面的参数作为每条请求的默认值
+    parser.add_argument('--batch', type=str,
+                        help="批量请求的 JSONL 文件路径，- 表示标准输入；每行为含 prompt 及请求参数的 JSON 对象")
+    parser.add_argument('--batch_output', type=str,
+                        help="批处理结果的 JSONL 文件路径，按完成顺序写入 (默认: 标准输出)")
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_BATCH_CONCURRENCY,
+                        help=f"批处理的并发请求数 (默认: {DEFAULT_BATCH_CONCURRENCY})")
+    parser.add_argument('--rpm', type=float, help="批处理每分钟最多发出的请求数 (默认: 不限)")
+    parser.add_argument('--api_retries', type=int, default=DEFAULT_BATCH_RETRIES,
+                        help=f"批处理中限流、超时等可重试错误的重试次数 (默认: {DEFAULT_BATCH_RETRIES})")
+    
     args = parser.parse_args()
     
+    if args.batch:
+        batch_options = ('batch', 'batch_output', 'concurrency', 'rpm', 'api_retries', 'prompt', 'stream')
+        defaults = {k: v for k, v in vars(args).items() if v is not None and k not in batch_options}
+        if 'api_key' not in defaults:
+            parser.error("批处理模式需要提供 --api_key")
+        sys.exit(1 if _batch_main(args, defaults) else 0)
+    
     # 收集非空参数
-    kwargs = {k: v for k, v in vars(args).items() if v is not None}
+    batch_options = ('batch', 'batch_output', 'concurrency', 'rpm', 'api_retries')
+    kwargs = {k: v for k, v in vars(args).items() if v is not None and k not in batch_options}
     
     # API_KEY = "sk-***"
     print("API 已调用...")
@@ -356,8 +533,11 @@ if __name__ == "__main__":
         
         if kwargs.get('stream', False):
             # 流式响应处理
-            full_response = save_stream_thoughts("temp\\temp_results.txt", response)
+            reasoning_path = "temp\\temp_reasoning.txt" if kwargs.get('include_reasoning') else None
+            full_response = save_stream_thoughts("temp\\temp_results.txt", response, reasoning_path)
             print("最终结果已保存至 temp\\temp_results.txt")
+            if reasoning_path:
+                print(f"思考过程已保存至 {reasoning_path}")
         else:
             # 非流式响应处理
             save_file("temp\\temp_results.txt", response)  
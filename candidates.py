@@ -0,0 +1,87 @@
+import re
+from typing import List, Dict, Optional, Iterable
+
+from mdtext import count_visible_chars
+from retrieval import char_ngrams
+
+# 综合得分中各项的权重；没有探针文本时验证得分的权重按比例分摊给其余两项
+COMPLIANCE_WEIGHT = 0.5
+BOLD_WEIGHT = 0.3
+VALIDATION_WEIGHT = 0.2
+
+_BOLD = re.compile(r'(\*\*|__)(.+?)\1')
+
+def extract_bold_terms(text: Optional[str]) -> List[str]:
+    """提取 Markdown 中加粗的关键术语（去重并保持顺序）"""
+    if not text:
+        return []
+    seen = {}
+    for match in _BOLD.finditer(text):
+        term = match.group(2).strip()
+        if term and term.lower() not in seen:
+            seen[term.lower()] = term
+    return list(seen.values())
+
+def length_compliance(visible_chars: int, limit: int) -> float:
+    """字数合规得分：不超过限制得 1，超出部分按比例扣分，超出一倍及以上得 0"""
+    if limit <= 0 or visible_chars <= limit:
+        return 1.0
+    return max(0.0, 1.0 - (visible_chars - limit) / limit)
+
+def term_coverage(text: str, terms: Iterable[str]) -> float:
+    """加粗术语覆盖率：候选中保留了多少个上一轮的关键术语"""
+    terms = list(terms)
+    if not terms:
+        return 1.0
+    lowered = text.lower()
+    return sum(1 for t in terms if t.lower() in lowered) / len(terms)
+
+def probe_coverage(text: str, probes: Iterable[str]) -> Optional[float]:
+    """
+    廉价的本地验证得分：探针文本（题目或原文小节标题）的字符 n-gram 在候选中出现的比例
+
+    没有探针时返回 None。
+    """
+    grams = set(char_ngrams(text))
+    scores = []
+    for probe in probes:
+        probe_grams = set(char_ngrams(probe))
+        if probe_grams:
+            scores.append(len(probe_grams & grams) / len(probe_grams))
+    return sum(scores) / len(scores) if scores else None
+
+def score_candidate(text: str, limit: int, key_terms: List[str], probes: List[str]) -> Dict:
+    """计算单个候选摘要的各项得分及综合得分"""
+    visible = count_visible_chars(text)
+    compliance = length_compliance(visible, limit)
+    coverage = term_coverage(text, key_terms)
+    validation = probe_coverage(text, probes)
+    if validation is None:
+        scale = 1.0 / (COMPLIANCE_WEIGHT + BOLD_WEIGHT)
+        total = (COMPLIANCE_WEIGHT * compliance + BOLD_WEIGHT * coverage) * scale
+    else:
+        total = (COMPLIANCE_WEIGHT * compliance + BOLD_WEIGHT * coverage
+                 + VALIDATION_WEIGHT * validation)
+    return {
+        "visible_chars": visible,
+        "compliance": round(compliance, 4),
+        "bold_coverage": round(coverage, 4),
+        "validation": None if validation is None else round(validation, 4),
+        "score": round(total, 4),
+    }
+
+def rank_candidates(candidates: List[str], limit: int, key_terms: List[str],
+                    probes: List[str]) -> List[Dict]:
+    """
+    对候选摘要打分排序
+
+    返回按综合得分从高到低排列的列表，每项包含 index（候选编号）和各项得分；
+    得分相同时优先字数更少的候选。
+    """
+    scored = []
+    for index, text in enumerate(candidates):
+        entry = score_candidate(text, limit, key_terms, probes)
+        entry["index"] = index
+        scored.append(entry)
+    scored.sort(key=lambda e: (-e["score"], e["visible_chars"]))
+    return scored
@@ -0,0 +1,252 @@
+import collections
+import gzip
+import hashlib
+import json
+import threading
+import time
+import logging
+from typing import Optional, Dict, List, Any, Iterator
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+logger = logging.getLogger("DeepSeekAPI")
+
+CASSETTE_VERSION = 1
+# 回放时保留的响应头
+KEPT_HEADERS = ("Content-Type", "Retry-After")
+
+class CassetteMiss(requests.exceptions.RequestException):
+    """回放时磁带中没有与请求匹配的记录"""
+
+def _open(path: str, mode: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+def request_key(request: requests.PreparedRequest) -> str:
+    """
+    请求的匹配键：方法、URL 路径和规范化后的 JSON 请求体
+
+    不含主机名和请求头，更换 API 地址或 API key 不影响匹配。
+    """
+    body = request.body or b""
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    try:
+        body = json.dumps(json.loads(body), sort_keys=True, ensure_ascii=False).encode("utf-8")
+    except ValueError:
+        pass
+    digest = hashlib.sha256()
+    digest.update(f"{request.method} {urlparse(request.url).path}\n".encode("utf-8"))
+    digest.update(body)
+    return digest.hexdigest()
+
+def _describe(request: requests.PreparedRequest) -> Dict[str, Any]:
+    """记录中便于人工查看的请求摘要：模型和用户消息开头"""
+    try:
+        payload = json.loads(request.body or b"{}")
+        user = [m["content"] for m in payload.get("messages", []) if m.get("role") == "user"]
+        return {"model": payload.get("model"), "prompt": (user[-1] if user else "")[:80]}
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return {}
+
+class _RecordingRaw:
+    """包装底层响应流，逐块记录收到的数据及其相对请求开始的时间"""
+
+    def __init__(self, raw, entry: Dict[str, Any], start: float, on_done):
+        self._raw = raw
+        self._entry = entry
+        self._start = start
+        self._on_done = on_done
+        self._done = False
+
+    def _record(self, chunk: bytes) -> None:
+        if chunk:
+            self._entry["chunks"].append([
+                round(time.monotonic() - self._start, 3),
+                chunk.decode("utf-8", errors="surrogateescape"),
+            ])
+
+    def _finish(self) -> None:
+        if not self._done:
+            self._done = True
+            self._on_done(self._entry)
+
+    def stream(self, amt: int = 2 ** 16, decode_content: Optional[bool] = None) -> Iterator[bytes]:
+        try:
+            for chunk in self._raw.stream(amt, decode_content=True):
+                self._record(chunk)
+                yield chunk
+        finally:
+            self._finish()
+
+    def read(self, amt: Optional[int] = None, *args, **kwargs) -> bytes:
+        chunk = self._raw.read(amt, decode_content=True)
+        self._record(chunk)
+        if not chunk or amt is None:
+            self._finish()
+        return chunk
+
+    def close(self) -> None:
+        # 提前关闭（如长度守卫中止）时保留已收到的部分
+        self._finish()
+        self._raw.close()
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+class RecordingAdapter(HTTPAdapter):
+    """
+    录制模式的传输适配器：照常发送请求，同时把请求键、状态码、响应数据块及时间写入磁带
+
+    磁带为 JSONL 文件（以 .gz 结尾时使用 gzip 压缩），每条响应在读取完毕或连接关闭时写入。
+    """
+
+    def __init__(self, path: str, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self._lock = threading.Lock()
+        self.recorded = 0
+        with _open(path, "w") as f:
+            f.write(json.dumps({"version": CASSETTE_VERSION, "created": time.time()}) + "\n")
+
+    def _write(self, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            with _open(self.path, "a") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self.recorded += 1
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        entry: Dict[str, Any] = {"key": request_key(request), **_describe(request), "chunks": []}
+        start = time.monotonic()
+        try:
+            response = super().send(request, stream=True, timeout=timeout, verify=verify,
+                                    cert=cert, proxies=proxies)
+        except requests.exceptions.RequestException as e:
+            entry["error"] = "timeout" if isinstance(e, requests.exceptions.Timeout) else "connection"
+            entry["message"] = str(e)
+            entry["elapsed"] = round(time.monotonic() - start, 3)
+            self._write(entry)
+            raise
+        entry["status"] = response.status_code
+        entry["headers"] = {k: response.headers[k] for k in KEPT_HEADERS if k in response.headers}
+        entry["elapsed"] = round(time.monotonic() - start, 3)
+        response.raw = _RecordingRaw(response.raw, entry, start, self._write)
+        return response
+
+class _ReplayRaw:
+    """按记录的数据块回放响应流；speed 为 None 时立即返回，否则按记录时间的 1/speed 等待"""
+
+    def __init__(self, chunks: List[list], start: float, speed: Optional[float]):
+        self._chunks = collections.deque(chunks)
+        self._start = start
+        self._speed = speed
+        self.closed = False
+
+    def _next(self) -> Optional[bytes]:
+        if self.closed or not self._chunks:
+            return None
+        offset, text = self._chunks.popleft()
+        if self._speed:
+            delay = offset / self._speed - (time.monotonic() - self._start)
+            if delay > 0:
+                time.sleep(delay)
+        return text.encode("utf-8", errors="surrogateescape")
+
+    def stream(self, amt: int = 2 ** 16, decode_content: Optional[bool] = None) -> Iterator[bytes]:
+        while True:
+            chunk = self._next()
+            if chunk is None:
+                return
+            yield chunk
+
+    def read(self, amt: Optional[int] = None, *args, **kwargs) -> bytes:
+        if amt is None:
+            return b"".join(self.stream())
+        return self._next() or b""
+
+    def close(self) -> None:
+        self.closed = True
+
+    def release_conn(self) -> None:
+        pass
+
+class ReplayAdapter(BaseAdapter):
+    """
+    回放模式的传输适配器：不访问网络，按请求键返回磁带中记录的响应
+
+    相同请求多次出现时按录制顺序依次返回；没有匹配记录时抛出 CassetteMiss。
+    """
+
+    def __init__(self, path: str, speed: Optional[float] = None):
+        super().__init__()
+        self.path = path
+        self.speed = speed
+        self._entries: Dict[str, collections.deque] = collections.defaultdict(collections.deque)
+        self._lock = threading.Lock()
+        self.served = 0
+        with _open(path, "r") as f:
+            header = json.loads(f.readline() or "{}")
+            if header.get("version") != CASSETTE_VERSION:
+                raise ValueError(f"不支持的磁带版本: {header.get('version')}")
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._entries[entry["key"]].append(entry)
+        logger.info(f"已载入磁带 {path}: {sum(len(q) for q in self._entries.values())} 条记录")
+
+    def remaining(self) -> int:
+        with self._lock:
+            return sum(len(q) for q in self._entries.values())
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        key = request_key(request)
+        with self._lock:
+            queue = self._entries.get(key)
+            entry = queue.popleft() if queue else None
+            if entry is not None:
+                self.served += 1
+        if entry is None:
+            raise CassetteMiss(
+                f"磁带 {self.path} 中没有匹配的请求（{_describe(request).get('prompt', '')!r}），"
+                "回放时的参数需与录制时一致", request=request
+            )
+        start = time.monotonic()
+        if self.speed and entry.get("elapsed"):
+            time.sleep(entry["elapsed"] / self.speed)
+        if "error" in entry:
+            cls = (requests.exceptions.ReadTimeout if entry["error"] == "timeout"
+                   else requests.exceptions.ConnectionError)
+            raise cls(entry.get("message", "回放的请求错误"), request=request)
+
+        response = requests.Response()
+        response.status_code = entry["status"]
+        response.headers = CaseInsensitiveDict(entry.get("headers") or {})
+        response.encoding = "utf-8"
+        response.url = request.url
+        response.request = request
+        response.reason = "Replayed"
+        response.raw = _ReplayRaw(entry["chunks"], start, self.speed)
+        return response
+
+    def close(self) -> None:
+        pass
+
+def recording_session(path: str) -> requests.Session:
+    """创建录制用的会话；配合 fix.configure_transport(session=...) 使用"""
+    session = requests.Session()
+    adapter = RecordingAdapter(path)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def replay_session(path: str, speed: Optional[float] = None) -> requests.Session:
+    """创建回放用的会话；speed 为 None 或 0 时立即返回，1 为按录制速度"""
+    session = requests.Session()
+    adapter = ReplayAdapter(path, speed or None)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
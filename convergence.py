@@ -0,0 +1,103 @@
+import math
+from typing import Optional, List, Dict, Tuple
+
+DEFAULT_TARGET_ACCURACY = 1.0
+DEFAULT_PATIENCE = 2
+DEFAULT_MIN_DELTA = 0.02
+DEFAULT_CI_HALF_WIDTH = 0.1
+DEFAULT_MIN_PROBLEMS = 5
+DEFAULT_MAX_PROBLEMS = 100
+Z_95 = 1.96
+
+def wilson_interval(correct: int, total: int, z: float = Z_95) -> Tuple[float, float]:
+    """正确率的 Wilson 置信区间"""
+    if total <= 0:
+        return 0.0, 1.0
+    p = correct / total
+    denom = 1 + z * z / total
+    center = (p + z * z / (2 * total)) / denom
+    half = z * math.sqrt(p * (1 - p) / total + z * z / (4 * total * total)) / denom
+    return max(0.0, center - half), min(1.0, center + half)
+
+class ConvergenceController:
+    """
+    验证循环的收敛控制器
+
+    每轮验证后调用 update()；正确率达到目标、或连续 patience 轮没有超过历史最佳
+    min_delta 以上时，should_stop() 返回 True。next_problem_count() 根据当前正确率
+    估计使置信区间半宽达到 ci_half_width 所需的题目数量。
+    """
+
+    def __init__(self, target_accuracy: float = DEFAULT_TARGET_ACCURACY,
+                 patience: int = DEFAULT_PATIENCE, min_delta: float = DEFAULT_MIN_DELTA,
+                 ci_half_width: float = DEFAULT_CI_HALF_WIDTH,
+                 min_problems: int = DEFAULT_MIN_PROBLEMS,
+                 max_problems: int = DEFAULT_MAX_PROBLEMS):
+        self.target_accuracy = target_accuracy
+        self.patience = patience
+        self.min_delta = min_delta
+        self.ci_half_width = ci_half_width
+        self.min_problems = min_problems
+        self.max_problems = max_problems
+        self.history: List[Dict] = []
+        self.best_index: Optional[int] = None
+        self.stale = 0
+        self.stop_reason: Optional[str] = None
+
+    @property
+    def best(self) -> Optional[Dict]:
+        return None if self.best_index is None else self.history[self.best_index]
+
+    def update(self, correct: int, total: int, summary: Optional[str] = None) -> Dict:
+        """记录一轮验证结果，summary 为本轮被测试的摘要"""
+        accuracy = correct / total if total else 0.0
+        low, high = wilson_interval(correct, total)
+        entry = {
+            "loop": len(self.history) + 1,
+            "correct": correct,
+            "total": total,
+            "accuracy": round(accuracy, 4),
+            "ci": [round(low, 4), round(high, 4)],
+            "summary": summary,
+        }
+        self.history.append(entry)
+
+        best = self.best
+        if best is None or accuracy > best["accuracy"] + self.min_delta:
+            self.best_index = len(self.history) - 1
+            self.stale = 0
+        else:
+            if accuracy > best["accuracy"]:
+                self.best_index = len(self.history) - 1
+            self.stale += 1
+
+        if total and accuracy >= self.target_accuracy:
+            self.stop_reason = f"正确率 {accuracy:.0%} 已达到目标 {self.target_accuracy:.0%}"
+        elif self.patience > 0 and self.stale >= self.patience:
+            self.stop_reason = f"连续 {self.stale} 轮正确率未提升"
+        else:
+            self.stop_reason = None
+        return entry
+
+    def should_stop(self) -> bool:
+        return self.stop_reason is not None
+
+    def next_problem_count(self, current: int) -> int:
+        """按当前正确率估计下一轮所需题目数，使置信区间半宽约为 ci_half_width"""
+        if not self.history or self.ci_half_width <= 0:
+            return current
+        last = self.history[-1]
+        # 加一平滑，避免正确率为 0 或 1 时方差为 0
+        p = (last["correct"] + 1) / (last["total"] + 2)
+        needed = math.ceil(Z_95 * Z_95 * p * (1 - p) / (self.ci_half_width ** 2))
+        return max(self.min_problems, min(self.max_problems, needed))
+
+    def report(self) -> Dict:
+        """供保存的收敛记录（不含摘要正文）"""
+        return {
+            "target_accuracy": self.target_accuracy,
+            "patience": self.patience,
+            "stop_reason": self.stop_reason,
+            "best_loop": None if self.best is None else self.best["loop"],
+            "history": [{k: v for k, v in h.items() if k != "summary"} for h in self.history],
+        }
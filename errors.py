@@ -0,0 +1,90 @@
+import json
+from typing import Optional
+
+import requests
+
+class DeepSeekAPIError(Exception):
+    """
+    DeepSeek API 调用失败
+
+    retryable 表示稍后重试是否可能成功；status_code 为 HTTP 状态码（若有），
+    retry_after 为服务端建议的等待秒数（若有）。
+    """
+    retryable = False
+
+    def __init__(self, message: str, status_code: Optional[int] = None,
+                 retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+class RateLimitError(DeepSeekAPIError):
+    """请求过于频繁（HTTP 429）"""
+    retryable = True
+
+class APITimeoutError(DeepSeekAPIError):
+    """连接或读取超时，包括流式响应停顿"""
+    retryable = True
+
+class ServerError(DeepSeekAPIError):
+    """服务端错误（HTTP 5xx）或连接中断"""
+    retryable = True
+
+class MalformedResponseError(DeepSeekAPIError):
+    """响应不是预期的 JSON 结构"""
+    retryable = True
+
+class CancelledError(DeepSeekAPIError):
+    """调用所属的任务已被取消"""
+
+class AuthenticationError(DeepSeekAPIError):
+    """API 密钥无效或无权限（HTTP 401/403）"""
+
+class InsufficientBalanceError(DeepSeekAPIError):
+    """账户余额不足（HTTP 402）"""
+
+class InvalidRequestError(DeepSeekAPIError):
+    """请求参数错误（HTTP 400/404/422 等）"""
+
+def _retry_after(response: Optional[requests.Response]) -> Optional[float]:
+    if response is None:
+        return None
+    value = response.headers.get("Retry-After")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+def from_http_status(status: int, message: str,
+                     response: Optional[requests.Response] = None) -> DeepSeekAPIError:
+    """按 HTTP 状态码映射为对应的异常类型"""
+    if status == 429:
+        cls = RateLimitError
+    elif status in (401, 403):
+        cls = AuthenticationError
+    elif status == 402:
+        cls = InsufficientBalanceError
+    elif status == 408:
+        cls = APITimeoutError
+    elif status >= 500:
+        cls = ServerError
+    else:
+        cls = InvalidRequestError
+    return cls(message, status_code=status, retry_after=_retry_after(response))
+
+def from_request_exception(e: Exception) -> DeepSeekAPIError:
+    """将 requests 抛出的异常转换为带重试分类的 DeepSeekAPIError"""
+    message = f"API请求错误: {str(e)}"
+    if isinstance(e, json.JSONDecodeError):
+        return MalformedResponseError(f"JSON解析错误: {str(e)}")
+    if isinstance(e, requests.exceptions.HTTPError) and e.response is not None:
+        return from_http_status(e.response.status_code, message, e.response)
+    if isinstance(e, requests.exceptions.Timeout):
+        return APITimeoutError(message)
+    if isinstance(e, requests.exceptions.RetryError):
+        # urllib3 已按状态码重试多次仍失败
+        return ServerError(message)
+    if isinstance(e, (requests.exceptions.ConnectionError,
+                      requests.exceptions.ChunkedEncodingError)):
+        return ServerError(message)
+    return DeepSeekAPIError(message)
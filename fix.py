@@ -5,9 +5,20 @@ import json
 import logging
 import sys
 import argparse
+import time
+import threading
+import contextvars
+import telemetry
+import hedge
+import ratelimit
+import routing
+import errors
+import tracing
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
-from typing import Optional, Union, List, Dict, Generator
+from collections import defaultdict
+from contextlib import nullcontext
+from typing import Optional, Union, List, Dict, Generator, Callable
 
 # 设置日志
 logging.basicConfig(level=logging.INFO)
@@ -18,6 +29,7 @@ def create_retry_session(
     backoff_factor: float = 0.3,
     status_forcelist: tuple = (500, 502, 504),
     session: Optional[requests.Session] = None,
+    pool_maxsize: int = 10,
 ) -> requests.Session:
     """创建带有重试机制的请求会话"""
     session = session or requests.Session()
@@ -28,11 +40,262 @@ def create_retry_session(
         backoff_factor=backoff_factor,
         status_forcelist=status_forcelist,
     )
-    adapter = HTTPAdapter(max_retries=retry)
+    adapter = HTTPAdapter(max_retries=retry, pool_maxsize=pool_maxsize)
     session.mount('http://', adapter)
     session.mount('https://', adapter)
     return session
 
+# 内部流式传输的默认超时（秒）：连接、等待首个 token、两个数据块之间的最大间隔
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_FIRST_TOKEN_TIMEOUT = 180
+DEFAULT_IDLE_TIMEOUT = 60
+DEFAULT_STALL_RETRIES = 2
+DEFAULT_API_RETRIES = 2
+DEFAULT_API_RETRY_DELAY = 2
+PROGRESS_INTERVAL = 5
+# 分节修复时每节的最大字符数（按页合并，只在页边界切分）
+DEFAULT_SECTION_CHARS = 8000
+
+_transport = {
+    "streaming": False,
+    "connect_timeout": DEFAULT_CONNECT_TIMEOUT,
+    "first_token_timeout": DEFAULT_FIRST_TOKEN_TIMEOUT,
+    "idle_timeout": DEFAULT_IDLE_TIMEOUT,
+    "stall_retries": DEFAULT_STALL_RETRIES,
+    # 未显式传入 session 的调用共用的会话（如服务进程中的连接池），None 表示每次调用各自创建
+    "session": None,
+}
+
+# 当前上下文所属任务的取消事件；服务在执行任务的线程中设置
+_cancel_event: contextvars.ContextVar[Optional[threading.Event]] = contextvars.ContextVar(
+    "cancel_event", default=None
+)
+
+def configure_transport(**options) -> None:
+    """
+    设置非流式调用的内部传输方式
+
+    streaming 为 True 时，非流式调用在内部以流式请求完成，并分别施加连接、首个 token
+    和数据块间隔超时；停顿的请求会立即重试。其余可选项见 _transport。
+    """
+    for key, value in options.items():
+        if key not in _transport:
+            raise ValueError(f"未知的传输选项: {key}")
+        if value is not None:
+            _transport[key] = value
+
+def bind_cancel_event(event: Optional[threading.Event]) -> contextvars.Token:
+    """为当前上下文设置取消事件；事件被设置后，后续及进行中的流式调用抛出 CancelledError"""
+    return _cancel_event.set(event)
+
+def check_cancelled() -> None:
+    event = _cancel_event.get()
+    if event is not None and event.is_set():
+        raise errors.CancelledError("任务已取消")
+
+class StreamStalled(requests.exceptions.ReadTimeout):
+    """流式响应在首个 token 之前或两个数据块之间停顿超时"""
+
+class GenerationAborted(Exception):
+    """on_delta 回调主动中止生成；partial 为中止时已收到的正文"""
+
+    def __init__(self, message: str = "", partial: str = ""):
+        super().__init__(message)
+        self.partial = partial
+
+def log_progress(stats: Dict) -> None:
+    """默认的流式进度输出"""
+    logger.info(
+        f"流式接收中: {stats['bytes'] / 1024:.1f} KB, {stats['tokens']} tokens, "
+        f"{stats['tokens_per_second']:.1f} tokens/s"
+    )
+
+class _Cancellation:
+    """
+    请求的取消登记，在发送请求前写入 handle["cancel"]，供对冲时取消落败的一方
+
+    收到响应头之前被取消的，响应到达后立即关闭连接并抛出 CancelledError；之后被取消的
+    直接关闭响应连接。提供 session（对冲的备份请求使用的独立会话）时，取消时一并关闭该会话。
+    """
+
+    def __init__(self, session: Optional[requests.Session] = None):
+        self._lock = threading.Lock()
+        self.cancelled = False
+        self.response = None
+        self.session = session
+
+    @classmethod
+    def for_handle(cls, handle: Dict, session: Optional[requests.Session] = None) -> "_Cancellation":
+        """返回 handle 上已登记的取消对象，没有时新建并登记"""
+        cancellation = handle.get("cancellation")
+        if cancellation is None:
+            cancellation = handle["cancellation"] = cls(session)
+            handle["cancel"] = cancellation.cancel
+        return cancellation
+
+    def cancel(self) -> None:
+        with self._lock:
+            self.cancelled = True
+            response = self.response
+        if response is not None:
+            response.close()
+        if self.session is not None:
+            self.session.close()
+
+    def attach(self, response: requests.Response) -> None:
+        """登记收到的响应；此前已被取消时关闭连接并抛出 CancelledError"""
+        with self._lock:
+            self.response = response
+            cancelled = self.cancelled
+        if cancelled:
+            response.close()
+            raise errors.CancelledError("另一份对冲请求已完成，取消本请求")
+
+def stream_completion(
+    session: requests.Session,
+    url: str,
+    headers: Dict,
+    data: Dict,
+    handle: Dict,
+    connect_timeout: float,
+    first_token_timeout: float,
+    idle_timeout: float,
+    on_progress: Optional[Callable[[Dict], None]] = log_progress,
+    on_delta: Optional[Callable[[str], None]] = None,
+) -> Dict:
+    """
+    以流式方式完成一次请求，并拼装为与非流式响应相同结构的结果
+
+    看门狗线程在首个 token 超时或数据块间隔超时时关闭连接并抛出 StreamStalled；
+    reasoning_content 与 content 分别累积。tokens 按收到的增量块数估算。
+    on_delta 逐块接收正文，可抛出 GenerationAborted 中止生成（连接随即关闭）。
+    """
+    payload = dict(data, stream=True, stream_options={"include_usage": True})
+    start = time.time()
+    state = {"first": None, "last": start, "stalled": None}
+    cancellation = _Cancellation.for_handle(handle)
+    response = session.post(
+        url,
+        headers=headers,
+        json=payload,
+        stream=True,
+        timeout=(connect_timeout, max(first_token_timeout, idle_timeout))
+    )
+    cancellation.attach(response)
+    response.raise_for_status()
+
+    finished = threading.Event()
+
+    def watchdog():
+        while not finished.wait(0.5):
+            now = time.time()
+            if state["first"] is None and now - start > first_token_timeout:
+                state["stalled"] = f"{first_token_timeout} 秒内未收到首个 token"
+            elif state["first"] is not None and now - state["last"] > idle_timeout:
+                state["stalled"] = f"超过 {idle_timeout} 秒未收到新的数据块"
+            else:
+                continue
+            response.close()
+            return
+
+    threading.Thread(target=watchdog, daemon=True).start()
+
+    contents = defaultdict(list)
+    reasoning = defaultdict(list)
+    finish_reasons = {}
+    usage = None
+    stats = {"bytes": 0, "tokens": 0, "elapsed": 0.0, "tokens_per_second": 0.0}
+    last_report = start
+    decode_seconds = 0.0
+    cancel_event = _cancel_event.get()
+    try:
+        for line in response.iter_lines():
+            if cancel_event is not None and cancel_event.is_set():
+                raise errors.CancelledError("任务已取消")
+            stats["bytes"] += len(line) + 1
+            if not line:
+                continue
+            decoded_line = line.decode('utf-8')
+            if not decoded_line.startswith('data:'):
+                # 保活注释行不算作进展
+                continue
+            json_str = decoded_line[5:].strip()
+            if json_str == "[DONE]":
+                break
+            decode_start = time.perf_counter()
+            try:
+                chunk = json.loads(json_str)
+            except json.JSONDecodeError:
+                logger.warning("JSON解析错误，跳过数据块")
+                continue
+            finally:
+                decode_seconds += time.perf_counter() - decode_start
+            if chunk.get("usage"):
+                usage = chunk["usage"]
+            for choice in chunk.get("choices") or []:
+                index = choice.get("index", 0)
+                delta = choice.get("delta") or {}
+                if choice.get("finish_reason"):
+                    finish_reasons[index] = choice["finish_reason"]
+                progressed = False
+                if delta.get("content"):
+                    contents[index].append(str(delta["content"]))
+                    progressed = True
+                    if on_delta is not None:
+                        try:
+                            on_delta(str(delta["content"]))
+                        except GenerationAborted as e:
+                            e.partial = "".join(contents[index])
+                            raise
+                if delta.get("reasoning_content"):
+                    reasoning[index].append(str(delta["reasoning_content"]))
+                    progressed = True
+                if progressed:
+                    now = time.time()
+                    if state["first"] is None:
+                        state["first"] = now
+                    state["last"] = now
+                    stats["tokens"] += 1
+
+            now = time.time()
+            if on_progress and now - last_report >= PROGRESS_INTERVAL:
+                last_report = now
+                stats["elapsed"] = now - start
+                stats["tokens_per_second"] = stats["tokens"] / max(now - (state["first"] or now), 1e-6)
+                on_progress(dict(stats))
+    except Exception as e:
+        if state["stalled"]:
+            raise StreamStalled(state["stalled"]) from e
+        if isinstance(e, requests.exceptions.RequestException):
+            # 读取超时或连接中断同样视为停顿
+            raise StreamStalled(f"流式读取中断: {str(e)}") from e
+        raise
+    finally:
+        finished.set()
+        response.close()
+        # 数据块逐个解析，与网络等待交错进行，解析耗时记为所在区间的参数
+        tracing.annotate(json_decode_ms=round(decode_seconds * 1000, 3), bytes=stats["bytes"])
+    if state["stalled"]:
+        raise StreamStalled(state["stalled"])
+
+    indices = sorted(set(contents) | set(reasoning) | set(finish_reasons))
+    return {
+        "choices": [
+            {
+                "index": i,
+                "message": {
+                    "role": "assistant",
+                    "content": "".join(contents[i]),
+                    "reasoning_content": "".join(reasoning[i]),
+                },
+                "finish_reason": finish_reasons.get(i),
+            }
+            for i in indices
+        ],
+        "usage": usage,
+    }
+
+@tracing.traced()
 def call_deepseek_api(
     prompt: str,
     api_key: str,
@@ -58,9 +321,41 @@ def call_deepseek_api(
     session: Optional[requests.Session] = None,
     retries: int = 3,
     backoff_factor: float = 0.3,
+    context_prefix: Optional[str] = None,
+    stage: Optional[str] = None,
+    stream_transport: Optional[bool] = None,
+    on_progress: Optional[Callable[[Dict], None]] = log_progress,
+    on_delta: Optional[Callable[[str], None]] = None,
+    api_retries: int = DEFAULT_API_RETRIES,
     **kwargs
 ) -> Union[str, List[str], Generator[str, None, None]]:
+    """
+    调用 DeepSeek Chat Completions 接口
+
+    context_prefix 作为第一条消息发送，用于放置多次调用间字节一致的大段内容
+    （如课程原文），以命中服务端上下文缓存；stage 用于遥测记录，并决定是否适用
+    hedge.configure() 设置的对冲策略。stream_transport 为 None 时沿用
+    configure_transport() 的设置，为真时非流式调用在内部以流式请求完成，
+    on_progress 接收接收进度。提供 on_delta 时强制使用内部流式传输，
+    回调抛出的 GenerationAborted 会原样向上抛出。
+
+    失败时抛出 errors.DeepSeekAPIError 的子类；可重试的错误（限流、超时、服务端错误、
+    响应格式错误）最多重试 api_retries 次，其余错误立即抛出。
+    routing.configure() 设置了路由表时，按 stage 替换 model、temperature 和 max_tokens。
+    tracing.configure() 启用追踪时，整次调用及其中的网络等待、JSON 解析分别记为区间。
+    """
     
+    # 按阶段路由模型和参数，实际取值随遥测一并记录
+    table = routing.get_table()
+    if table is not None:
+        model, temperature, max_tokens = table.resolve(stage, model, temperature, max_tokens)
+    tracing.annotate(stage=stage, model=model)
+    route_info = {
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "routing": table.name if table is not None else None,
+    }
+
     url = "https://api.deepseek.com/v1/chat/completions"
     
     headers = {
@@ -70,7 +365,11 @@ def call_deepseek_api(
     
     # 构建消息系统
     messages = []
-    
+
+    # 添加稳定前缀（必须位于最前，保证跨调用字节一致）
+    if context_prefix:
+        messages.append({"role": "system", "content": context_prefix})
+
     # 添加系统消息（如果提供）
     if system_message:
         messages.append({"role": "system", "content": system_message})
@@ -113,94 +412,193 @@ def call_deepseek_api(
     if response_format is not None:
         data["response_format"] = response_format
     
+    # 流式响应在最后一个数据块中返回 usage，供遥测统计缓存命中
+    if stream:
+        data["stream_options"] = {"include_usage": True}
+    
     # 添加其他API参数
     data.update(kwargs)
     
-    try:
+    if session is None and _transport["session"] is not None:
+        # 共用会话已配置好重试，直接复用其连接池
+        session = _transport["session"]
+    else:
         # 创建带重试机制的会话
         session = create_retry_session(
             retries=retries,
             backoff_factor=backoff_factor,
             session=session
         )
-        
-        if stream:
-            # 流式处理 - 返回生成器
-            logger.info(f"发送流式请求到DeepSeek API，超时={stream_timeout}秒")
-            response = session.post(
-                url,
-                headers=headers,
-                json=data,
-                stream=True,
-                timeout=stream_timeout
-            )
-            response.raise_for_status()
+    limiter = ratelimit.get_limiter()
+    
+    attempt = 0
+    while True:
+        try:
+            check_cancelled()
+            start_time = time.time()
+            if stream:
+                # 流式处理 - 返回生成器
+                logger.info(f"发送流式请求到DeepSeek API，超时={stream_timeout}秒")
+                with limiter.slot() if limiter else nullcontext():
+                    response = session.post(
+                        url,
+                        headers=headers,
+                        json=data,
+                        stream=True,
+                        timeout=stream_timeout
+                    )
+                response.raise_for_status()
             
-            def content_generator():
-                for line in response.iter_lines():
-                    if line:
-                        decoded_line = line.decode('utf-8')
-                        if decoded_line.startswith('data:'):
-                            json_str = decoded_line[5:].strip()
-                            if json_str == "[DONE]":
-                                logger.info("流式响应完成")
-                                break
-                            try:
-                                chunk = json.loads(json_str)
-                                if "choices" in chunk and len(chunk["choices"]) > 0:
-                                    delta = chunk["choices"][0].get("delta", {})
-                                    if "content" in delta:
-                                        content = delta["content"]
-                                        # 确保内容始终是字符串且不为None
-                                        if content is None:
-                                            logger.debug("收到空内容块，跳过")
-                                            continue
-                                        content_str = str(content)
-                                        yield content_str
-                            except json.JSONDecodeError:
-                                logger.warning("JSON解析错误，跳过数据块")
-                                continue
+                def content_generator():
+                    for line in response.iter_lines():
+                        if line:
+                            decoded_line = line.decode('utf-8')
+                            if decoded_line.startswith('data:'):
+                                json_str = decoded_line[5:].strip()
+                                if json_str == "[DONE]":
+                                    logger.info("流式响应完成")
+                                    break
+                                try:
+                                    chunk = json.loads(json_str)
+                                    if chunk.get("usage"):
+                                        telemetry.record_call(
+                                            stage, model, time.time() - start_time,
+                                            usage=chunk["usage"], stream=True, **route_info
+                                        )
+                                    if "choices" in chunk and len(chunk["choices"]) > 0:
+                                        delta = chunk["choices"][0].get("delta", {})
+                                        if "content" in delta:
+                                            content = delta["content"]
+                                            # 确保内容始终是字符串且不为None
+                                            if content is None:
+                                                logger.debug("收到空内容块，跳过")
+                                                continue
+                                            content_str = str(content)
+                                            yield content_str
+                                except json.JSONDecodeError:
+                                    logger.warning("JSON解析错误，跳过数据块")
+                                    continue
                 
-            return content_generator()
+                return content_generator()
             
-        else:
-            # 非流式处理 - 返回字符串
-            logger.info(f"发送请求到DeepSeek API，超时={timeout}秒")
-            response = session.post(
-                url,
-                headers=headers,
-                json=data,
-                timeout=timeout
-            )
-            response.raise_for_status()
-            result = response.json()
+            else:
+                # 非流式处理 - 返回字符串
+                streaming = _transport["streaming"] if stream_transport is None else stream_transport
+                if on_delta is not None:
+                    streaming = True
+                if streaming:
+                    first_token_timeout = min(timeout, _transport["first_token_timeout"])
+                    idle_timeout = min(timeout, _transport["idle_timeout"])
+                    logger.info(
+                        f"发送请求到DeepSeek API（内部流式），首个 token 超时={first_token_timeout}秒，"
+                        f"数据块间隔超时={idle_timeout}秒"
+                    )
+                else:
+                    logger.info(f"发送请求到DeepSeek API，超时={timeout}秒")
             
-            # 处理多个响应
-            if n > 1:
-                responses = []
-                for choice in result['choices']:
-                    content = choice['message']['content']
-                    # 确保内容不为None
-                    if content is None:
-                        content = ""
-                    responses.append(str(content))
-                return responses
+                def post_completion(handle, attempt_session):
+                    with limiter.slot() if limiter else nullcontext():
+                        return _post_completion(handle, attempt_session)
             
-            content = result['choices'][0]['message']['content']
-            # 确保内容不为None
-            if content is None:
-                content = ""
-            return str(content)
+                def _post_completion(handle, attempt_session):
+                    if streaming:
+                        retries_left = _transport["stall_retries"]
+                        while True:
+                            try:
+                                with tracing.span("network", transport="stream"):
+                                    return stream_completion(
+                                        attempt_session, url, headers, data, handle,
+                                        _transport["connect_timeout"], first_token_timeout,
+                                        idle_timeout, on_progress, on_delta
+                                    )
+                            except StreamStalled as e:
+                                if retries_left <= 0:
+                                    raise
+                                retries_left -= 1
+                                logger.warning(f"流式响应停顿（{str(e)}），立即重试")
+                    with tracing.span("network", transport="plain") as span_args:
+                        # 发送前登记取消，对冲时另一份请求胜出则关闭连接以取消本请求
+                        cancellation = _Cancellation.for_handle(handle)
+                        response = attempt_session.post(
+                            url,
+                            headers=headers,
+                            json=data,
+                            stream=True,
+                            timeout=timeout
+                        )
+                        cancellation.attach(response)
+                        response.raise_for_status()
+                        # 先读完响应体，使网络等待与 JSON 解析分开计时
+                        span_args["bytes"] = len(response.content)
+                    with tracing.span("json_decode"):
+                        return response.json()
+            
+                policy = hedge.get_policy()
+                # 逐块回调带有状态，不能由两份对冲请求共享
+                hedged = (policy is not None and n == 1 and on_delta is None
+                          and policy.applies(stage))
+                if hedged:
+                    def hedged_attempt(handle):
+                        if not handle.get("backup"):
+                            # 首份请求沿用已配置的会话（连接池），不发对冲时与普通调用相同
+                            return post_completion(handle, session)
+                        # 备份请求使用独立会话，取消时关闭该会话，不影响共用的连接池
+                        backup_session = create_retry_session(retries=retries, backoff_factor=backoff_factor)
+                        _Cancellation.for_handle(handle, backup_session)
+                        try:
+                            return post_completion(handle, backup_session)
+                        finally:
+                            backup_session.close()
+                    
+                    result = policy.run(hedged_attempt, stage, model)
+                else:
+                    try:
+                        result = post_completion({}, session)
+                    except GenerationAborted as e:
+                        telemetry.record_call(
+                            stage, model, time.time() - start_time,
+                            aborted=True, partial_chars=len(e.partial), transport="stream",
+                            **route_info
+                        )
+                        raise
+                telemetry.record_call(
+                    stage, model, time.time() - start_time,
+                    usage=result.get("usage"), hedge_enabled=hedged,
+                    transport="stream" if streaming else "plain", **route_info
+                )
+            
+                # 处理多个响应
+                if n > 1:
+                    responses = []
+                    for choice in result['choices']:
+                        content = choice['message']['content']
+                        # 确保内容不为None
+                        if content is None:
+                            content = ""
+                        responses.append(str(content))
+                    return responses
             
-    except requests.exceptions.RequestException as e:
-        logger.error(f"API请求错误: {str(e)}")
-        return f"API请求错误: {str(e)}"
-    except (KeyError, IndexError):
-        logger.error("响应解析错误: 无效的API响应格式")
-        return "响应解析错误: 无效的API响应格式"
-    except json.JSONDecodeError:
-        logger.error("JSON解析错误: 无效的API响应格式")
-        return "JSON解析错误: 无效的API响应格式"
+                content = result['choices'][0]['message']['content']
+                # 确保内容不为None
+                if content is None:
+                    content = ""
+                return str(content)
+            
+        except requests.exceptions.RequestException as e:
+            error, cause = errors.from_request_exception(e), e
+        except (KeyError, IndexError, TypeError) as e:
+            error, cause = errors.MalformedResponseError("响应解析错误: 无效的API响应格式"), e
+        except json.JSONDecodeError as e:
+            error, cause = errors.MalformedResponseError("JSON解析错误: 无效的API响应格式"), e
+        
+        # 按错误类型决定重试或立即失败，不再把错误信息当作正常内容返回
+        if not error.retryable or attempt >= api_retries:
+            logger.error(f"{type(error).__name__}: {str(error)}")
+            raise error from cause
+        delay = error.retry_after or DEFAULT_API_RETRY_DELAY * (2 ** attempt)
+        attempt += 1
+        logger.warning(f"{type(error).__name__}: {str(error)}，{delay:.0f} 秒后重试（{attempt}/{api_retries}）")
+        time.sleep(delay)
 
 def save_file(path: str, content: str) -> None:
     """保存内容到文件"""
@@ -216,17 +614,61 @@ def save_file(path: str, content: str) -> None:
         f.write(content)
     logger.info(f"内容已保存至 {path}")
 
-def extract_text_from_pdf(pdf_path: str) -> str:
-    """从PDF文件中提取文本"""
+# 修复阶段的固定系统消息：位于请求最前部，所有修复请求共享同一缓存前缀
+REPAIR_SYSTEM_MESSAGE = "这些是一门课程的课件或者笔记，你需要注意：我们直接通过某种工具将其转换成了纯文本，可能会造成格式错误，乱码或者信息丢失，请务必先根据已有的知识进行修复，然后逐字逐句的以 Markdown 的格式输出，你需要用 $ 包裹公式而不是括号和斜杠，输出修复后的内容，不要进行包括概括，内容拓展等的任何操作！！！"
+
+@tracing.traced()
+def extract_page_texts(pdf_path: str) -> List[str]:
+    """逐页提取PDF文本"""
     doc = fitz.open(pdf_path)
-    full_text = []
+    pages = []
 
     for page in doc:
         text = page.get_text("text")  # 提取格式化文本（包括中文、代码缩进）
-        full_text.append(text)
+        pages.append(text)
 
     doc.close()
-    return "\n".join(full_text)
+    return pages
+
+def extract_text_from_pdf(pdf_path: str) -> str:
+    """从PDF文件中提取文本"""
+    return "\n".join(extract_page_texts(pdf_path))
+
+def group_pages(pages: List[str], max_chars: int = DEFAULT_SECTION_CHARS) -> List[str]:
+    """
+    按页把文本合并为不超过 max_chars 字符的小节，用于分节修复
+
+    只在页边界处切分，单页超过 max_chars 时独占一节；空白页并入相邻小节。
+    """
+    sections, current, size = [], [], 0
+    for text in pages:
+        if current and size + len(text) > max_chars and text.strip():
+            sections.append("\n".join(current))
+            current, size = [], 0
+        current.append(text)
+        size += len(text) + 1
+    if current:
+        sections.append("\n".join(current))
+    return [s for s in sections if s.strip()]
+
+def repair_text(content: str, api_key: str, timeout: Union[int, float] = 1145) -> str:
+    """修复从PDF提取的文本（整份文档或其中一节），返回 Markdown 格式的修复结果"""
+    return call_deepseek_api(
+        prompt=content,
+        api_key=api_key,
+        system_message=REPAIR_SYSTEM_MESSAGE,
+        model="deepseek-reasoner",
+        max_tokens=16384,
+        deep_thought=True,
+        timeout=timeout,
+        stream=False,
+        stage="repair"
+    )
+
+def repaired_path(pdf_path: str, output_dir: str) -> str:
+    """修复结果的保存路径：<输出目录>/<PDF 文件名>_input.txt"""
+    base_name = os.path.splitext(os.path.basename(pdf_path))[0]
+    return os.path.join(output_dir, f"{base_name}_input.txt")
 
 def process_pdf(pdf_path: str, api_key: str, output_dir: str = "output") -> str:
     """处理PDF文件并调用API"""
@@ -242,19 +684,10 @@ def process_pdf(pdf_path: str, api_key: str, output_dir: str = "output") -> str:
     save_file(prompt_path, content)
     
     # 调用API处理文本
-    result = call_deepseek_api(
-        prompt=content,
-        api_key=api_key,
-        system_message="这些是一门课程的课件或者笔记，你需要注意：我们直接通过某种工具将其转换成了纯文本，可能会造成格式错误，乱码或者信息丢失，请务必先根据已有的知识进行修复，然后逐字逐句的以 Markdown 的格式输出，你需要用 $ 包裹公式而不是括号和斜杠，输出修复后的内容，不要进行包括概括，内容拓展等的任何操作！！！",
-        model="deepseek-reasoner",
-        max_tokens=16384,
-        deep_thought=True,
-        timeout=1145,
-        stream=False
-    )
+    result = repair_text(content, api_key)
     
     # 保存处理结果
-    input_path = os.path.join(output_dir, f"{base_name}_input.txt")
+    input_path = repaired_path(pdf_path, output_dir)
     save_file(input_path, result)
     logger.info(f"处理完成，结果已保存至: {input_path}")
     return input_path
@@ -265,7 +698,37 @@ if __name__ == "__main__":
     parser.add_argument("pdf_file", help="要处理的PDF文件路径")
     parser.add_argument("--api_key", help="DeepSeek API密钥", required=True)
     parser.add_argument("--output_dir", help="输出目录", default="output")
+    parser.add_argument("--routing", default=None,
+                        help="阶段路由预设（default、fast）或 JSON 文件路径，决定修复阶段使用的模型")
+    parser.add_argument("--route", action="append", default=[],
+                        help="覆盖单个阶段的路由，格式 STAGE=MODEL[:TEMPERATURE[:MAX_TOKENS]]，可重复")
+    parser.add_argument("--trace", action="store_true",
+                        help="记录各阶段耗时，写入输出目录下的 repair_trace.json（Chrome/Perfetto 格式）")
+    parser.add_argument("--tracemem", action="store_true",
+                        help="追踪时同时用 tracemalloc 记录主线程上各区间的内存峰值（会拖慢运行）")
     args = parser.parse_args()
     
-    # 处理PDF文件
-    process_pdf(args.pdf_file, args.api_key, args.output_dir)
\ No newline at end of file
+    if args.routing or args.route:
+        try:
+            routing.configure(routing.RoutingTable.from_preset(args.routing or "default").override(args.route))
+        except ValueError as e:
+            parser.error(str(e))
+    
+    # 内部以流式请求完成修复调用，停顿时立即重试而不是等满超时
+    configure_transport(streaming=True)
+    
+    # 记录调用遥测（含上下文缓存命中 token 数）
+    telemetry.configure(os.path.join(args.output_dir, "telemetry.jsonl"))
+    
+    tracer = tracing.Tracer(memory=args.tracemem) if args.trace or args.tracemem else None
+    tracing.configure(tracer)
+    
+    # 处理PDF文件；API 错误时以非零状态退出，避免把错误信息当作修复结果保存
+    try:
+        process_pdf(args.pdf_file, args.api_key, args.output_dir)
+    except errors.DeepSeekAPIError as e:
+        logger.error(f"PDF 修复失败: {type(e).__name__}: {str(e)}")
+        sys.exit(1)
+    finally:
+        if tracer is not None:
+            tracer.save(os.path.join(args.output_dir, "repair_trace.json"))
\ No newline at end of file
@@ -5,8 +5,32 @@ import re
 import argparse
 import time
 import json
+import contextvars
+import math
+import threading
 from datetime import datetime
-from fix import call_deepseek_api
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+from fix import call_deepseek_api, GenerationAborted, configure_transport, DEFAULT_FIRST_TOKEN_TIMEOUT, DEFAULT_IDLE_TIMEOUT
+from fix import extract_page_texts, extract_text_from_pdf, group_pages, repair_text, repaired_path, DEFAULT_SECTION_CHARS
+import telemetry
+import runstore
+import hedge
+import routing
+import cassette
+import tracing
+import autotune
+from errors import DeepSeekAPIError
+from patch import PATCH_FORMAT_INSTRUCTION, PatchError, parse_patch, apply_patch
+from retrieval import SourceIndex, DEFAULT_PASSAGE_CHARS
+from sections import SectionTree, cache_path_for
+from warmstart import prepare_warm_start, split_questions, join_questions
+from pagefit import PageFitter, PageSpec, overflow_report, DEFAULT_PAGES, DEFAULT_COLUMNS, DEFAULT_FONT_SIZE, DEFAULT_FONT
+from strata import CoverageMap, stratify, strata_limit, DEFAULT_MAX_STRATA, MIN_STRATUM_QUESTIONS
+from lectures import LectureCache, allocate_budgets, file_digest, lecture_limit, lecture_name, settings_digest
+from mdtext import count_visible_chars, detect_language, VisibleCharCounter, trim_to_visible_limit
+from candidates import extract_bold_terms, rank_candidates
+from convergence import ConvergenceController, DEFAULT_TARGET_ACCURACY, DEFAULT_PATIENCE, DEFAULT_CI_HALF_WIDTH
 
 # 默认参数值
 DEFAULT_GEN_ITER = 3
@@ -14,6 +38,23 @@ DEFAULT_VAL_ITER = 2
 DEFAULT_VAL_PROBLEMS = 5
 DEFAULT_MAX_WAIT = 300
 DEFAULT_MAX_TOKENS = 32768
+DEFAULT_RETRIEVAL_CHARS = 6000
+DEFAULT_CANDIDATES = 1
+DEFAULT_OVERSHOOT = 2.0
+DEFAULT_REPAIR_WORKERS = 2
+# 分节首轮摘要的最小字数预算，避免很短的小节被压缩得只剩标题
+MIN_SECTION_LIMIT = 200
+# 分部分出题的并发请求数
+DEFAULT_QUESTION_WORKERS = 4
+# 热启动时旧摘要超过字数限制不到该倍数则不再压缩
+WARMSTART_TOLERANCE = 1.1
+# 讲次摘要、出题或解答的提示词有实质修改时递增，使已缓存的讲次摘要失效
+LECTURE_PROMPT_VERSION = 1
+# 讲次独立摘要和验证用到的阶段，其路由是讲次缓存键的一部分
+LECTURE_STAGES = ("compress", "question", "solve", "parse")
+
+# 原文前缀的固定引导语；原文前缀在所有使用原文的调用中必须字节一致，才能命中上下文缓存
+SOURCE_PREFIX_HEADER = "以下是一门课程的原始文本，后续任务均以此为依据：\n"
 
 def create_output_dir(base_dir="output"):
     """创建带时间戳的输出目录"""
@@ -22,6 +63,7 @@ def create_output_dir(base_dir="output"):
     os.makedirs(output_dir, exist_ok=True)
     return output_dir
 
+@tracing.traced()
 def save_iteration_data(output_dir, iteration, content_type, content):
     """保存迭代数据到文件"""
     filename = f"{content_type}{iteration}.txt"
@@ -42,37 +84,18 @@ def read_file_content(file_path):
         print(f"错误: 读取文件 '{file_path}' 时出现异常: {e}", file=sys.stderr)
         return None
 
-def strip_markdown(text):
-    """移除Markdown语法"""
-    text = re.sub(r'```.*?```', '', text, flags=re.S)
-    text = re.sub(r'`([^`]+)`', r'\1', text)
-    text = re.sub(r'!\[([^\]]*)\]\([^\)]+\)', r'\1', text)
-    text = re.sub(r'\[([^\]]+)\]\([^\)]+\)', r'\1', text)
-    text = re.sub(r'(^|\n)#+\s*', r'\1', text)
-    text = re.sub(r'(\*\*|__)(.*?)\1', r'\2', text)
-    text = re.sub(r'(\*|_)(.*?)\1', r'\2', text)
-    text = re.sub(r'~~(.*?)~~', r'\1', text)
-    text = re.sub(r'(^|\n)>\s?', r'\1', text)
-    text = re.sub(r'(^|\n)[\-\*\+]\s+', r'\1', text)
-    text = re.sub(r'<[^>]+>', '', text)
-    return text
-
-def count_visible_chars(text):
-    """计算可见字符数"""
-    stripped = strip_markdown(text)
-    return len(re.sub(r"\s+", "", stripped))
-
-def detect_language(text):
-    """检测文本主要语言"""
-    total = len(text)
-    if total == 0: return None
-    chinese = len(re.findall(r'[\u4e00-\u9fff]', text))
-    ratio = chinese / total
-    return '中文' if ratio > 0.3 else 'English'
-
-def generate_questions(content, api_key, model, num_questions, timeout):
-    """生成考试题目"""
-    prompt = f"请基于以下文本内容，生成{num_questions}道选择题（单选或多选）。确保题目覆盖文本中的重要知识点和易错点：\n{content}"
+def build_source_prefix(content):
+    """构造原文前缀，作为请求的第一条消息，使各阶段共享同一缓存前缀"""
+    return f"{SOURCE_PREFIX_HEADER}{content}"
+
+def generate_questions(content, api_key, model, num_questions, timeout, focus=None):
+    """生成考试题目；提供 focus 时只针对原文中的这一部分出题，原文前缀不变以命中缓存"""
+    prompt = f"请基于上述原始文本，生成{num_questions}道选择题（单选或多选）。确保题目覆盖文本中的重要知识点和易错点。"
+    if focus is not None:
+        prompt = (
+            f"请只针对上述原始文本中的以下部分，生成{num_questions}道选择题（单选或多选）。"
+            f"确保题目覆盖这一部分的重要知识点和易错点。\n\n{focus}"
+        )
     
     system_message = (
         "您是一位经验丰富的考试命题专家。任务："
@@ -94,13 +117,78 @@ def generate_questions(content, api_key, model, num_questions, timeout):
             model=model,
             max_tokens=DEFAULT_MAX_TOKENS,
             system_message=system_message,
-            timeout=timeout
+            timeout=timeout,
+            context_prefix=build_source_prefix(content),
+            stage="question"
         )
         return questions
+    except DeepSeekAPIError:
+        raise
     except Exception as e:
         print(f"题目生成失败: {e}", file=sys.stderr)
         return None
 
+def question_blocks(text):
+    """把生成的题目文本拆成单题；没有题号时整体作为一道题，避免丢失"""
+    blocks = split_questions(text or "")
+    if not blocks and text and text.strip():
+        blocks = [text.strip()]
+    return blocks
+
+def generate_stratified_questions(content, coverage, counts, api_key, model, timeout,
+                                  workers=DEFAULT_QUESTION_WORKERS, spans=None):
+    """
+    按原文各部分并行出题，counts[i] 为第 i 部分的题目数
+    
+    提供 spans 时只针对各部分中与这些 (start, end) 重叠的原文出题（热启动时为有变化的小节）。
+    返回 (题目列表, 每道题所属的部分)。单个部分出题失败时跳过该部分；
+    API 错误在其余部分完成后抛出。
+    """
+    jobs = [i for i, n in enumerate(counts) if n > 0]
+    
+    def run(i):
+        focus = coverage.text(i) if len(coverage.strata) > 1 else None
+        if spans:
+            a, b = coverage.strata[i]
+            focus = "\n\n".join(content[max(a, start):min(b, end)] for start, end in spans
+                                if start < b and end > a) or focus
+        with tracing.span("question_part", part=i, problems=counts[i]):
+            return generate_questions(content, api_key, model, counts[i], timeout, focus=focus)
+    
+    texts, error = {}, None
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(jobs) or 1))) as pool:
+        futures = {submit_in_context(pool, run, i): i for i in jobs}
+        for future in as_completed(futures):
+            try:
+                texts[futures[future]] = future.result()
+            except DeepSeekAPIError as e:
+                error = e
+    if error is not None:
+        raise error
+    questions, owners = [], []
+    for i in jobs:
+        blocks = question_blocks(texts.get(i))
+        if not blocks:
+            print(f"第 {i + 1} 部分（{coverage.titles[i]}）出题失败，跳过", file=sys.stderr)
+        questions.extend(blocks)
+        owners.extend([i] * len(blocks))
+    return questions, owners
+
+def parse_results_json(result_json):
+    """解析解答状态的 JSON；模型在 JSON 前后附带说明文字时，退而提取其中的数组"""
+    try:
+        return json.loads(result_json)
+    except json.JSONDecodeError:
+        json_match = re.search(r'\[.*\]', result_json, re.DOTALL)
+        if json_match:
+            try:
+                return json.loads(json_match.group(0))
+            except json.JSONDecodeError:
+                pass
+        print(f"无法解析为有效JSON: {result_json}")
+        return None
+
+@tracing.traced("parse")
 def parse_answers_with_api(answers_text, api_key, model, timeout):
     """解析解答结果"""
     prompt = (
@@ -127,20 +215,13 @@ def parse_answers_with_api(answers_text, api_key, model, timeout):
             model=model,
             max_tokens=DEFAULT_MAX_TOKENS,
             system_message=system_message,
-            timeout=timeout
+            timeout=timeout,
+            stage="parse"
         )
         
-        try:
-            return json.loads(result_json)
-        except json.JSONDecodeError:
-            json_match = re.search(r'\[.*\]', result_json, re.DOTALL)
-            if json_match:
-                try:
-                    return json.loads(json_match.group(0))
-                except json.JSONDecodeError:
-                    pass
-            print(f"无法解析为有效JSON: {result_json}")
-            return None
+        return parse_results_json(result_json)
+    except DeepSeekAPIError:
+        raise
     except Exception as e:
         print(f"解析API调用失败: {e}", file=sys.stderr)
         return None
@@ -171,15 +252,146 @@ def solve_questions_with_cheatsheet(questions, cheatsheet, api_key, model, timeo
             model=model,
             max_tokens=DEFAULT_MAX_TOKENS,
             system_message=system_message,
-            timeout=timeout
+            timeout=timeout,
+            stage="solve"
         )
         
         results = parse_answers_with_api(answers, api_key, model, timeout)
         return answers, results
+    except DeepSeekAPIError:
+        raise
     except Exception as e:
         print(f"题目解答失败: {e}", file=sys.stderr)
         return None, None
 
+def request_patched_summary(current_content, prompt, system_message, api_key, model, timeout,
+                            output_dir, tag, stage, **call_kwargs):
+    """以编辑操作的形式请求修改摘要并在本地应用，失败时返回 None 以便回退为完整重写"""
+    try:
+        response = call_deepseek_api(
+            prompt=prompt,
+            api_key=api_key,
+            model=model,
+            max_tokens=DEFAULT_MAX_TOKENS,
+            system_message=system_message + PATCH_FORMAT_INSTRUCTION,
+            timeout=timeout,
+            stage=f"{stage}_patch",
+            **call_kwargs
+        )
+        ops = parse_patch(response)
+        patched = apply_patch(current_content, ops)
+    except PatchError as e:
+        print(f"编辑操作应用失败，回退为完整重写: {e}")
+        return None
+    except DeepSeekAPIError:
+        # API 已按错误类型重试过，回退为完整重写只会继续失败
+        raise
+    except Exception as e:
+        print(f"编辑操作请求失败，回退为完整重写: {e}", file=sys.stderr)
+        return None
+    
+    save_iteration_data(output_dir, tag, "patch", json.dumps(ops, ensure_ascii=False, indent=2))
+    print(f"已应用 {len(ops)} 条编辑操作")
+    return patched
+
+class LengthExceeded(GenerationAborted):
+    """流式输出的可见字符数超过预算的 overshoot 倍"""
+
+class LengthGuard:
+    """流式长度守卫：逐块统计可见字符数，明显超出预算时中止生成"""
+    
+    def __init__(self, limit, overshoot):
+        self.limit = limit
+        self.threshold = limit * overshoot
+        self.counter = VisibleCharCounter()
+    
+    def __call__(self, delta):
+        self.counter.feed(delta)
+        if self.counter.count > self.threshold:
+            raise LengthExceeded(f"可见字符数超过 {self.threshold:.0f}")
+
+def call_with_length_guard(limit, overshoot, on_overflow, **call_kwargs):
+    """
+    带长度守卫的摘要调用
+    
+    输出超过 limit 的 overshoot 倍时提前中止：on_overflow 为 'retry' 时以更严格的指令重新生成一次，
+    仍然超出或为 'trim' 时把已生成的部分交给本地截断。
+    """
+    system_message = call_kwargs.pop("system_message", None) or ""
+    for attempt in range(2):
+        guard = LengthGuard(limit, overshoot)
+        try:
+            return call_deepseek_api(system_message=system_message, on_delta=guard, **call_kwargs)
+        except LengthExceeded as e:
+            print(f"输出已超过 {guard.counter.count} 字（限制 {limit} 字的 {overshoot} 倍），提前中止生成")
+            if on_overflow == "trim" or attempt == 1:
+                trimmed = trim_to_visible_limit(e.partial, limit)
+                print(f"已在本地截断至 {count_visible_chars(trimmed)} 字")
+                return trimmed
+            system_message += (
+                f"\n注意：上一次生成的内容远超字数限制（超过 {guard.counter.count} 字仍未结束）。"
+                f"请大幅删减，只保留最核心的考点，目标不超过 {int(limit * 0.8)} 字。"
+            )
+            print("收紧字数指令后重新生成...")
+
+def guarded_call(limit, overshoot, on_overflow):
+    """摘要调用函数：overshoot 大于 0 时带长度守卫（见 call_with_length_guard），否则直接调用 API"""
+    if overshoot > 0:
+        return partial(call_with_length_guard, limit, overshoot, on_overflow)
+    return call_deepseek_api
+
+def language_instruction(text):
+    """要求摘要沿用原文主要语言的指令；无法判断语言时为空"""
+    lang = detect_language(text)
+    return f"若原文主要使用{lang}，请使用相同语言输出摘要。" if lang else ''
+
+def submit_in_context(pool, fn, *args, **kwargs):
+    """向线程池提交任务，并复制当前上下文，使任务沿用当前任务的遥测记录、路由表和取消事件"""
+    return pool.submit(contextvars.copy_context().run, partial(fn, *args, **kwargs))
+
+def generate_candidates(num_candidates, candidate_mode, call=call_deepseek_api, **call_kwargs):
+    """
+    生成多个候选摘要
+    
+    candidate_mode 为 'n' 时使用 API 的 n 参数，否则通过 call 并发发送多个请求。
+    """
+    if candidate_mode == "n":
+        result = call_deepseek_api(n=num_candidates, **call_kwargs)
+        results = result if isinstance(result, list) else [result]
+    else:
+        results = []
+        first_error = None
+        with ThreadPoolExecutor(max_workers=num_candidates) as pool:
+            futures = [submit_in_context(pool, call, **call_kwargs) for _ in range(num_candidates)]
+            for future in futures:
+                try:
+                    results.append(future.result())
+                except DeepSeekAPIError as e:
+                    print(f"候选生成失败: {e}", file=sys.stderr)
+                    first_error = first_error or e
+        # 所有候选都因 API 错误失败时向上抛出，由调用方决定是否终止
+        if not results and first_error is not None:
+            raise first_error
+    return [r for r in results if r and isinstance(r, str)]
+
+@tracing.traced("rank_candidates")
+def select_best_candidate(candidates, limit, key_terms, probes, output_dir, iteration):
+    """在本地对候选摘要排序，保存得分并返回最佳候选"""
+    if not candidates:
+        return None
+    ranking = rank_candidates(candidates, limit, key_terms, probes)
+    for rank in ranking:
+        save_iteration_data(output_dir, f"{iteration}_cand{rank['index']}", "gen", candidates[rank["index"]])
+    path = os.path.join(output_dir, f"candidates{iteration}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({"limit": limit, "ranking": ranking}, f, ensure_ascii=False, indent=2)
+    
+    best = ranking[0]
+    print(f"候选 {len(candidates)} 份，选中候选 {best['index']}："
+          f"{best['visible_chars']}字，综合得分 {best['score']}")
+    return candidates[best["index"]]
+
+@tracing.traced("visualize")
 def generate_visualization(results, output_dir, iteration):
     """生成正确性可视化"""
     if not results:
@@ -219,12 +431,44 @@ def generate_visualization(results, output_dir, iteration):
     
     return vis_path, result_path
 
-def iterative_summarize(content, api_key, model, final_limit, output_dir, 
-                       gen_iter, val_iter, val_problems, max_wait):
-    """迭代式摘要生成"""
-    lang = detect_language(content)
-    lang_instruction = f"若原文主要使用{lang}，请使用相同语言输出摘要。" if lang else ''
-    
+def compress_system_message(idx, limit, lang_instruction):
+    """第 idx 轮压缩的系统消息：首轮从原文浓缩，之后在上一轮结果上精简"""
+    if idx == 1:
+        return (
+            "您是一位高效的学术助手和专业的总结者，" 
+            f"当前扮演角色: 经验丰富的考试复习摘要助手（迭代{idx}），你需要把用户给出的资料进行高度的概括，帮助用户制作半开卷考试的入场资料。"
+            f"由于半开卷考试的纸张大小有限，经用户计算，目标可见字符数严格不超过 {limit}。"
+            f"任务：将提供的讲义浓缩成简洁、高度可扫描的考试复习备忘录，字数严格不超过 {limit} 字（可见字符）。"
+            "请先估算最终摘要的可见字符长度，如果可能超过限制，请预先规划删除策略。"
+            "侧重核心概念、定义、关键公式、重要步骤和易混淆考点。"
+            "请仅基于提供文本，不含外部信息或臆造内容。"
+            "请以Markdown格式输出，加粗关键术语，~划掉~表示可弱化。"
+            "第一次摘要时，请识别并对关键考点使用**加粗**标注，以便后续保留；"
+            "思考流程：识别主题→提炼定义、公式、见解和记忆提示；"
+            f"若内容过多，请大胆删除与考试无关知识点，以确保输出长度不超过 {limit} 字；"
+            f"若已满足限制，无需压缩；{lang_instruction}"
+            "同时，请始终满足以下要求：\n"
+            f"1. 明确课程名称，推测学生的前置知识\n"
+            f"2. 删除考试中绝对不会遇到的内容\n"
+            f"3. 用户群体均为准备期末考试的大学生\n"
+            f"4. 始终保持可读性"
+        )
+    else:
+        return (
+            f"您是一位更高级的考试复习摘要专家（迭代{idx}）。基于上一次结果，精简至严格不超过 {limit} 字："
+            "请首先评估当前摘要长度，若超过限制，务必进一步删除非核心内容；"
+            "确认覆盖所有核心考点；保留**加粗**，弱化或删除~划掉~；"
+            f"若已满足限制，无需再次压缩；压缩困难时可删除更细节非考试相关内容；"
+            f"{lang_instruction}优化表达，增加记忆提示；保持逻辑连贯、易快速浏览；"
+            "同时，请始终满足以下要求：\n"
+            f"1. 明确课程名称，推测学生的前置知识\n"
+            f"2. 删除考试中绝对不会遇到的内容\n"
+            f"3. 用户群体均为准备期末考试的大学生\n"
+            f"4. 以Markdown格式输出"
+        )
+
+def compression_limits(final_limit, gen_iter):
+    """各轮压缩的字数限制：首轮 5 倍、次轮 2 倍、之后为最终限制，均不超过 DEEPSEEK_MAX_VISIBLE_CHARS"""
     try:
         cap = int(os.getenv("DEEPSEEK_MAX_VISIBLE_CHARS", "30000"))
     except ValueError:
@@ -235,57 +479,108 @@ def iterative_summarize(content, api_key, model, final_limit, output_dir,
         if i == 0: raw_limits.append(5 * final_limit)
         elif i == 1: raw_limits.append(2 * final_limit)
         else: raw_limits.append(final_limit)
-    limits = [min(l, cap) for l in raw_limits]
+    return [min(l, cap) for l in raw_limits]
+
+@tracing.traced()
+def iterative_summarize(content, api_key, model, final_limit, output_dir, 
+                       gen_iter, val_iter, val_problems, max_wait, patch_mode=False,
+                       source_index=None, num_candidates=DEFAULT_CANDIDATES, candidate_mode="concurrent",
+                       controller=None, overshoot=0, on_overflow="retry", first_pass=None, resume=None,
+                       warm_start=None, max_strata=DEFAULT_MAX_STRATA, question_workers=DEFAULT_QUESTION_WORKERS,
+                       page_fitter=None, section_tree=None):
+    """
+    迭代式摘要生成
     
+    patch_mode 为真时，后续压缩与反馈优化以编辑操作的形式增量修改摘要；
+    提供 source_index 时，反馈优化只携带与未解答题目相关的原文片段，而不是完整原文；
+    num_candidates 大于 1 时，每轮压缩生成多个候选并在本地择优；
+    提供 controller 时，验证阶段在正确率达标或不再提升时提前结束，并按需调整下一轮题目数；
+    overshoot 大于 0 时，完整重写的输出超过字数限制的 overshoot 倍即中止，按 on_overflow 处理；
+    提供 first_pass 时以其作为首轮压缩结果（见 repair_and_summarize），从第二轮开始压缩；
+    resume 为 (摘要, 字数限制) 时从该摘要继续，只执行限制小于该值的压缩轮次（见 summarize_branches），
+    没有这样的轮次而该值大于 final_limit 时按 final_limit 压缩一轮；
+    提供 warm_start（见 prepare_warm_start）时，首轮验证沿用其中出处未变的旧题，只针对有变化的原文补足新题；
+    验证题目按原文各部分（至多 max_strata 个，且每部分至少 MIN_STRATUM_QUESTIONS 道题）的篇幅和最近的正确率分配，
+    以 question_workers 个线程并行生成，每轮的分部分统计写入 coverageX.json；
+    提供 page_fitter（见 pagefit.PageFitter）时，摘要一旦能排入版面即跳过剩余的压缩轮次，
+    反馈优化时列出超出版面的小节；
+    section_tree 为已解析的原文小节树（见 SectionTree.load_or_parse），缺省时在此解析一次。
+    """
+    lang_instruction = language_instruction(content)
+    
+    limits = compression_limits(final_limit, gen_iter)
+    
+    source_prefix = build_source_prefix(content)
+    # 原文小节标题作为候选择优时的本地验证探针
+    tree = section_tree or SectionTree.parse(content)
+    probes = [s.title for s in tree.sections if s.title]
     current_content = content
-    save_iteration_data(output_dir, "0_raw", "gen", content)
+    first_idx = 1
+    if resume is not None:
+        # 之后的各轮都在已有摘要上精简
+        current_content, resumed_limit = resume
+        remaining = [l for l in limits if l < resumed_limit]
+        if not remaining and resumed_limit > final_limit:
+            # geniter 较小时各轮限制都不低于续接点，仍至少按最终限制压缩一轮
+            remaining = [final_limit]
+        first_idx = max(2, len(limits) - len(remaining) + 1)
+        limits = remaining
+    else:
+        save_iteration_data(output_dir, "0_raw", "gen", content)
+    total_iter = len(limits) + first_idx - 1
     
-    for idx, limit in enumerate(limits, start=1):
+    for idx, limit in enumerate(limits, start=first_idx):
+        if page_fitter is not None and idx > 1:
+            fit = page_fitter.measure(current_content)
+            print(f"版面: 占 {fit.used:.0f}/{fit.capacity} 行")
+            if fit.fits:
+                print(f"摘要已能排入版面，跳过剩余 {total_iter - idx + 1} 轮压缩")
+                break
+        if idx == 1 and first_pass is not None:
+            # 首轮已在修复 PDF 的同时逐节完成
+            print(f"\n=== 生成阶段迭代 {idx}/{total_iter}（已与 PDF 修复重叠完成）===")
+            current_content = first_pass
+            save_iteration_data(output_dir, f"{idx}", "gen", current_content)
+            continue
+        system_message = compress_system_message(idx, limit, lang_instruction)
+        
+        print(f"\n=== 生成阶段迭代 {idx}/{total_iter} ===")
         if idx == 1:
-            system_message = (
-                "您是一位高效的学术助手和专业的总结者，" 
-                f"当前扮演角色: 经验丰富的考试复习摘要助手（迭代{idx}），你需要把用户给出的资料进行高度的概括，帮助用户制作半开卷考试的入场资料。"
-                f"由于半开卷考试的纸张大小有限，经用户计算，目标可见字符数严格不超过 {limit}。"
-                f"任务：将提供的讲义浓缩成简洁、高度可扫描的考试复习备忘录，字数严格不超过 {limit} 字（可见字符）。"
-                "请先估算最终摘要的可见字符长度，如果可能超过限制，请预先规划删除策略。"
-                "侧重核心概念、定义、关键公式、重要步骤和易混淆考点。"
-                "请仅基于提供文本，不含外部信息或臆造内容。"
-                "请以Markdown格式输出，加粗关键术语，~划掉~表示可弱化。"
-                "第一次摘要时，请识别并对关键考点使用**加粗**标注，以便后续保留；"
-                "思考流程：识别主题→提炼定义、公式、见解和记忆提示；"
-                f"若内容过多，请大胆删除与考试无关知识点，以确保输出长度不超过 {limit} 字；"
-                f"若已满足限制，无需压缩；{lang_instruction}"
-                "同时，请始终满足以下要求：\n"
-                f"1. 明确课程名称，推测学生的前置知识\n"
-                f"2. 删除考试中绝对不会遇到的内容\n"
-                f"3. 用户群体均为准备期末考试的大学生\n"
-                f"4. 始终保持可读性"
-            )
+            # 首轮直接压缩原文：原文放入共享前缀，用户消息只保留简短指令
+            call_args = {
+                "prompt": "请按系统要求，将上述原始文本浓缩为考试复习摘要。",
+                "context_prefix": source_prefix,
+            }
         else:
-            system_message = (
-                f"您是一位更高级的考试复习摘要专家（迭代{idx}）。基于上一次结果，精简至严格不超过 {limit} 字："
-                "请首先评估当前摘要长度，若超过限制，务必进一步删除非核心内容；"
-                "确认覆盖所有核心考点；保留**加粗**，弱化或删除~划掉~；"
-                f"若已满足限制，无需再次压缩；压缩困难时可删除更细节非考试相关内容；"
-                f"{lang_instruction}优化表达，增加记忆提示；保持逻辑连贯、易快速浏览；"
-                "同时，请始终满足以下要求：\n"
-                f"1. 明确课程名称，推测学生的前置知识\n"
-                f"2. 删除考试中绝对不会遇到的内容\n"
-                f"3. 用户群体均为准备期末考试的大学生\n"
-                f"4. 以Markdown格式输出"
-            )
+            call_args = {"prompt": current_content}
         
-        print(f"\n=== 生成阶段迭代 {idx}/{len(limits)} ===")
+        call_kwargs = dict(
+            api_key=api_key,
+            model=model,
+            max_tokens=DEFAULT_MAX_TOKENS,
+            system_message=system_message,
+            deep_thought=True,
+            timeout=max_wait,
+            stage="compress",
+            **call_args
+        )
+        call = guarded_call(limit, overshoot, on_overflow)
         try:
-            result = call_deepseek_api(
-                prompt=current_content,
-                api_key=api_key,
-                model=model,
-                max_tokens=DEFAULT_MAX_TOKENS,
-                system_message=system_message,
-                deep_thought=True,
-                timeout=max_wait
-            )
+            with tracing.span("compress", iteration=idx, limit=limit):
+                result = None
+                if patch_mode and idx > 1:
+                    result = request_patched_summary(
+                        current_content, current_content, system_message, api_key, model, max_wait,
+                        output_dir, f"{idx}", "compress", deep_thought=True
+                    )
+                if result is None and num_candidates > 1:
+                    candidates = generate_candidates(num_candidates, candidate_mode, call, **call_kwargs)
+                    result = select_best_candidate(
+                        candidates, limit, extract_bold_terms(current_content), probes,
+                        output_dir, idx
+                    )
+                elif result is None:
+                    result = call(**call_kwargs)
         except Exception as e:
             print(f"Error: 第 {idx} 次 API 调用失败: {e}", file=sys.stderr)
             return None
@@ -297,21 +592,41 @@ def iterative_summarize(content, api_key, model, final_limit, output_dir,
         current_content = result
         save_iteration_data(output_dir, f"{idx}", "gen", current_content)
     
+    coverage = None
+    if val_iter > 0:
+        coverage = CoverageMap(content, stratify(content, strata_limit(val_problems, max_strata), tree), tree)
     for loop in range(1, val_iter + 1):
         print(f"\n=== 验证阶段迭代 {loop}/{val_iter} ===")
         
         save_iteration_data(output_dir, f"{loop}_pre", "gen", current_content)
         
-        print(f"生成 {val_problems} 道选择题...")
-        questions = generate_questions(
-            content=content,
-            api_key=api_key,
-            model=model,
-            num_questions=val_problems,
-            timeout=max_wait
-        )
+        reused, only, spans = [], None, None
+        if loop == 1 and warm_start is not None:
+            reused = warm_start.questions[:val_problems]
+            # 新题只出在与有变化的小节重叠的部分
+            only = [i for i, (a, b) in enumerate(coverage.strata)
+                    if any(start < b and end > a for start, end in warm_start.changed_spans)] or None
+            spans = warm_start.changed_spans
+            if reused:
+                print(f"沿用上一次运行的 {len(reused)} 道题目（出处小节未变）")
+        counts = coverage.allocate(val_problems - len(reused), only)
+        try:
+            fresh, owners = [], []
+            if sum(counts):
+                parts = sum(1 for n in counts if n)
+                print(f"生成 {sum(counts)} 道选择题（{parts} 个原文部分）...")
+                with tracing.span("question", loop=loop, problems=sum(counts), parts=parts):
+                    fresh, owners = generate_stratified_questions(
+                        content, coverage, counts, api_key, model, max_wait, question_workers, spans
+                    )
+        except DeepSeekAPIError as e:
+            print(f"题目生成失败（{type(e).__name__}: {e}），结束验证阶段", file=sys.stderr)
+            break
+        question_list = reused + fresh
+        owners = [coverage.attribute(q) for q in reused] + owners
+        questions = join_questions(question_list)
         
-        if not questions:
+        if not question_list:
             print("题目生成失败，跳过反馈循环")
             continue
         
@@ -319,13 +634,18 @@ def iterative_summarize(content, api_key, model, final_limit, output_dir,
         print(f"已保存选择题: {q_path}")
         
         print("尝试使用摘要解答选择题...")
-        answers, results = solve_questions_with_cheatsheet(
-            questions=questions,
-            cheatsheet=current_content,
-            api_key=api_key,
-            model=model,
-            timeout=max_wait
-        )
+        try:
+            with tracing.span("solve", loop=loop):
+                answers, results = solve_questions_with_cheatsheet(
+                    questions=questions,
+                    cheatsheet=current_content,
+                    api_key=api_key,
+                    model=model,
+                    timeout=max_wait
+                )
+        except DeepSeekAPIError as e:
+            print(f"题目解答失败（{type(e).__name__}: {e}），结束验证阶段", file=sys.stderr)
+            break
         
         if not answers or not results:
             print("题目解答失败，跳过反馈循环")
@@ -338,6 +658,25 @@ def iterative_summarize(content, api_key, model, final_limit, output_dir,
         if vis_path and result_path:
             print(f"已保存可视化: {vis_path}")
             print(f"已保存详细结果: {result_path}")
+        loop_coverage = coverage.record(owners, results)
+        cov_path = coverage.save(output_dir, loop, loop_coverage)
+        tested = sum(1 for stats in coverage.totals if stats["questions"])
+        print(f"已保存覆盖情况: {cov_path}（已测试 {tested}/{len(coverage.strata)} 个原文部分）")
+        
+        if controller is not None:
+            correct = sum(1 for r in results if "status" in r and "正确" in r["status"])
+            entry = controller.update(correct, len(results), current_content)
+            print(f"本轮正确率: {entry['accuracy']:.0%} "
+                  f"(95% 置信区间 {entry['ci'][0]:.0%}~{entry['ci'][1]:.0%})")
+            if controller.should_stop():
+                print(f"收敛判定: {controller.stop_reason}，提前结束验证阶段")
+                current_content = controller.best["summary"]
+                print(f"采用第 {controller.best['loop']} 轮测试过的摘要")
+                break
+            next_problems = controller.next_problem_count(val_problems)
+            if next_problems != val_problems:
+                print(f"下一轮验证题目数调整为 {next_problems} 道")
+                val_problems = next_problems
         
         unsolved_questions = []
         if results:
@@ -349,10 +688,40 @@ def iterative_summarize(content, api_key, model, final_limit, output_dir,
         print(f"发现 {len(unsolved_questions)} 道无法解答的题目")
         
         unsolved_text = "\n".join([f"- {q}" for q in unsolved_questions[:10]])
+        weak = coverage.weak()
+        weak_text = ""
+        if weak:
+            weak_text = "薄弱的原文部分（按正确率从低到高）：\n" + "\n".join(
+                f"- {coverage.titles[i]}（正确率 {coverage.last_accuracy[i]:.0%}）" for i in weak
+            ) + "\n\n"
+        doc_ids = []
+        if source_index is not None and unsolved_questions:
+            # 只检索与未解答题目相关的原文段落，代替完整原文
+            with tracing.span("retrieve", loop=loop):
+                doc_ids = source_index.select_passages(
+                    unsolved_questions[:10], max_chars=DEFAULT_RETRIEVAL_CHARS
+                )
+        if doc_ids:
+            passages_text = source_index.render_passages(doc_ids)
+            print(f"检索到 {len(doc_ids)} 个相关原文片段，共 {len(passages_text)} 字符")
+            refine_prefix = None
+            source_section = f"相关原文片段：\n{passages_text}\n\n"
+        else:
+            # 原文已位于共享前缀中，这里只放每轮变化的部分
+            refine_prefix = source_prefix
+            source_section = ""
+        layout_text = ""
+        if page_fitter is not None:
+            fit = page_fitter.measure(current_content)
+            if not fit.fits:
+                layout_text = (f"当前摘要超出版面 {math.ceil(fit.overflow)} 行，超出的小节：\n"
+                               + "\n".join(f"- {line}" for line in overflow_report(fit)) + "\n\n")
         prompt = (
             f"当前摘要：\n{current_content}\n\n"
-            f"原始文本：\n{content}...\n\n"
+            f"{source_section}"
             f"无法解答的题目：\n{unsolved_text}\n\n"
+            f"{weak_text}"
+            f"{layout_text}"
             f"任务：优化摘要以覆盖未解答题目所需的知识点，同时保持严格不超过 {final_limit} 字。"
             "优化策略："
             "1. 保留所有已覆盖的知识点"
@@ -369,7 +738,7 @@ def iterative_summarize(content, api_key, model, final_limit, output_dir,
             "同时，请始终满足以下要求：\n"
             "要求："
             "1. 分析未解答题目缺失的知识点"
-            "2. 从原始文本中提取必要信息添加到摘要"
+            "2. 从给出的原始文本或原文片段中提取必要信息添加到摘要"
             "3. 删除相对次要的内容以保持长度限制"
             "4. 确保新摘要能解答这些题目"
             "5. 保持Markdown格式和重点标注"
@@ -377,15 +746,26 @@ def iterative_summarize(content, api_key, model, final_limit, output_dir,
         )
         
         print("基于反馈优化摘要...")
+        call = guarded_call(final_limit, overshoot, on_overflow)
         try:
-            optimized_summary = call_deepseek_api(
-                prompt=prompt,
-                api_key=api_key,
-                model=model,
-                max_tokens=DEFAULT_MAX_TOKENS,
-                system_message=system_message,
-                timeout=max_wait
-            )
+            with tracing.span("refine", loop=loop, unsolved=len(unsolved_questions)):
+                optimized_summary = None
+                if patch_mode:
+                    optimized_summary = request_patched_summary(
+                        current_content, prompt, system_message, api_key, model, max_wait,
+                        output_dir, f"{loop}_post", "refine", context_prefix=refine_prefix
+                    )
+                if optimized_summary is None:
+                    optimized_summary = call(
+                        prompt=prompt,
+                        api_key=api_key,
+                        model=model,
+                        max_tokens=DEFAULT_MAX_TOKENS,
+                        system_message=system_message,
+                        timeout=max_wait,
+                        context_prefix=refine_prefix,
+                        stage="refine"
+                    )
             current_content = optimized_summary
             save_iteration_data(output_dir, f"{loop}_post", "gen", current_content)
             print(f"验证迭代 {loop} 完成，摘要已更新")
@@ -393,13 +773,413 @@ def iterative_summarize(content, api_key, model, final_limit, output_dir,
             print(f"摘要优化失败: {e}", file=sys.stderr)
             break
     
+    if controller is not None:
+        with open(os.path.join(output_dir, "convergence.json"), 'w', encoding='utf-8') as f:
+            json.dump(controller.report(), f, ensure_ascii=False, indent=2)
+    
     save_iteration_data(output_dir, "final", "gen", current_content)
     return current_content
 
-def main():
+# 当前分支的输出前缀；并发分支的输出按行加上前缀，避免相互穿插后无法分辨
+_output_prefix = contextvars.ContextVar("output_prefix", default=None)
+
+class _PrefixedOutput:
+    """替换 sys.stdout/sys.stderr：设置了前缀的上下文中按整行加前缀输出，其余照常输出"""
+
+    def __init__(self, target):
+        self.target = target
+        self._lock = threading.Lock()
+        self._partial = {}
+
+    def write(self, text):
+        prefix = _output_prefix.get()
+        if prefix is None:
+            return self.target.write(text)
+        # 各线程未完成的行分别暂存，整行写出，不会与其他分支的输出交错
+        key = threading.get_ident()
+        lines = (self._partial.pop(key, "") + text).split("\n")
+        if lines[-1]:
+            self._partial[key] = lines[-1]
+        if len(lines) > 1:
+            with self._lock:
+                self.target.write("".join(f"{prefix}{line}\n" if line else "\n" for line in lines[:-1]))
+        return len(text)
+
+    def flush(self):
+        self.target.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.target, name)
+
+def prefix_branch_output():
+    """安装按分支加前缀的输出流；重复调用不会重复包装"""
+    for name in ("stdout", "stderr"):
+        stream = getattr(sys, name)
+        if not isinstance(stream, _PrefixedOutput):
+            setattr(sys, name, _PrefixedOutput(stream))
+
+def shared_iterations(budgets, gen_iter):
+    """多个字数限制共用的压缩轮数：最大限制下放宽倍数的前几轮，且至少给各分支留下最后一轮"""
+    largest = max(budgets)
+    return sum(1 for l in compression_limits(largest, gen_iter)[:max(gen_iter - 1, 0)] if l > largest)
+
+def summarize_branches(content, budgets, output_dir, make_controller, gen_iter, first_pass=None,
+                       **summarize_kwargs):
+    """
+    一次运行生成多个字数限制的摘要
+    
+    先按最大的限制执行共用的前几轮压缩（5 倍、2 倍），再为每个限制开一个分支，
+    并发执行各自剩余的压缩轮次和验证阶段。第一个限制的分支输出在 output_dir，
+    其余分支在 output_dir/maxtoken_<限制>/，共用阶段在 output_dir/shared/。
+    没有共用轮次（geniter 为 1）时，first_pass 只用于最大限制的分支，其余分支各自重新压缩首轮；
+    各分支的控制台输出以 "[<限制>字] " 开头。
+    
+    返回:
+        {字数限制: 最终摘要}，失败的分支为 None
+    """
+    largest = max(budgets)
+    shared = shared_iterations(budgets, gen_iter)
+    resume = None
+    if shared:
+        shared_dir = os.path.join(output_dir, "shared")
+        os.makedirs(shared_dir, exist_ok=True)
+        print(f"\n=== 共用阶段：按 {largest} 字的限制执行前 {shared} 轮压缩 ===")
+        with tracing.span("shared", budget=largest, iterations=shared):
+            result = iterative_summarize(
+                content, final_limit=largest, output_dir=shared_dir, gen_iter=shared,
+                first_pass=first_pass, **dict(summarize_kwargs, val_iter=0)
+            )
+        if result is None:
+            return {budget: None for budget in budgets}
+        resume = (result, compression_limits(largest, shared)[-1])
+        first_pass = None
+    
+    def run_branch(budget):
+        _output_prefix.set(f"[{budget}字] ")
+        branch_dir = output_dir if budget == budgets[0] else os.path.join(output_dir, f"maxtoken_{budget}")
+        os.makedirs(branch_dir, exist_ok=True)
+        with tracing.span("branch", budget=budget):
+            return iterative_summarize(
+                content, final_limit=budget, output_dir=branch_dir, gen_iter=gen_iter,
+                controller=make_controller(), resume=resume,
+                # 首轮结果按最大限制生成，只能作为该限制分支的首轮
+                first_pass=first_pass if budget == largest else None,
+                **summarize_kwargs
+            )
+    
+    print(f"\n=== 并发执行 {len(budgets)} 个分支: {', '.join(map(str, budgets))} 字 ===")
+    prefix_branch_output()
+    results = {}
+    with ThreadPoolExecutor(max_workers=len(budgets)) as pool:
+        futures = {submit_in_context(pool, run_branch, budget): budget for budget in budgets}
+        for future in as_completed(futures):
+            budget = futures[future]
+            try:
+                results[budget] = future.result()
+            except DeepSeekAPIError as e:
+                print(f"{budget} 字分支失败（{type(e).__name__}: {e}）", file=sys.stderr)
+                results[budget] = None
+            print(f"{budget} 字分支{'完成' if results[budget] else '失败'}")
+    return results
+
+def summarize_section(section, index, total, limit, api_key, model, max_wait, lang_instruction,
+                      overshoot=0, on_overflow="retry"):
+    """对修复完成的一节做首轮压缩"""
+    system_message = compress_system_message(1, limit, lang_instruction) + (
+        f"\n本次提供的是整份讲义的第 {index}/{total} 部分，只需概括这一部分，"
+        "不要补充其他部分的内容，也不必重复课程名称等总体信息。"
+    )
+    call = guarded_call(limit, overshoot, on_overflow)
+    with tracing.span("compress_section", section=index, limit=limit):
+        return call(
+            prompt=section,
+            api_key=api_key,
+            model=model,
+            max_tokens=DEFAULT_MAX_TOKENS,
+            system_message=system_message,
+            deep_thought=True,
+            timeout=max_wait,
+            stage="compress"
+        )
+
+def repair_and_summarize(pdf_path, api_key, model, final_limit, gen_iter, output_dir, input_dir,
+                         max_wait, workers=DEFAULT_REPAIR_WORKERS, overshoot=0, on_overflow="retry"):
+    """
+    分节修复 PDF，并在每节修复完成后立即开始该节的首轮压缩
+    
+    PDF 按页合并为若干小节，由 workers 个线程并发修复；修复完成的小节随即提交到摘要线程池，
+    按其原文长度占比分配首轮字数预算（首轮总预算与 iterative_summarize 相同）。
+    两个阶段重叠进行，总耗时接近较慢的一个阶段，而不是两者之和。
+    
+    返回:
+        (修复后的全文, 按小节顺序合并的首轮摘要, 修复全文的保存路径)；修复全文保存为 input_dir 下的 *_input.txt
+    """
+    with tracing.span("split_pdf"):
+        sections = group_pages(extract_page_texts(pdf_path), DEFAULT_SECTION_CHARS)
+    if not sections:
+        raise ValueError(f"未能从 {pdf_path} 中提取到文本")
+    total = len(sections)
+    raw_total = sum(len(s) for s in sections)
+    first_limit = compression_limits(final_limit, max(gen_iter, 1))[0]
+    sample = "\n".join(sections)[:2000]
+    lang_instruction = language_instruction(sample)
+    print(f"PDF 分为 {total} 节修复，首轮摘要总预算 {first_limit} 字")
+    
+    repaired = [None] * total
+    summaries = [None] * total
+    with ThreadPoolExecutor(max_workers=workers) as repair_pool, \
+            ThreadPoolExecutor(max_workers=workers) as summary_pool:
+        repairs = {submit_in_context(repair_pool, repair_text, section, api_key, max_wait): i
+                   for i, section in enumerate(sections)}
+        compressions = {}
+        try:
+            for future in as_completed(repairs):
+                i = repairs[future]
+                repaired[i] = future.result()
+                save_iteration_data(output_dir, f"{i + 1}", "repair", repaired[i])
+                limit = max(MIN_SECTION_LIMIT, round(first_limit * len(sections[i]) / raw_total))
+                print(f"第 {i + 1}/{total} 节修复完成，开始首轮摘要（预算 {limit} 字）")
+                compressions[submit_in_context(
+                    summary_pool, summarize_section, repaired[i], i + 1, total,
+                    limit, api_key, model, max_wait, lang_instruction, overshoot, on_overflow
+                )] = i
+            for future in as_completed(compressions):
+                i = compressions[future]
+                summaries[i] = future.result()
+                print(f"第 {i + 1}/{total} 节首轮摘要完成")
+        except BaseException:
+            # 任一节失败时不再开始尚未执行的调用
+            for future in list(repairs) + list(compressions):
+                future.cancel()
+            raise
+    
+    content = "\n".join(repaired)
+    input_path = repaired_path(pdf_path, input_dir)
+    os.makedirs(input_dir, exist_ok=True)
+    with open(input_path, 'w', encoding='utf-8') as f:
+        f.write(content)
+    print(f"修复后的全文已保存到: {input_path}")
+    return content, "\n\n".join(s or "" for s in summaries), input_path
+
+def load_lecture_text(path, cache, digest, api_key, max_wait):
+    """读取一讲的修复后文本：TXT 直接读取，PDF 分节修复后缓存（只取决于文件内容）"""
+    if not path.lower().endswith(".pdf"):
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read(), True
+    repaired = cache.load_repaired(digest)
+    if repaired is not None:
+        return repaired, True
+    sections = group_pages(extract_page_texts(path), DEFAULT_SECTION_CHARS)
+    if not sections:
+        raise ValueError(f"未能从 {path} 中提取到文本")
+    repaired = "\n".join(repair_text(section, api_key, max_wait) for section in sections)
+    cache.save_repaired(digest, repaired)
+    return repaired, False
+
+def lecture_settings(model, system_message):
+    """影响讲次独立摘要和验证正确率的设置：各阶段实际使用的模型与参数、压缩指令和提示词版本"""
+    table = routing.get_table()
+    routes = {stage: list(table.resolve(stage, model, None, None) if table else routing.Route(model))
+              for stage in LECTURE_STAGES}
+    return {"routes": routes, "prompt": system_message, "prompt_version": LECTURE_PROMPT_VERSION}
+
+def process_lecture(path, cache, api_key, model, final_limit, val_problems, max_wait,
+                    overshoot=0, on_overflow="retry"):
+    """
+    修复并独立摘要一讲，用一轮验证的正确率衡量该讲的难度
+    
+    结果按文件内容、字数限制、题目数以及模型、路由和提示词（见 lecture_settings）缓存；
+    字数限制只取决于该讲篇幅，增加讲次不会使其失效。
+    """
+    name = lecture_name(path)
+    digest = file_digest(path)
+    with tracing.span("lecture", lecture=name):
+        content, repair_cached = load_lecture_text(path, cache, digest, api_key, max_wait)
+        limit = lecture_limit(len(content), final_limit)
+        entry = {"name": name, "path": path, "chars": len(content), "limit": limit}
+        lang_instruction = language_instruction(content)
+        system_message = compress_system_message(1, limit, lang_instruction) + (
+            f"\n本次提供的是课程中的一讲（{name}），只需概括这一讲的内容。"
+        )
+        settings = settings_digest(lecture_settings(model, system_message))
+        cached = cache.load_summary(digest, limit, val_problems, settings)
+        if cached is not None:
+            print(f"[{name}] 使用缓存的独立摘要")
+            return dict(entry, summary=cached["summary"], accuracy=cached["accuracy"], cached=True)
+        
+        call = guarded_call(limit, overshoot, on_overflow)
+        print(f"[{name}] {'已有修复结果，' if repair_cached else '修复完成，'}生成独立摘要（限制 {limit} 字）")
+        summary = call(
+            prompt=content,
+            api_key=api_key,
+            model=model,
+            max_tokens=DEFAULT_MAX_TOKENS,
+            system_message=system_message,
+            deep_thought=True,
+            timeout=max_wait,
+            stage="compress"
+        )
+        
+        accuracy, questions = None, 0
+        if val_problems > 0:
+            questions_text = generate_questions(content, api_key, model, val_problems, max_wait)
+            if questions_text:
+                _, results = solve_questions_with_cheatsheet(questions_text, summary, api_key, model, max_wait)
+                if results:
+                    questions = len(results)
+                    correct = sum(1 for r in results if "status" in r and "正确" in r["status"])
+                    accuracy = correct / questions
+                    print(f"[{name}] 验证正确率 {accuracy:.0%}（{correct}/{questions}）")
+        cache.save_summary(digest, limit, val_problems, settings, summary, accuracy, questions)
+        return dict(entry, summary=summary, accuracy=accuracy, cached=False)
+
+def fit_lecture_summary(entry, budget, api_key, model, max_wait, overshoot=0, on_overflow="retry"):
+    """把一讲的独立摘要压缩到分配的预算内；已满足预算时原样返回"""
+    if count_visible_chars(entry["summary"]) <= budget:
+        return entry["summary"]
+    lang_instruction = language_instruction(entry["summary"])
+    system_message = compress_system_message(2, budget, lang_instruction) + (
+        f"\n这是课程中一讲（{entry['name']}）的摘要，只需精简这一讲。"
+    )
+    call = guarded_call(budget, overshoot, on_overflow)
+    with tracing.span("fit_lecture", lecture=entry["name"], budget=budget):
+        return call(
+            prompt=entry["summary"],
+            api_key=api_key,
+            model=model,
+            max_tokens=DEFAULT_MAX_TOKENS,
+            system_message=system_message,
+            deep_thought=True,
+            timeout=max_wait,
+            stage="compress"
+        )
+
+def summarize_lectures(paths, api_key, model, final_limit, output_dir, cache_dir, val_problems,
+                       max_wait, workers=DEFAULT_REPAIR_WORKERS, overshoot=0, on_overflow="retry"):
+    """
+    多讲次模式：各讲并行修复、独立摘要和验证，按篇幅与难度分配预算后合并压缩为一份备忘录
+    
+    各讲的修复结果和独立摘要缓存在 cache_dir 中，增加一讲时只处理新增的一讲；
+    预算分配、按预算精简和最终合并每次运行都会重新进行。
+    """
+    cache = LectureCache(cache_dir)
+    
+    def run_parallel(func, items):
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [submit_in_context(pool, func, item) for item in items]
+            try:
+                return [future.result() for future in futures]
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+    
+    entries = run_parallel(
+        lambda path: process_lecture(path, cache, api_key, model, final_limit, val_problems,
+                                     max_wait, overshoot, on_overflow),
+        paths
+    )
+    budgets = allocate_budgets([e["chars"] for e in entries], [e["accuracy"] for e in entries],
+                               final_limit)
+    print("\n=== 各讲预算 ===")
+    for entry, budget in zip(entries, budgets):
+        entry["budget"] = budget
+        accuracy = "-" if entry["accuracy"] is None else f"{entry['accuracy']:.0%}"
+        print(f"{entry['name']}: {entry['chars']} 字符, 正确率 {accuracy}, 预算 {budget} 字"
+              f"{'（缓存）' if entry['cached'] else ''}")
+    
+    fitted = run_parallel(
+        lambda entry: fit_lecture_summary(entry, entry["budget"], api_key, model, max_wait,
+                                          overshoot, on_overflow),
+        entries
+    )
+    for i, (entry, summary) in enumerate(zip(entries, fitted), start=1):
+        save_iteration_data(output_dir, i, "lecture", summary)
+    with open(os.path.join(output_dir, "lectures.json"), 'w', encoding='utf-8') as f:
+        json.dump([{k: v for k, v in e.items() if k != "summary"} for e in entries],
+                  f, ensure_ascii=False, indent=2)
+    
+    merged = "\n\n".join(f"## {entry['name']}\n\n{summary}" for entry, summary in zip(entries, fitted))
+    save_iteration_data(output_dir, "0_merged", "gen", merged)
+    lang_instruction = language_instruction(merged)
+    allocation = "；".join(f"{e['name']} 约 {e['budget']} 字" for e in entries)
+    system_message = (
+        f"您是一位考试复习摘要专家。用户提供的是同一门课程各讲的复习摘要，请合并为一份考试复习备忘录，"
+        f"严格不超过 {final_limit} 字（可见字符）。"
+        "合并时去除各讲之间重复的定义和公式，统一术语和符号，按课程逻辑组织章节；"
+        f"各讲篇幅大致按以下分配（已按内容多少和难度确定）：{allocation}。"
+        f"保留**加粗**的关键考点，以Markdown格式输出；{lang_instruction}"
+    )
+    call = guarded_call(final_limit, overshoot, on_overflow)
+    print("\n=== 合并各讲摘要 ===")
+    with tracing.span("merge_lectures", lectures=len(entries)):
+        result = call(
+            prompt=merged,
+            api_key=api_key,
+            model=model,
+            max_tokens=DEFAULT_MAX_TOKENS,
+            system_message=system_message,
+            deep_thought=True,
+            timeout=max_wait,
+            stage="compress"
+        )
+    save_iteration_data(output_dir, "final", "gen", result)
+    return result
+
+def store_run(db_path, output_dir, params, started, status):
+    """将本次运行存入运行记录库；未指定 --runstore 时不做任何事"""
+    if not db_path:
+        return
+    try:
+        with runstore.RunStore(db_path) as store:
+            run_id = store.ingest_run(output_dir, params=params, status=status,
+                                      started=started, finished=time.time())
+        print(f"运行记录已存入 {db_path}（编号 #{run_id}），可用 python runstore.py --db {db_path} show {run_id} 查看")
+    except Exception as e:
+        print(f"运行记录入库失败: {e}", file=sys.stderr)
+
+def save_trace(tracer, output_dir):
+    """写出追踪文件并打印耗时最多的区间；未指定 --trace 时不做任何事"""
+    if tracer is None:
+        return
+    path = tracer.save(os.path.join(output_dir, "trace.json"))
+    print(f"\n追踪记录已保存到: {path}（可在 chrome://tracing 或 ui.perfetto.dev 打开）")
+    for t in tracer.summary()[:8]:
+        mem = f", 内存峰值 {t['max_mem_peak_kb']:.0f} KB" if t["max_mem_peak_kb"] is not None else ""
+        print(f"  {t['name']:<22} {t['count']:>4}次, 累计 {t['total_ms'] / 1000:.2f}秒{mem}")
+
+def apply_autotune(args, argv, content, final_limit):
+    """按历史运行推荐参数，只替换命令行中未给出的 geniter、valiter、valproblems 和 maxwait"""
+    if args.lectures:
+        print("多讲次模式不支持自动调参，按给定参数运行")
+        return
+    if content is None and args.pdf:
+        content = extract_text_from_pdf(args.pdf)
+    history = args.history or os.path.join(args.output_dir, "output_*")
+    tuner = autotune.Tuner(autotune.load_history(history), detect_language(content))
+    rec = tuner.recommend(count_visible_chars(content), final_limit, args.targetacc)
+    print(f"\n=== 自动调参（{rec['runs']} 次历史运行）===")
+    print(f"依据: {rec['basis']}")
+    given = given_options(argv)
+    for key in ("geniter", "valiter", "valproblems", "maxwait"):
+        if key not in given:
+            setattr(args, key, rec[key])
+            print(f"  {key} = {rec[key]}")
+        else:
+            print(f"  {key} = {getattr(args, key)}（命令行指定，推荐 {rec[key]}）")
+    if rec["predicted"]:
+        predicted = tuner.predict(vars(args), count_visible_chars(content), args.targetacc)
+        print(f"预计耗时: {autotune.format_duration(predicted['seconds'])}, 预计 token: {predicted['tokens']:.0f}")
+
+def build_parser():
     parser = argparse.ArgumentParser(description="生成考试复习备忘录")
-    parser.add_argument("--filename", required=True, help="输入文件路径，例如 input.txt")
-    parser.add_argument("--maxtoken", required=True, type=int, help="输入你对字数的限制，例如 4096")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--filename", help="输入文件路径，例如 input.txt")
+    source.add_argument("--pdf", help="直接输入 PDF：分节修复，每节修复完成后立即开始该节的首轮摘要")
+    source.add_argument("--lectures", nargs="+", metavar="FILE",
+                       help="多讲次模式：输入同一门课的多个讲义（PDF 或已修复的 TXT），各讲并行修复和摘要后合并为一份备忘录")
+    parser.add_argument("--maxtoken", required=True, type=int, nargs="+",
+                       help="输入你对字数的限制，例如 4096；给出多个值（如 3000 6000）时共用前几轮压缩，再并发生成各个限制的摘要")
     parser.add_argument("--apikey", required=True, type=str, help="输入你的 apikey，例如 sk-xxxx")
     parser.add_argument("--output_dir", help="输出目录", default="output")
     
@@ -411,18 +1191,140 @@ def main():
                        help=f"每次验证生成的题目数量 (默认: {DEFAULT_VAL_PROBLEMS})")
     parser.add_argument("--maxwait", type=int, default=DEFAULT_MAX_WAIT, 
                        help=f"每次API调用的最大等待时间(秒) (默认: {DEFAULT_MAX_WAIT})")
-    
-    args = parser.parse_args()
+    parser.add_argument("--patch", action="store_true",
+                       help="后续压缩与反馈优化只请求编辑操作并在本地应用，失败时回退为完整重写")
+    parser.add_argument("--targetacc", type=float, default=DEFAULT_TARGET_ACCURACY,
+                       help=f"验证正确率达到该值时提前结束验证阶段 (默认: {DEFAULT_TARGET_ACCURACY})")
+    parser.add_argument("--patience", type=int, default=DEFAULT_PATIENCE,
+                       help=f"正确率连续多少轮未提升时提前结束，0 表示不启用 (默认: {DEFAULT_PATIENCE})")
+    parser.add_argument("--adaptproblems", action="store_true",
+                       help="根据当前正确率的置信区间自动调整下一轮验证题目数")
+    parser.add_argument("--candidates", type=int, default=DEFAULT_CANDIDATES,
+                       help=f"每轮压缩生成的候选摘要数量，在本地择优 (默认: {DEFAULT_CANDIDATES})")
+    parser.add_argument("--candidate_mode", choices=["concurrent", "n"], default="concurrent",
+                       help="候选生成方式：concurrent 为并发请求，n 为使用 API 的 n 参数 (默认: concurrent)")
+    parser.add_argument("--transport", choices=["stream", "plain"], default="stream",
+                       help="API 调用的内部传输方式：stream 为流式接收并检测停顿，plain 为普通请求 (默认: stream)")
+    parser.add_argument("--firsttokentimeout", type=int, default=DEFAULT_FIRST_TOKEN_TIMEOUT,
+                       help=f"流式传输等待首个 token 的最长时间(秒) (默认: {DEFAULT_FIRST_TOKEN_TIMEOUT})")
+    parser.add_argument("--idletimeout", type=int, default=DEFAULT_IDLE_TIMEOUT,
+                       help=f"流式传输两个数据块之间的最长间隔(秒) (默认: {DEFAULT_IDLE_TIMEOUT})")
+    parser.add_argument("--overshoot", type=float, default=DEFAULT_OVERSHOOT,
+                       help=f"摘要输出超过字数限制的该倍数时提前中止生成，0 表示不启用 (默认: {DEFAULT_OVERSHOOT})")
+    parser.add_argument("--onoverflow", choices=["retry", "trim"], default="retry",
+                       help="提前中止后的处理：retry 为收紧指令重新生成一次，trim 为本地截断已生成部分 (默认: retry)")
+    parser.add_argument("--hedge", action="store_true",
+                       help="出题、解析等辅助调用超过历史耗时 P90 后发送对冲请求，取先返回者（额外请求不超过 20%%）")
+    parser.add_argument("--retrieval", action="store_true",
+                       help="反馈优化时只携带与未解答题目相关的原文片段（BM25 索引缓存在输入文件旁）")
+    parser.add_argument("--runstore", nargs="?", const=os.path.join("output", "runs.db"), default=None,
+                       help="运行结束后将参数、调用记录、验证得分和全部产物存入 SQLite 运行记录库 (默认路径: output/runs.db)")
+    parser.add_argument("--course", help="运行记录库中的课程名 (默认由输入文件名推断)")
+    tape = parser.add_mutually_exclusive_group()
+    tape.add_argument("--record", metavar="CASSETTE",
+                       help="录制每次 API 请求的响应（含流式数据块与时间）到磁带文件，以 .gz 结尾时压缩")
+    tape.add_argument("--replay", metavar="CASSETTE",
+                       help="不访问网络，从磁带文件回放响应；除 apikey 外的参数需与录制时一致")
+    parser.add_argument("--replayspeed", type=float, default=0,
+                       help="回放速度：0 为立即返回，1 为按录制时的耗时，2 为两倍速 (默认: 0)")
+    parser.add_argument("--routing", default="default",
+                       help="阶段路由预设：default 全部使用推理模型，fast 让出题、解析使用非推理模型；也可为 JSON 文件路径 (默认: default)")
+    parser.add_argument("--route", action="append", default=[],
+                       help="覆盖单个阶段的路由，格式 STAGE=MODEL[:TEMPERATURE[:MAX_TOKENS]]，可重复；"
+                            f"STAGE 可选 {', '.join(routing.STAGES)}")
+    parser.add_argument("--repairworkers", type=int, default=DEFAULT_REPAIR_WORKERS,
+                       help=f"--pdf 模式下并发修复、并发首轮摘要的线程数；--lectures 模式下并行处理的讲次数 (默认: {DEFAULT_REPAIR_WORKERS})")
+    parser.add_argument("--lecturecache",
+                       help="--lectures 模式下各讲修复结果与独立摘要的缓存目录 (默认: <output_dir>/lecture_cache)")
+    parser.add_argument("--strata", type=int, default=DEFAULT_MAX_STRATA,
+                       help=f"验证出题时原文最多切分的部分数，各部分按篇幅分配题目并行生成，每部分至少 {MIN_STRATUM_QUESTIONS} 道题，"
+                            f"1 为整篇一次出题 (默认: {DEFAULT_MAX_STRATA})")
+    parser.add_argument("--questionworkers", type=int, default=DEFAULT_QUESTION_WORKERS,
+                       help=f"分部分出题的并发请求数 (默认: {DEFAULT_QUESTION_WORKERS})")
+    parser.add_argument("--warmstart", "--warm-start", metavar="FINAL_SUMMARY",
+                       help="从同一门课上一次运行的 final_summary.txt 热启动：跳过压缩阶段直接验证与优化，沿用原文未变小节的旧题")
+    parser.add_argument("--paper",
+                       help="按实际版面判断篇幅：纸张尺寸（如 a4、b5、letter，加 -l 为横向），摘要能排入版面后不再继续压缩")
+    parser.add_argument("--pages", type=int, default=DEFAULT_PAGES,
+                       help=f"--paper 版面的页数（双面一张纸为 2）(默认: {DEFAULT_PAGES})")
+    parser.add_argument("--columns", type=int, default=DEFAULT_COLUMNS,
+                       help=f"--paper 版面每页的分栏数 (默认: {DEFAULT_COLUMNS})")
+    parser.add_argument("--fontsize", type=float, default=DEFAULT_FONT_SIZE,
+                       help=f"--paper 版面的正文字号（点）(默认: {DEFAULT_FONT_SIZE})")
+    parser.add_argument("--font", default=DEFAULT_FONT,
+                       help=f"--paper 版面的字体：PyMuPDF 内置字体名或字体文件路径 (默认: {DEFAULT_FONT})")
+    parser.add_argument("--autotune", action="store_true",
+                       help="根据以往运行（--history）推荐 geniter、valiter、valproblems 和 maxwait，替换未在命令行给出的这几项，并预测耗时")
+    parser.add_argument("--history",
+                       help="--autotune 使用的历史运行目录通配符 (默认: <output_dir>/output_*)")
+    parser.add_argument("--trace", action="store_true",
+                       help="记录各阶段与每次 API 调用的耗时，写入输出目录下的 trace.json（Chrome/Perfetto 格式）")
+    parser.add_argument("--tracemem", action="store_true",
+                       help="追踪时同时用 tracemalloc 记录主线程上各区间的内存峰值（会拖慢本地处理）")
+    return parser
 
-    content = read_file_content(args.filename)
-    if content is None: sys.exit(1)
-    
+def given_options(argv):
+    """命令行中实际给出的参数名（dest），与 argparse 一样识别前缀缩写和 --key=value 写法"""
+    parser = build_parser()
+    for action in parser._actions:
+        action.default = argparse.SUPPRESS
+    return set(vars(parser.parse_args(argv)))
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
     try:
-        final_limit = args.maxtoken
-        if final_limit <= 0: raise ValueError
-    except Exception:
+        routes = routing.RoutingTable.from_preset(args.routing).override(args.route)
+    except ValueError as e:
+        parser.error(str(e))
+
+    content = None
+    if args.filename:
+        content = read_file_content(args.filename)
+        if content is None: sys.exit(1)
+    elif args.pdf and not os.path.isfile(args.pdf):
+        print(f"错误: PDF 文件 '{args.pdf}' 未找到。", file=sys.stderr)
+        sys.exit(1)
+    elif args.lectures:
+        missing = [path for path in args.lectures if not os.path.isfile(path)]
+        if missing:
+            print(f"错误: 讲义文件未找到: {', '.join(missing)}", file=sys.stderr)
+            sys.exit(1)
+    
+    # 去重并保持顺序；第一个限制的结果作为主输出（final_summary.txt）
+    budgets = list(dict.fromkeys(args.maxtoken))
+    if min(budgets) <= 0:
         print("错误: 字数限制需大于 0。", file=sys.stderr)
         sys.exit(1)
+    if args.lectures and len(budgets) > 1:
+        print("错误: 多讲次模式只支持一个字数限制。", file=sys.stderr)
+        sys.exit(1)
+    final_limit = budgets[0]
+    if args.warmstart and not args.filename:
+        print("错误: 热启动需要以 --filename 给出已修复的新原文。", file=sys.stderr)
+        sys.exit(1)
+    if args.warmstart and len(budgets) > 1:
+        print("错误: 热启动只支持一个字数限制。", file=sys.stderr)
+        sys.exit(1)
+    if args.paper and len(budgets) > 1:
+        print("错误: 版面适配（--paper）只支持一个字数限制。", file=sys.stderr)
+        sys.exit(1)
+    if args.warmstart and not os.path.isfile(args.warmstart):
+        print(f"错误: 上一次的摘要 '{args.warmstart}' 未找到。", file=sys.stderr)
+        sys.exit(1)
+
+    page_fitter = None
+    if args.paper:
+        try:
+            page_fitter = PageFitter(PageSpec.from_paper(
+                args.paper, pages=args.pages, columns=args.columns, font_size=args.fontsize, font=args.font
+            ))
+        except (ValueError, RuntimeError) as e:
+            print(f"错误: 无法创建版面: {e}", file=sys.stderr)
+            sys.exit(1)
+
+    if args.autotune:
+        apply_autotune(args, sys.argv[1:] if argv is None else argv, content, final_limit)
 
     api_key = args.apikey
     if not api_key:
@@ -431,29 +1333,178 @@ def main():
     
     output_dir = create_output_dir(args.output_dir)
     print(f"所有输出文件将保存到: {output_dir}")
+    started = time.time()
+    params = {k: v for k, v in vars(args).items() if k != "apikey"}
+    if args.lectures:
+        # 多讲次模式默认以讲义所在目录名作为课程名
+        params["course"] = args.course or os.path.basename(os.path.dirname(os.path.abspath(args.lectures[0])))
+    else:
+        params["course"] = args.course or runstore.course_name(args.filename or args.pdf)
+    runstore.write_params(output_dir, params)
+    telemetry.configure(os.path.join(output_dir, "telemetry.jsonl"))
+    tracer = tracing.Tracer(memory=args.tracemem) if args.trace or args.tracemem else None
+    tracing.configure(tracer)
+    tape_session = None
+    if args.record:
+        tape_session = cassette.recording_session(args.record)
+    elif args.replay:
+        try:
+            tape_session = cassette.replay_session(args.replay, args.replayspeed)
+        except (OSError, ValueError) as e:
+            print(f"错误: 无法读取磁带 '{args.replay}': {e}", file=sys.stderr)
+            sys.exit(1)
+    configure_transport(
+        streaming=args.transport == "stream",
+        first_token_timeout=args.firsttokentimeout,
+        idle_timeout=args.idletimeout,
+        session=tape_session
+    )
+    if args.hedge and tape_session is not None:
+        # 对冲请求使用独立会话且结果取决于时序，录制和回放时均不启用
+        print("录制/回放模式下不启用对冲请求")
+    elif args.hedge:
+        # 从以往运行的遥测记录学习各阶段的耗时分布
+        hedge.configure(hedge.HedgePolicy.from_history(
+            os.path.join(args.output_dir, "output_*", "telemetry.jsonl")
+        ))
     
     print("\n=== 配置参数 ===")
     print(f"超时设置: {args.maxwait}秒")
-    print(f"最终字数限制: {final_limit}字")
+    if args.transport == "stream":
+        print(f"流式传输: 首个 token 超时 {args.firsttokentimeout}秒, 数据块间隔超时 {args.idletimeout}秒")
+    print(f"最终字数限制: {'、'.join(map(str, budgets))}字")
     print(f"生成阶段迭代轮数: {args.geniter}")
     print(f"验证阶段迭代轮数: {args.valiter}")
     print(f"题目数量: {args.valproblems}道选择题/验证迭代")
+    print(f"编辑操作模式: {'开启' if args.patch else '关闭'}")
+    print(f"原文检索模式: {'开启' if args.retrieval else '关闭'}")
+    print(f"每轮压缩候选数: {args.candidates}")
+    if args.overshoot > 0:
+        print(f"长度守卫: 超过限制 {args.overshoot} 倍时中止并{'重新生成' if args.onoverflow == 'retry' else '本地截断'}")
+    print(f"提前结束条件: 正确率≥{args.targetacc:.0%} 或连续 {args.patience} 轮未提升")
     
     model = "deepseek-reasoner"
-    final_result = iterative_summarize(
-        content, 
-        api_key=api_key, 
-        model=model,
-        final_limit=final_limit,
-        output_dir=output_dir,
-        gen_iter=args.geniter,
-        val_iter=args.valiter,
-        val_problems=args.valproblems,
-        max_wait=args.maxwait
-    )
+    routing.configure(routes)
+    effective = {}
+    for stage in routing.STAGES:
+        if stage == "repair":
+            continue
+        route = routes.resolve(stage, model, 0.7, DEFAULT_MAX_TOKENS)
+        effective[stage] = route._asdict()
+        print(f"阶段路由 {stage:<9}: {route.model}, temperature={route.temperature}, max_tokens={route.max_tokens}")
+    with open(os.path.join(output_dir, "routing.json"), 'w', encoding='utf-8') as f:
+        json.dump({"preset": args.routing, "overrides": args.route, "stages": effective},
+                  f, ensure_ascii=False, indent=2)
+    
+    if args.lectures:
+        print(f"\n=== 多讲次模式：{len(args.lectures)} 讲 ===")
+        try:
+            final_result = summarize_lectures(
+                args.lectures, api_key, model, final_limit, output_dir,
+                args.lecturecache or os.path.join(args.output_dir, "lecture_cache"),
+                args.valproblems, args.maxwait, args.repairworkers, args.overshoot, args.onoverflow
+            )
+        except (DeepSeekAPIError, OSError, ValueError) as e:
+            print(f"Error: 多讲次摘要失败（{type(e).__name__}: {e}）", file=sys.stderr)
+            final_result = None
+    else:
+        first_pass = None
+        if args.pdf:
+            print("\n=== 修复 PDF 并同时生成首轮摘要 ===")
+            try:
+                content, first_pass, args.filename = repair_and_summarize(
+                    args.pdf, api_key, model, max(budgets), args.geniter, output_dir, args.output_dir,
+                    args.maxwait, args.repairworkers, args.overshoot, args.onoverflow
+                )
+            except (DeepSeekAPIError, ValueError) as e:
+                print(f"Error: PDF 修复或首轮摘要失败（{type(e).__name__}: {e}）", file=sys.stderr)
+                save_trace(tracer, output_dir)
+                store_run(args.runstore, output_dir, params, started, "failed")
+                sys.exit(1)
+    
+        # 小节树只解析一次（并缓存到原文旁），供出题分部分、候选探针和检索共用
+        with tracing.span("parse_sections"):
+            tree = SectionTree.load_or_parse(content, cache_path_for(args.filename))
+        source_index = None
+        if args.retrieval:
+            # 检索段落沿用小节树的切分边界，不会切断公式或代码块
+            with tracing.span("build_index"):
+                stem = os.path.splitext(args.filename)[0]
+                source_index = SourceIndex.load_or_build(
+                    content, f"{stem}_bm25.json", passages=tree.chunks(DEFAULT_PASSAGE_CHARS)
+                )
+            print(f"检索索引: {len(source_index.passages)} 个原文段落")
+    
+        def make_controller():
+            return ConvergenceController(
+                target_accuracy=args.targetacc,
+                patience=args.patience,
+                ci_half_width=DEFAULT_CI_HALF_WIDTH if args.adaptproblems else 0
+            )
+    
+        summarize_kwargs = dict(
+            api_key=api_key, 
+            model=model,
+            val_iter=args.valiter,
+            val_problems=args.valproblems,
+            max_wait=args.maxwait,
+            patch_mode=args.patch,
+            source_index=source_index,
+            num_candidates=args.candidates,
+            candidate_mode=args.candidate_mode,
+            overshoot=args.overshoot,
+            on_overflow=args.onoverflow,
+            max_strata=args.strata,
+            question_workers=args.questionworkers,
+            page_fitter=page_fitter,
+            section_tree=tree
+        )
+        if args.warmstart:
+            warm = prepare_warm_start(args.warmstart, content)
+            print(f"\n=== 热启动：{args.warmstart} ===")
+            print(f"原文 {warm.total_units} 个小节中 {len(warm.changed_spans)} 个有变化，"
+                  f"可沿用的旧题 {len(warm.questions)} 道")
+            # 保存新原文，供下一次热启动比较
+            save_iteration_data(output_dir, "0_raw", "gen", content)
+            # 旧摘要基本符合字数限制时不再压缩，否则只执行最后一轮压缩
+            fits = count_visible_chars(warm.summary) <= final_limit * WARMSTART_TOLERANCE
+            final_result = iterative_summarize(
+                content,
+                final_limit=final_limit,
+                output_dir=output_dir,
+                gen_iter=args.geniter,
+                controller=make_controller(),
+                resume=(warm.summary, 0 if fits else final_limit + 1),
+                warm_start=warm,
+                **summarize_kwargs
+            )
+        elif len(budgets) == 1:
+            final_result = iterative_summarize(
+                content,
+                final_limit=final_limit,
+                output_dir=output_dir,
+                gen_iter=args.geniter,
+                controller=make_controller(),
+                first_pass=first_pass,
+                **summarize_kwargs
+            )
+        else:
+            branch_results = summarize_branches(
+                content, budgets, output_dir, make_controller, args.geniter, first_pass,
+                **summarize_kwargs
+            )
+            final_result = branch_results[final_limit]
+            for budget, result in branch_results.items():
+                if budget != final_limit and result is not None:
+                    path = os.path.join(output_dir, f"final_summary_{budget}.txt")
+                    with open(path, 'w', encoding='utf-8') as f:
+                        f.write(result)
+                    print(f"{budget} 字的摘要已保存到: {path}（{count_visible_chars(result)}字）")
     
     if final_result is None:
         print("Error: 摘要过程失败。", file=sys.stderr)
+        save_trace(tracer, output_dir)
+        store_run(args.runstore, output_dir, params, started, "failed")
         sys.exit(1)
         
     output_path = os.path.join(output_dir, "final_summary.txt")
@@ -462,6 +1513,32 @@ def main():
     print(f"\n=== 最终结果 ===")
     print(f"最终摘要已成功生成并保存到: {output_path}")
     print(f"摘要长度: {count_visible_chars(final_result)}字")
+    if page_fitter is not None:
+        fit = page_fitter.measure(final_result)
+        layout_path = page_fitter.render(final_result, os.path.join(output_dir, "final_layout.pdf"))
+        print(f"版面: 占 {fit.used:.0f}/{fit.capacity} 行（{'可以排入' if fit.fits else f'超出 {math.ceil(fit.overflow)} 行'}），"
+              f"排版预览: {layout_path}")
+        for line in overflow_report(fit):
+            print(f"  {line}")
+    
+    usage = telemetry.summarize()
+    print(f"API 调用: {usage['calls']}次, 累计耗时: {usage['latency']:.1f}秒")
+    print(f"输入 token: {usage['prompt_tokens']}, 输出 token: {usage['completion_tokens']}, "
+          f"缓存命中 token: {usage['prompt_cache_hit_tokens']} "
+          f"({usage['cache_hit_ratio']:.1%})")
+    for g in telemetry.summarize_stages():
+        print(f"  {g['stage'] or '-':<14} {g['model']:<18} {g['calls']:>3}次, 平均耗时 {g['mean_latency']:.1f}秒, "
+              f"输出 token {g['completion_tokens']}")
+    if hedge.get_policy() is not None:
+        stats = hedge.get_policy().stats()
+        print(f"对冲请求: {stats['hedges']}次 / {stats['calls']}次调用, 对冲胜出 {stats['hedge_wins']}次")
+    if args.record:
+        print(f"磁带已录制: {args.record}")
+    elif args.replay:
+        adapter = tape_session.get_adapter("https://")
+        print(f"磁带回放: {adapter.served} 条响应, 未使用 {adapter.remaining()} 条")
+    save_trace(tracer, output_dir)
+    store_run(args.runstore, output_dir, params, started, "completed")
     
     print("\n=== 输出文件说明 ===")
     print("| 文件名             | 说明                                                         |")
@@ -472,9 +1549,28 @@ def main():
     print("| valX.txt           | Stage 2 的第 X 轮的验证题目                                     |")
     print("| resultX.txt        | Stage 2 的第 X 轮的题目解答                                    |")
     print("| resultX.json       | Stage 2 的第 X 轮的题目解答的统计                               |")
+    print("| coverageX.json     | Stage 2 的第 X 轮各原文部分的出题数与正确率（累计及本轮）       |")
     print("| visualX.txt        | Stage 2 的第 X 轮的题目解答的可视化颜色条                        |")
     print("| genX_post.txt      | Stage 2 的第 X 轮的输出                                 |")
+    if args.lectures:
+        print("| lectureX.txt       | --lectures 模式下第 X 讲按预算精简后的摘要                    |")
+        print("| lectures.json      | 各讲篇幅、验证正确率、分配的预算及是否命中缓存                |")
+    if len(budgets) > 1:
+        print("| final_summary_N.txt | 多个字数限制时，限制为 N 字的最终输出（过程文件在 maxtoken_N/）|")
+        print("| shared/            | 多个字数限制共用的前几轮压缩                                  |")
+    if args.pdf:
+        print("| repairX.txt        | --pdf 模式下第 X 节的修复结果                                 |")
+    print("| candidatesX.json   | 第 X 轮压缩的候选得分排名（genX_candY.txt 为各候选）          |")
+    print("| patchX.txt         | --patch 模式下第 X 轮应用的编辑操作                           |")
+    print("| convergence.json   | 验证阶段每轮正确率、置信区间及提前结束原因                     |")
     print("| final_summary.txt  | 最终输出                                             |")
+    if page_fitter is not None:
+        print("| final_layout.pdf   | --paper 版面下最终输出的排版预览                              |")
+    print("| telemetry.jsonl    | 每次 API 调用的耗时与 token 用量（含缓存命中）                |")
+    print("| params.json        | 本次运行的参数（不含 API key）                                |")
+    print("| routing.json       | 各阶段实际使用的模型、temperature 和 max_tokens               |")
+    if tracer is not None:
+        print("| trace.json         | --trace 模式下各阶段耗时的追踪记录（Chrome/Perfetto 格式）    |")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
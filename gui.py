@@ -5,11 +5,14 @@ import os
 import threading
 import sys
 
+import autotune
+from mdtext import count_visible_chars, detect_language
+
 class PDFSummarizerApp:
     def __init__(self, root):
         self.root = root
         self.root.title("PDF 摘要生成工具")
-        self.root.geometry("600x500")
+        self.root.geometry("600x650")
         
         # 创建主框架
         self.main_frame = ttk.Frame(root, padding="10")
@@ -66,17 +69,43 @@ class PDFSummarizerApp:
         self.max_wait_spin.grid(row=8, column=1, sticky=tk.W, pady=5)
         self.max_wait_spin.set("300")
         
+        # 阶段模型路由
+        ttk.Label(self.main_frame, text="模型路由:").grid(row=9, column=0, sticky=tk.W, pady=5)
+        self.routing_combo = ttk.Combobox(self.main_frame, state="readonly", width=47, values=[
+            "default - 全部阶段使用 deepseek-reasoner",
+            "fast - 出题、解析使用 deepseek-chat",
+        ])
+        self.routing_combo.grid(row=9, column=1, sticky=tk.W, pady=5)
+        self.routing_combo.current(0)
+        
+        # 运行记录库
+        self.runstore_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(self.main_frame, text="保存到运行记录库 (输出目录/runs.db)",
+                        variable=self.runstore_var).grid(row=10, column=0, columnspan=3, sticky=tk.W, pady=5)
+        
+        # 流水线模式
+        self.overlap_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(self.main_frame, text="流水线模式 (分节修复 PDF，同时开始首轮摘要)",
+                        variable=self.overlap_var).grid(row=11, column=0, columnspan=3, sticky=tk.W, pady=5)
+        
+        # 预计耗时（根据输出目录中的历史运行）
+        self.predict_label = ttk.Label(self.main_frame, text="预计耗时: 选择PDF后估算")
+        self.predict_label.grid(row=12, column=0, columnspan=2, sticky=tk.W, pady=5)
+        ttk.Button(self.main_frame, text="自动调参", command=lambda: self.estimate(apply=True)).grid(
+            row=12, column=2, sticky=tk.W, pady=5)
+        self.input_stats = None
+        
         # 进度条
         self.progress = ttk.Progressbar(self.main_frame, orient="horizontal", length=400, mode="determinate")
-        self.progress.grid(row=9, column=0, columnspan=3, pady=20)
+        self.progress.grid(row=13, column=0, columnspan=3, pady=20)
         
         # 状态标签
         self.status_label = ttk.Label(self.main_frame, text="准备就绪", foreground="blue")
-        self.status_label.grid(row=10, column=0, columnspan=3, pady=5)
+        self.status_label.grid(row=14, column=0, columnspan=3, pady=5)
         
         # 按钮框架
         self.button_frame = ttk.Frame(self.main_frame)
-        self.button_frame.grid(row=11, column=0, columnspan=3, pady=10)
+        self.button_frame.grid(row=15, column=0, columnspan=3, pady=10)
         
         # 开始按钮
         self.start_button = ttk.Button(self.button_frame, text="开始处理", command=self.start_processing)
@@ -99,6 +128,54 @@ class PDFSummarizerApp:
         if file_path:
             self.pdf_path_entry.delete(0, tk.END)
             self.pdf_path_entry.insert(0, file_path)
+            self.input_stats = None
+            self.estimate()
+    
+    def estimate(self, apply=False):
+        """在后台估算当前参数的耗时；apply 为真时把推荐参数填入各输入框"""
+        pdf_path = self.pdf_path_entry.get()
+        if not pdf_path or not os.path.exists(pdf_path):
+            self.predict_label.config(text="预计耗时: 请先选择PDF文件")
+            return
+        try:
+            params = {"geniter": int(self.gen_iter_spin.get()), "valiter": int(self.val_iter_spin.get())}
+            max_token = int(self.max_token_spin.get())
+        except ValueError:
+            messagebox.showerror("错误", "参数必须是整数")
+            return
+        self.predict_label.config(text="预计耗时: 估算中...")
+        history = os.path.join(self.output_dir_entry.get() or "output", "output_*")
+        threading.Thread(target=self.run_estimate, args=(pdf_path, history, params, max_token, apply),
+                         daemon=True).start()
+    
+    def run_estimate(self, pdf_path, history, params, max_token, apply):
+        try:
+            if self.input_stats is None or self.input_stats[0] != pdf_path:
+                # 只在本地提取文本统计篇幅，不调用 API
+                from fix import extract_text_from_pdf
+                content = extract_text_from_pdf(pdf_path)
+                self.input_stats = (pdf_path, count_visible_chars(content), detect_language(content))
+            _, chars, language = self.input_stats
+            tuner = autotune.Tuner(autotune.load_history(history), language)
+            rec = tuner.recommend(chars, max_token)
+            if apply:
+                params = {"geniter": rec["geniter"], "valiter": rec["valiter"]}
+            predicted = tuner.predict(params, chars) if tuner.runs else None
+        except Exception as e:
+            self.root.after(0, lambda: self.predict_label.config(text=f"预计耗时: 估算失败（{e}）"))
+            return
+        self.root.after(0, lambda: self.show_estimate(rec, predicted, apply))
+    
+    def show_estimate(self, rec, predicted, apply):
+        if apply:
+            for spin, key in ((self.gen_iter_spin, "geniter"), (self.val_iter_spin, "valiter"),
+                              (self.val_problems_spin, "valproblems"), (self.max_wait_spin, "maxwait")):
+                spin.set(str(rec[key]))
+        if predicted is None:
+            self.predict_label.config(text="预计耗时: 输出目录中没有历史运行，无法估算")
+        else:
+            self.predict_label.config(text=f"预计耗时: 约 {autotune.format_duration(predicted['seconds'])}"
+                                           f"（基于 {rec['runs']} 次历史运行，不含PDF修复）")
     
     def browse_output_dir(self):
         dir_path = filedialog.askdirectory()
@@ -168,6 +245,9 @@ class PDFSummarizerApp:
             self.root.after(100, self.update_progress)
     
     def run_processing(self, pdf_path, api_key, output_dir, max_token, gen_iter, val_iter, val_problems, max_wait):
+        if self.overlap_var.get():
+            self.run_overlapped(pdf_path, api_key, output_dir, max_token, gen_iter, val_iter, val_problems, max_wait)
+            return
         try:
             # 第一步：使用fix.py处理PDF
             self.update_status("正在转换PDF为文本...")
@@ -177,6 +257,8 @@ class PDFSummarizerApp:
                 "--api_key", api_key,
                 "--output_dir", output_dir
             ]
+            routing_preset = self.routing_combo.get().split(" ", 1)[0]
+            fix_cmd += ["--routing", routing_preset]
             
             self.progress["value"] = 10
             result = subprocess.run(fix_cmd, capture_output=True, text=True)
@@ -201,37 +283,63 @@ class PDFSummarizerApp:
             self.update_status("PDF转换完成，正在生成摘要...")
             
             # 第二步：使用gen.py生成摘要
-            gen_cmd = [
-                sys.executable, "gen.py",
-                "--filename", input_txt,
-                "--maxtoken", str(max_token),
-                "--apikey", api_key,
-                "--output_dir", output_dir,
-                "--geniter", str(gen_iter),
-                "--valiter", str(val_iter),
-                "--valproblems", str(val_problems),
-                "--maxwait", str(max_wait)
-            ]
+            gen_cmd = self.build_gen_cmd(["--filename", input_txt], api_key, output_dir, max_token,
+                                         gen_iter, val_iter, val_problems, max_wait)
             
             result = subprocess.run(gen_cmd, capture_output=True, text=True)
             self.progress["value"] = 90
+            self.report_gen_result(result, output_dir)
             
-            if result.returncode != 0:
-                self.update_status(f"摘要生成失败: {result.stderr}", "red")
-            else:
-                self.update_status("处理完成！", "green")
-                self.progress["value"] = 100
-                
-                # 显示结果路径
-                final_summary = os.path.join(output_dir, "final_summary.txt")
-                messagebox.showinfo("完成", f"处理完成！最终摘要已保存到:\n{final_summary}")
-            
         except Exception as e:
             self.update_status(f"处理出错: {str(e)}", "red")
         finally:
             self.processing = False
             self.root.after(0, self.reset_buttons)
     
+    def run_overlapped(self, pdf_path, api_key, output_dir, max_token, gen_iter, val_iter, val_problems, max_wait):
+        """流水线模式：由 gen.py 分节修复 PDF，每节修复完成后立即开始该节的首轮摘要"""
+        try:
+            self.update_status("正在分节修复PDF并生成首轮摘要...")
+            self.progress["value"] = 10
+            gen_cmd = self.build_gen_cmd(["--pdf", pdf_path], api_key, output_dir, max_token,
+                                         gen_iter, val_iter, val_problems, max_wait)
+            result = subprocess.run(gen_cmd, capture_output=True, text=True)
+            self.progress["value"] = 90
+            self.report_gen_result(result, output_dir)
+        except Exception as e:
+            self.update_status(f"处理出错: {str(e)}", "red")
+        finally:
+            self.processing = False
+            self.root.after(0, self.reset_buttons)
+    
+    def build_gen_cmd(self, source_args, api_key, output_dir, max_token, gen_iter, val_iter, val_problems, max_wait):
+        gen_cmd = [
+            sys.executable, "gen.py",
+            *source_args,
+            "--maxtoken", str(max_token),
+            "--apikey", api_key,
+            "--output_dir", output_dir,
+            "--geniter", str(gen_iter),
+            "--valiter", str(val_iter),
+            "--valproblems", str(val_problems),
+            "--maxwait", str(max_wait),
+            "--routing", self.routing_combo.get().split(" ", 1)[0]
+        ]
+        if self.runstore_var.get():
+            gen_cmd += ["--runstore", os.path.join(output_dir, "runs.db")]
+        return gen_cmd
+    
+    def report_gen_result(self, result, output_dir):
+        if result.returncode != 0:
+            self.update_status(f"摘要生成失败: {result.stderr}", "red")
+        else:
+            self.update_status("处理完成！", "green")
+            self.progress["value"] = 100
+            
+            # 显示结果路径
+            final_summary = os.path.join(output_dir, "final_summary.txt")
+            messagebox.showinfo("完成", f"处理完成！最终摘要已保存到:\n{final_summary}")
+    
     def reset_buttons(self):
         self.start_button.config(state=tk.NORMAL)
         self.cancel_button.config(state=tk.DISABLED)
@@ -0,0 +1,155 @@
+import contextvars
+import glob
+import math
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Optional, Callable, Iterable, List, Dict, Any
+
+import telemetry
+
+logger = logging.getLogger("DeepSeekAPI")
+
+DEFAULT_PERCENTILE = 0.9
+DEFAULT_MIN_SAMPLES = 5
+DEFAULT_MAX_EXTRA_FRACTION = 0.2
+DEFAULT_MIN_DELAY = 5.0
+# 默认只对短小的辅助调用做对冲：出题、解析
+DEFAULT_STAGES = ("question", "parse")
+
+_policy: Optional["HedgePolicy"] = None
+
+def configure(policy: Optional["HedgePolicy"]) -> None:
+    """设置全局对冲策略，None 表示关闭对冲"""
+    global _policy
+    _policy = policy
+
+def get_policy() -> Optional["HedgePolicy"]:
+    return _policy
+
+def percentile(values: List[float], q: float) -> float:
+    """线性插值分位数"""
+    ordered = sorted(values)
+    if not ordered:
+        raise ValueError("空样本无法计算分位数")
+    pos = (len(ordered) - 1) * q
+    lo, hi = math.floor(pos), math.ceil(pos)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (pos - lo)
+
+class HedgePolicy:
+    """
+    对冲请求策略
+
+    调用耗时超过同阶段、同模型历史耗时的 percentile 分位数后，再发送一份相同的请求，
+    取先返回的结果并取消另一份。额外请求数不超过总调用数的 max_extra_fraction。
+    """
+
+    def __init__(self, percentile: float = DEFAULT_PERCENTILE,
+                 min_samples: int = DEFAULT_MIN_SAMPLES,
+                 max_extra_fraction: float = DEFAULT_MAX_EXTRA_FRACTION,
+                 min_delay: float = DEFAULT_MIN_DELAY,
+                 stages: Optional[Iterable[str]] = DEFAULT_STAGES,
+                 history: Optional[List[Dict[str, Any]]] = None):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.max_extra_fraction = max_extra_fraction
+        self.min_delay = min_delay
+        self.stages = None if stages is None else set(stages)
+        self.history = list(history or [])
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_history(cls, pattern: str, **kwargs) -> "HedgePolicy":
+        """从以往运行的 telemetry.jsonl（支持通配符）学习耗时分布"""
+        history = []
+        for path in glob.glob(pattern):
+            history.extend(telemetry.load_records(path))
+        logger.info(f"对冲策略载入 {len(history)} 条历史调用记录")
+        return cls(history=history, **kwargs)
+
+    def applies(self, stage: Optional[str]) -> bool:
+        return self.stages is None or stage in self.stages
+
+    def delay_for(self, stage: Optional[str], model: str) -> Optional[float]:
+        """返回发送对冲请求前的等待秒数；样本不足时返回 None（不对冲）"""
+        samples = [
+            float(r["latency"])
+            for r in self.history + telemetry.get_records()
+            if r.get("stage") == stage and r.get("model") == model
+            and r.get("latency")
+        ]
+        if len(samples) < self.min_samples:
+            return None
+        return max(self.min_delay, percentile(samples, self.percentile))
+
+    def _acquire(self) -> bool:
+        """在额外花费上限内申请一次对冲"""
+        with self._lock:
+            if self.hedges + 1 > self.max_extra_fraction * self.calls:
+                return False
+            self.hedges += 1
+            return True
+
+    def run(self, attempt: Callable[[Dict[str, Any]], Any], stage: Optional[str],
+            model: str) -> Any:
+        """
+        以对冲方式执行请求
+
+        参数:
+            attempt: 执行一次完整请求的函数；接收一个字典，应在发送请求前在其中登记 "cancel"
+                     回调，以便在另一份请求胜出时被取消；对冲的备份请求的字典中 "backup" 为真
+            stage: 调用所属阶段
+            model: 模型名称
+
+        返回:
+            先成功完成的请求结果；两份请求都失败时抛出最先失败的异常
+        """
+        with self._lock:
+            self.calls += 1
+        delay = self.delay_for(stage, model)
+        if delay is None:
+            return attempt({})
+
+        pool = ThreadPoolExecutor(max_workers=2)
+        handles: Dict[Any, Dict[str, Any]] = {}
+        try:
+            primary_handle: Dict[str, Any] = {}
+            primary = pool.submit(contextvars.copy_context().run, attempt, primary_handle)
+            handles[primary] = primary_handle
+            done, _ = wait([primary], timeout=delay)
+            if done or not self._acquire():
+                return primary.result()
+
+            logger.info(f"请求耗时超过 {delay:.1f} 秒（P{self.percentile * 100:.0f}），发送对冲请求")
+            backup_handle: Dict[str, Any] = {"backup": True}
+            backup = pool.submit(contextvars.copy_context().run, attempt, backup_handle)
+            handles[backup] = backup_handle
+
+            pending = {primary, backup}
+            first_error = None
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        if future is backup:
+                            with self._lock:
+                                self.hedge_wins += 1
+                        return future.result()
+                    first_error = first_error or future.exception()
+            raise first_error
+        finally:
+            # 取消仍在进行的请求，不等待其线程结束
+            for future, handle in handles.items():
+                if not future.done() and handle.get("cancel"):
+                    try:
+                        handle["cancel"]()
+                    except Exception:
+                        pass
+            pool.shutdown(wait=False)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"calls": self.calls, "hedges": self.hedges, "hedge_wins": self.hedge_wins}
@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+import logging
+from typing import Optional, List, Dict, Any, Sequence
+
+logger = logging.getLogger("DeepSeekAPI")
+
+LECTURES_VERSION = 1
+# 单讲独立摘要的压缩比（修复后全文字符数 / 摘要字数）及其上下限
+LECTURE_COMPRESSION_RATIO = 5
+MIN_LECTURE_LIMIT = 300
+# 难度权重：验证正确率为 0 的讲次按篇幅计的预算放大到 1 + DIFFICULTY_WEIGHT 倍
+DIFFICULTY_WEIGHT = 1.0
+# 分配给单讲的最少字数
+MIN_LECTURE_BUDGET = 100
+
+def file_digest(path: str) -> str:
+    """文件内容的 SHA-256，作为缓存键的一部分；文件改名或移动不影响命中"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def settings_digest(settings: Dict[str, Any]) -> str:
+    """生成设置（模型、各阶段路由、提示词版本等）的短摘要，作为缓存键的一部分"""
+    payload = json.dumps(settings, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+def lecture_name(path: str) -> str:
+    """讲次名称：去掉扩展名和 fix.py 追加的 _input 后缀的文件名"""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return stem[:-len("_input")] if stem.endswith("_input") else stem
+
+def lecture_limit(repaired_chars: int, final_limit: int) -> int:
+    """
+    单讲独立摘要的字数限制：只取决于该讲篇幅和最终字数限制，与其他讲次无关
+
+    因此增加或删除讲次不会使已有讲次的缓存失效。
+    """
+    return max(MIN_LECTURE_LIMIT, min(2 * final_limit, repaired_chars // LECTURE_COMPRESSION_RATIO))
+
+def allocate_budgets(sizes: Sequence[int], accuracies: Sequence[Optional[float]],
+                     total: int, minimum: int = MIN_LECTURE_BUDGET) -> List[int]:
+    """
+    按篇幅和验证难度把总字数预算分配到各讲
+
+    权重为 篇幅 ×（1 + DIFFICULTY_WEIGHT ×（1 − 正确率）），未验证的讲次按正确率 0.5 计；
+    每讲至少 minimum 字（总预算不足时平均分配），按最大余数法取整，合计恰好为 total。
+    """
+    n = len(sizes)
+    if n == 0:
+        return []
+    minimum = min(minimum, total // n)
+    weights = [max(size, 1) * (1 + DIFFICULTY_WEIGHT * (1 - (0.5 if acc is None else acc)))
+               for size, acc in zip(sizes, accuracies)]
+    spare = total - minimum * n
+    shares = [spare * w / sum(weights) for w in weights]
+    budgets = [minimum + int(s) for s in shares]
+    by_remainder = sorted(range(n), key=lambda i: shares[i] - int(shares[i]), reverse=True)
+    for i in by_remainder[:total - sum(budgets)]:
+        budgets[i] += 1
+    return budgets
+
+class LectureCache:
+    """
+    各讲中间结果的缓存目录
+
+    repaired/<文件哈希>.txt 保存 PDF 的修复结果（只取决于文件内容）；
+    summary/<文件哈希>_<字数限制>_<题目数>_<设置摘要>.json 保存该讲的独立摘要和验证正确率；
+    设置摘要（见 settings_digest）涵盖模型、各阶段路由和提示词，任一变化都不会命中旧结果。
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, kind: str, name: str) -> str:
+        return os.path.join(self.root, kind, name)
+
+    def load_repaired(self, digest: str) -> Optional[str]:
+        path = self._path("repaired", f"{digest}.txt")
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read()
+
+    def save_repaired(self, digest: str, content: str) -> None:
+        path = self._path("repaired", f"{digest}.txt")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+
+    def _summary_path(self, digest: str, limit: int, val_problems: int, settings: str) -> str:
+        return self._path("summary", f"{digest}_{limit}_{val_problems}_{settings}.json")
+
+    def load_summary(self, digest: str, limit: int, val_problems: int,
+                     settings: str) -> Optional[Dict[str, Any]]:
+        path = self._summary_path(digest, limit, val_problems, settings)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"讲次缓存无效，将重新生成: {str(e)}")
+            return None
+        if data.get("version") != LECTURES_VERSION or not data.get("summary"):
+            return None
+        return data
+
+    def save_summary(self, digest: str, limit: int, val_problems: int, settings: str,
+                     summary: str, accuracy: Optional[float], questions: int) -> None:
+        path = self._summary_path(digest, limit, val_problems, settings)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({
+                "version": LECTURES_VERSION,
+                "summary": summary,
+                "accuracy": accuracy,
+                "questions": questions,
+            }, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,103 @@
+import re
+
+def strip_markdown(text):
+    """移除Markdown语法"""
+    text = re.sub(r'```.*?```', '', text, flags=re.S)
+    text = re.sub(r'`([^`]+)`', r'\1', text)
+    text = re.sub(r'!\[([^\]]*)\]\([^\)]+\)', r'\1', text)
+    text = re.sub(r'\[([^\]]+)\]\([^\)]+\)', r'\1', text)
+    text = re.sub(r'(^|\n)#+\s*', r'\1', text)
+    text = re.sub(r'(\*\*|__)(.*?)\1', r'\2', text)
+    text = re.sub(r'(\*|_)(.*?)\1', r'\2', text)
+    text = re.sub(r'~~(.*?)~~', r'\1', text)
+    text = re.sub(r'(^|\n)>\s?', r'\1', text)
+    text = re.sub(r'(^|\n)[\-\*\+]\s+', r'\1', text)
+    text = re.sub(r'<[^>]+>', '', text)
+    return text
+
+def count_visible_chars(text):
+    """计算可见字符数"""
+    stripped = strip_markdown(text)
+    return len(re.sub(r"\s+", "", stripped))
+
+def detect_language(text):
+    """检测文本主要语言"""
+    total = len(text)
+    if total == 0: return None
+    chinese = len(re.findall(r'[\u4e00-\u9fff]', text))
+    ratio = chinese / total
+    return '中文' if ratio > 0.3 else 'English'
+
+def _count_line(line, in_fence):
+    """按 count_visible_chars 的规则统计单行，返回 (可见字符数, 行末是否处于代码块内)"""
+    parts = line.split("```")
+    visible = []
+    for i, part in enumerate(parts):
+        inside = in_fence if i % 2 == 0 else not in_fence
+        if not inside:
+            visible.append(part)
+    if len(parts) % 2 == 0:
+        in_fence = not in_fence
+    return count_visible_chars("".join(visible)), in_fence
+
+class VisibleCharCounter:
+    """
+    增量统计流式输出的可见字符数
+
+    已完成的行按 count_visible_chars 的规则逐行累计，并跟踪跨行代码块；
+    最后一个未完成的行的字数在 feed 之间缓存，多次读取 count 只统计一次。
+    """
+
+    def __init__(self):
+        self._committed = 0
+        self._in_fence = False
+        self._pending = ""
+        self._pending_count = 0
+
+    def feed(self, text):
+        """追加一段流式文本"""
+        if not text:
+            return
+        if "\n" not in text:
+            self._pending += text
+            self._pending_count = None
+            return
+        lines = (self._pending + text).split("\n")
+        for line in lines[:-1]:
+            visible, self._in_fence = _count_line(line, self._in_fence)
+            self._committed += visible
+        self._pending = lines[-1]
+        self._pending_count = None
+
+    @property
+    def count(self):
+        if self._pending_count is None:
+            pending = self._pending
+            if not pending or self._in_fence and "```" not in pending:
+                self._pending_count = 0
+            else:
+                self._pending_count, _ = _count_line(pending, self._in_fence)
+        return self._committed + self._pending_count
+
+def trim_to_visible_limit(text, limit):
+    """
+    本地截断：按行保留不超过 limit 个可见字符的前缀
+
+    丢弃最后一个不完整的行；截断点位于代码块内时补上结束标记。
+    """
+    lines = text.split("\n")
+    if not text.endswith("\n") and len(lines) > 1:
+        lines = lines[:-1]
+    kept = []
+    total = 0
+    in_fence = False
+    for line in lines:
+        visible, next_fence = _count_line(line, in_fence)
+        if total + visible > limit:
+            break
+        kept.append(line)
+        total += visible
+        in_fence = next_fence
+    if in_fence:
+        kept.append("```")
+    return "\n".join(kept).rstrip() + "\n"
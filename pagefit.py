@@ -0,0 +1,250 @@
+import hashlib
+import math
+import os
+import re
+import logging
+from typing import List, Dict, Tuple, NamedTuple
+
+import fitz
+
+from mdtext import strip_markdown
+from sections import SectionTree
+
+logger = logging.getLogger("DeepSeekAPI")
+
+DEFAULT_PAPER = "a4"
+DEFAULT_PAGES = 1
+DEFAULT_COLUMNS = 2
+DEFAULT_FONT_SIZE = 7.0
+DEFAULT_MARGIN = 18.0
+# 内置的简体中文字体，也包含拉丁字符
+DEFAULT_FONT = "china-s"
+CODE_FONT = "cour"
+LINE_SPACING = 1.15
+COLUMN_GAP = 8.0
+# 标题字号相对正文的倍数（按级别）
+HEADING_SCALE = {1: 1.3, 2: 1.15, 3: 1.05}
+# 列表项的缩进（以正文字号计）
+LIST_INDENT = 1.0
+
+_HEADING = re.compile(r'^\s*(#{1,6})\s+(.*)$')
+_LIST_ITEM = re.compile(r'^(\s*)(?:[-*+]|\d+[.)])\s+(.*)$')
+_CJK = re.compile(r'[⺀-鿿가-힯豈-﫿＀-￯]')
+
+class PageSpec(NamedTuple):
+    """版面：纸张尺寸（点）、页数、分栏、页边距和正文字体"""
+    width: float
+    height: float
+    pages: int = DEFAULT_PAGES
+    columns: int = DEFAULT_COLUMNS
+    margin: float = DEFAULT_MARGIN
+    font_size: float = DEFAULT_FONT_SIZE
+    font: str = DEFAULT_FONT
+
+    @classmethod
+    def from_paper(cls, paper: str = DEFAULT_PAPER, **kwargs) -> "PageSpec":
+        """按纸张名（a4、a5、b5、letter 等，加 -l 为横向）创建版面"""
+        width, height = fitz.paper_size(paper)
+        if width < 0:
+            raise ValueError(f"未知的纸张尺寸: {paper}")
+        return cls(float(width), float(height), **kwargs)
+
+    @property
+    def line_height(self) -> float:
+        return self.font_size * LINE_SPACING
+
+    @property
+    def column_width(self) -> float:
+        return (self.width - 2 * self.margin - COLUMN_GAP * (self.columns - 1)) / self.columns
+
+    @property
+    def column_height(self) -> float:
+        return self.height - 2 * self.margin
+
+    @property
+    def capacity_lines(self) -> int:
+        """整个版面可容纳的正文行数"""
+        return int(self.column_height // self.line_height) * self.columns * self.pages
+
+class Line(NamedTuple):
+    """排好的一行：文字、字号、左缩进（点）、字体"""
+    text: str
+    size: float
+    indent: float
+    font: str
+
+class SectionFit(NamedTuple):
+    title: str
+    lines: float
+    overflow: float
+
+class FitResult(NamedTuple):
+    """版面测量结果，行数均以正文行高计"""
+    capacity: int
+    used: float
+    sections: List[SectionFit]
+
+    @property
+    def overflow(self) -> float:
+        return max(0.0, self.used - self.capacity)
+
+    @property
+    def fits(self) -> bool:
+        return self.used <= self.capacity
+
+class _Metrics:
+    """字体的字符宽度表（字号 1 时的宽度），逐字符缓存"""
+
+    def __init__(self, font: str):
+        if os.path.isfile(font):
+            self.font = fitz.Font(fontfile=font)
+        else:
+            self.font = fitz.Font(font)
+        self.widths: Dict[str, float] = {}
+
+    def width(self, ch: str) -> float:
+        w = self.widths.get(ch)
+        if w is None:
+            w = self.widths[ch] = self.font.text_length(ch, fontsize=1)
+        return w
+
+class PageFitter:
+    """
+    把 Markdown 摘要排入给定版面，测量每个小节占用的行数及超出版面的行数
+
+    排版只用字体的字符宽度做贪心断行（中文可在任意字符处断开，西文在空格处断开），
+    不生成页面，因此足够快，可在每轮压缩后调用。各小节的排版结果按小节内容缓存，
+    小幅修改后重新测量只会重排变化的小节。
+    """
+
+    def __init__(self, spec: PageSpec):
+        self.spec = spec
+        self._metrics = {spec.font: _Metrics(spec.font), CODE_FONT: _Metrics(CODE_FONT)}
+        self._cache: Dict[str, List[Line]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _wrap(self, text: str, size: float, indent: float, font: str) -> List[Line]:
+        metrics = self._metrics[font]
+        limit = self.spec.column_width - indent
+        lines, start, width, last_break = [], 0, 0.0, None
+        i = 0
+        while i < len(text):
+            ch = text[i]
+            w = metrics.width(ch) * size
+            if width + w > limit and i > start:
+                cut = last_break if last_break is not None and last_break > start else i
+                lines.append(Line(text[start:cut].rstrip(), size, indent, font))
+                while cut < len(text) and text[cut] == " ":
+                    cut += 1
+                start, width, last_break = cut, 0.0, None
+                i = cut
+                continue
+            width += w
+            if ch == " ":
+                last_break = i + 1
+            elif _CJK.match(ch):
+                last_break = i + 1
+            i += 1
+        if start < len(text) or not lines:
+            lines.append(Line(text[start:], size, indent, font))
+        return lines
+
+    def layout(self, text: str) -> List[Line]:
+        """把一段 Markdown 排成行；空行不占高度"""
+        spec = self.spec
+        lines: List[Line] = []
+        in_fence = False
+        for raw in text.splitlines():
+            if raw.strip().startswith("```"):
+                in_fence = not in_fence
+                continue
+            if in_fence:
+                lines.extend(self._wrap(raw.rstrip(), spec.font_size, 0.0, CODE_FONT))
+                continue
+            if not raw.strip():
+                continue
+            heading = _HEADING.match(raw)
+            if heading:
+                size = spec.font_size * HEADING_SCALE.get(len(heading.group(1)), 1.0)
+                lines.extend(self._wrap(strip_markdown(heading.group(2)).strip(), size, 0.0, spec.font))
+                continue
+            item = _LIST_ITEM.match(raw)
+            if item:
+                depth = len(item.group(1).expandtabs(4)) // 2 + 1
+                indent = spec.font_size * LIST_INDENT * depth
+                body = "• " + strip_markdown(item.group(2)).strip()
+                lines.extend(self._wrap(body, spec.font_size, indent, spec.font))
+                continue
+            lines.extend(self._wrap(strip_markdown(raw).strip(), spec.font_size, 0.0, spec.font))
+        return lines
+
+    def _section_lines(self, text: str) -> List[Line]:
+        key = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        lines = self._cache.get(key)
+        if lines is None:
+            self.misses += 1
+            lines = self._cache[key] = self.layout(text)
+        else:
+            self.hits += 1
+        return lines
+
+    def _sections(self, text: str) -> List[Tuple[str, str]]:
+        tree = SectionTree.parse(text)
+        parts = []
+        for s in tree.sections:
+            body = text[s.start:s.body_end]
+            if body.strip():
+                parts.append((" > ".join(s.path) or "（开头）", body))
+        return parts or [("（开头）", text)]
+
+    def measure(self, text: str) -> FitResult:
+        """测量摘要占用的行数；小节按顺序排入版面，超出版面的部分计为该小节的溢出行数"""
+        spec = self.spec
+        capacity = spec.capacity_lines
+        used = 0.0
+        sections = []
+        for title, body in self._sections(text):
+            height = sum(line.size * LINE_SPACING for line in self._section_lines(body)) / spec.line_height
+            overflow = max(0.0, used + height - max(used, capacity))
+            used += height
+            sections.append(SectionFit(title, round(height, 1), round(overflow, 1)))
+        return FitResult(capacity, round(used, 1), sections)
+
+    def render(self, text: str, path: str) -> str:
+        """按测量时的排版写出预览 PDF，超出版面的内容接着排在额外的页上"""
+        spec = self.spec
+        doc = fitz.open()
+        fonts = {spec.font: "F0", CODE_FONT: CODE_FONT}
+        page, column, y = None, spec.columns, 0.0
+        for _, body in self._sections(text):
+            for line in self._section_lines(body):
+                height = line.size * LINE_SPACING
+                if page is None or y + height > spec.column_height:
+                    column += 1
+                    y = 0.0
+                    if column >= spec.columns:
+                        page = doc.new_page(width=spec.width, height=spec.height)
+                        if os.path.isfile(spec.font):
+                            page.insert_font(fontname="F0", fontfile=spec.font)
+                        else:
+                            page.insert_font(fontname="F0", fontbuffer=self._metrics[spec.font].font.buffer)
+                        column = 0
+                y += height
+                x = spec.margin + column * (spec.column_width + COLUMN_GAP) + line.indent
+                page.insert_text((x, spec.margin + y - (height - line.size)), line.text,
+                                 fontsize=line.size, fontname=fonts[line.font])
+        if page is None:
+            doc.new_page(width=spec.width, height=spec.height)
+        doc.save(path)
+        doc.close()
+        return path
+
+def overflow_report(result: FitResult, limit: int = 10) -> List[str]:
+    """列出溢出行数最多的小节，用于提示；行数均向上取整，溢出行数不超过该小节的行数"""
+    over = sorted((s for s in result.sections if s.overflow > 0), key=lambda s: -s.overflow)
+    report = []
+    for s in over[:limit]:
+        lines = math.ceil(s.lines)
+        report.append(f"{s.title}: 占 {lines} 行，超出 {min(math.ceil(s.overflow), lines)} 行")
+    return report
@@ -0,0 +1,111 @@
+import json
+import re
+from typing import List, Dict, Optional, Tuple
+
+# 要求模型以编辑操作而不是完整摘要作答时追加到系统消息末尾的格式说明
+PATCH_FORMAT_INSTRUCTION = (
+    "\n输出格式（必须严格遵守）：不要输出完整摘要，只输出对当前摘要的编辑操作，"
+    "格式为一个 JSON 数组，每个元素是以下三种对象之一：\n"
+    '1. {"op": "replace", "target": "<当前摘要中的某一整行>", "content": "<替换后的内容，可多行>"}\n'
+    '2. {"op": "insert", "after": "<当前摘要中的某一整行>", "content": "<插入的内容，可多行>"}\n'
+    '3. {"op": "delete", "target": "<当前摘要中的某一整行>"}\n'
+    "target/after 必须逐字复制当前摘要中唯一存在的一整行；"
+    "若该行是标题（以 # 开头），replace/delete 作用于整个小节，insert 插入到该小节末尾；"
+    'insert 的 after 为空字符串时追加到摘要末尾。只输出 JSON 数组，不要输出其他内容。'
+)
+
+class PatchError(ValueError):
+    """编辑操作无法解析或无法应用"""
+
+def parse_patch(text: Optional[str]) -> List[Dict]:
+    """从模型输出中提取编辑操作列表"""
+    if not text or not isinstance(text, str):
+        raise PatchError("空的编辑操作输出")
+    try:
+        ops = json.loads(text)
+    except json.JSONDecodeError:
+        match = re.search(r'\[.*\]', text, re.DOTALL)
+        if not match:
+            raise PatchError("输出中未找到 JSON 数组")
+        try:
+            ops = json.loads(match.group(0))
+        except json.JSONDecodeError as e:
+            raise PatchError(f"编辑操作 JSON 无效: {e}")
+    if not isinstance(ops, list):
+        raise PatchError("编辑操作必须是 JSON 数组")
+    for op in ops:
+        if not isinstance(op, dict) or op.get("op") not in ("replace", "insert", "delete"):
+            raise PatchError(f"未知的编辑操作: {op!r}")
+    return ops
+
+def _normalize(line: str) -> str:
+    return re.sub(r"\s+", " ", line).strip()
+
+def _heading_level(line: str) -> int:
+    match = re.match(r'\s*(#+)\s', line)
+    return len(match.group(1)) if match else 0
+
+def _find_line(lines: List[str], anchor: str) -> int:
+    """定位锚点所在行：先精确匹配，再忽略空白差异匹配，要求唯一"""
+    anchor = anchor.rstrip("\n")
+    for key in (lambda s: s.strip(), _normalize):
+        target = key(anchor)
+        if not target:
+            break
+        hits = [i for i, line in enumerate(lines) if key(line) == target]
+        if len(hits) == 1:
+            return hits[0]
+        if len(hits) > 1:
+            raise PatchError(f"锚点不唯一: {anchor!r}")
+    raise PatchError(f"未找到锚点: {anchor!r}")
+
+def _block_range(lines: List[str], index: int) -> Tuple[int, int]:
+    """返回锚点行对应的作用范围 [start, end)：标题行为整个小节，否则为单行"""
+    level = _heading_level(lines[index])
+    if not level:
+        return index, index + 1
+    end = index + 1
+    while end < len(lines):
+        other = _heading_level(lines[end])
+        if other and other <= level:
+            break
+        end += 1
+    return index, end
+
+def apply_patch(text: str, ops: List[Dict]) -> str:
+    """
+    按顺序将编辑操作应用到摘要上
+
+    参数:
+        text: 当前摘要
+        ops: parse_patch 返回的编辑操作列表
+
+    返回:
+        应用编辑后的摘要；任一操作失败时抛出 PatchError
+    """
+    lines = text.split("\n")
+    for op in ops:
+        kind = op["op"]
+        content = op.get("content")
+        if kind in ("replace", "insert") and not isinstance(content, str):
+            raise PatchError(f"{kind} 操作缺少 content: {op!r}")
+        new_lines = content.split("\n") if isinstance(content, str) else []
+
+        if kind == "insert":
+            after = op.get("after")
+            if after is None or not str(after).strip():
+                lines.extend(new_lines)
+                continue
+            _, end = _block_range(lines, _find_line(lines, str(after)))
+            lines[end:end] = new_lines
+        else:
+            target = op.get("target")
+            if not isinstance(target, str):
+                raise PatchError(f"{kind} 操作缺少 target: {op!r}")
+            start, end = _block_range(lines, _find_line(lines, target))
+            lines[start:end] = new_lines if kind == "replace" else []
+
+    result = "\n".join(lines)
+    if not result.strip():
+        raise PatchError("应用编辑后摘要为空")
+    return result
@@ -0,0 +1,64 @@
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from typing import Optional, Iterator
+
+logger = logging.getLogger("DeepSeekAPI")
+
+_limiter: Optional["RateLimiter"] = None
+
+def configure(limiter: Optional["RateLimiter"]) -> None:
+    """设置全局限流器，None 表示不限流"""
+    global _limiter
+    _limiter = limiter
+
+def get_limiter() -> Optional["RateLimiter"]:
+    return _limiter
+
+class RateLimiter:
+    """
+    API 请求限流器
+
+    令牌桶限制每分钟发出的请求数（允许 burst 个请求的突发），max_concurrent 限制
+    同时进行中的请求数；两者为 None 时不做对应限制。
+    """
+
+    def __init__(self, requests_per_minute: Optional[float] = None,
+                 max_concurrent: Optional[int] = None, burst: int = 1):
+        self.requests_per_minute = requests_per_minute
+        self.max_concurrent = max_concurrent
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_concurrent) if max_concurrent else None
+        self.waited = 0.0
+
+    def _take_token(self) -> None:
+        if not self.requests_per_minute:
+            return
+        rate = self.requests_per_minute / 60.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = (1 - self._tokens) / rate
+                self.waited += delay
+            time.sleep(delay)
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        """占用一个请求名额，直到请求结束"""
+        if self._slots is not None:
+            self._slots.acquire()
+        try:
+            self._take_token()
+            yield
+        finally:
+            if self._slots is not None:
+                self._slots.release()
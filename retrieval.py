@@ -0,0 +1,182 @@
+import hashlib
+import json
+import math
+import os
+import re
+import logging
+from collections import Counter, defaultdict
+from typing import Optional, List, Dict, Tuple, Iterable
+
+logger = logging.getLogger("DeepSeekAPI")
+
+INDEX_VERSION = 1
+DEFAULT_NGRAMS = (2, 3)
+DEFAULT_PASSAGE_CHARS = 800
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# 仅保留字母、数字和中日韩字符参与 n-gram，空白与标点不计入
+_TOKEN_CHARS = re.compile(r'[0-9a-z\u4e00-\u9fff\u3400-\u4dbf]+')
+
+def char_ngrams(text: str, sizes: Iterable[int] = DEFAULT_NGRAMS) -> List[str]:
+    """将文本切分为字符 n-gram（无需中文分词）"""
+    runs = _TOKEN_CHARS.findall(text.lower())
+    grams = []
+    for run in runs:
+        for n in sizes:
+            if len(run) < n:
+                if n == min(sizes):
+                    grams.append(run)
+                continue
+            grams.extend(run[i:i + n] for i in range(len(run) - n + 1))
+    return grams
+
+def split_passages(content: str, max_chars: int = DEFAULT_PASSAGE_CHARS) -> List[Tuple[int, int]]:
+    """
+    按段落切分原文，返回 (start, end) 偏移列表
+
+    标题行总是开启新的段落组；相邻短段落合并到 max_chars 以内，超长段落按长度硬切分。
+    """
+    spans = []
+    for match in re.finditer(r'[^\n]+(?:\n(?!\s*\n)[^\n]*)*', content):
+        start, end = match.span()
+        if content[start:end].strip():
+            spans.append((start, end))
+
+    passages: List[Tuple[int, int]] = []
+    for start, end in spans:
+        is_heading = content[start:end].lstrip().startswith("#")
+        if passages and not is_heading:
+            prev_start, prev_end = passages[-1]
+            if end - prev_start <= max_chars:
+                passages[-1] = (prev_start, end)
+                continue
+        while end - start > max_chars:
+            passages.append((start, start + max_chars))
+            start += max_chars
+        passages.append((start, end))
+    return passages
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+class SourceIndex:
+    """基于字符 n-gram 的 BM25 原文检索索引"""
+
+    def __init__(self, content: str, passages: List[Tuple[int, int]],
+                 postings: Dict[str, List[Tuple[int, int]]], doc_len: List[int],
+                 ngrams: Tuple[int, ...] = DEFAULT_NGRAMS):
+        self.content = content
+        self.passages = passages
+        self.postings = postings
+        self.doc_len = doc_len
+        self.ngrams = tuple(ngrams)
+        self.avgdl = (sum(doc_len) / len(doc_len)) if doc_len else 0.0
+        n = len(passages)
+        self.idf = {
+            term: math.log(1 + (n - len(plist) + 0.5) / (len(plist) + 0.5))
+            for term, plist in postings.items()
+        }
+
+    @classmethod
+    def build(cls, content: str, passages: Optional[List[Tuple[int, int]]] = None,
+              ngrams: Tuple[int, ...] = DEFAULT_NGRAMS) -> "SourceIndex":
+        """从原文构建索引"""
+        if passages is None:
+            passages = split_passages(content)
+        postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        doc_len = []
+        for doc_id, (start, end) in enumerate(passages):
+            counts = Counter(char_ngrams(content[start:end], ngrams))
+            doc_len.append(sum(counts.values()))
+            for term, tf in counts.items():
+                postings[term].append((doc_id, tf))
+        return cls(content, passages, dict(postings), doc_len, ngrams)
+
+    @classmethod
+    def load_or_build(cls, content: str, cache_path: Optional[str] = None,
+                      passages: Optional[List[Tuple[int, int]]] = None) -> "SourceIndex":
+        """读取磁盘缓存的索引；缓存缺失或原文已变化时重新构建并写回"""
+        digest = content_hash(content)
+        if cache_path and os.path.exists(cache_path):
+            try:
+                with open(cache_path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("version") == INDEX_VERSION and data.get("hash") == digest:
+                    cached = [tuple(p) for p in data["passages"]]
+                    if passages is None or cached == [tuple(p) for p in passages]:
+                        logger.info(f"已载入检索索引缓存: {cache_path}")
+                        return cls(
+                            content,
+                            cached,
+                            {t: [tuple(x) for x in plist] for t, plist in data["postings"].items()},
+                            data["doc_len"],
+                            tuple(data["ngrams"]),
+                        )
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"检索索引缓存无效，将重新构建: {str(e)}")
+
+        index = cls.build(content, passages)
+        if cache_path:
+            index.save(cache_path, digest)
+        return index
+
+    def save(self, path: str, digest: Optional[str] = None) -> None:
+        """将索引写入 JSON 缓存文件"""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({
+                "version": INDEX_VERSION,
+                "hash": digest or content_hash(self.content),
+                "ngrams": list(self.ngrams),
+                "passages": self.passages,
+                "doc_len": self.doc_len,
+                "postings": self.postings,
+            }, f, ensure_ascii=False, separators=(",", ":"))
+        logger.info(f"检索索引已保存至 {path}")
+
+    def passage(self, doc_id: int) -> str:
+        start, end = self.passages[doc_id]
+        return self.content[start:end]
+
+    def search(self, query: str, k: int = 3) -> List[Tuple[float, int]]:
+        """返回与查询最相关的 k 个段落 (得分, 段落编号)"""
+        scores: Dict[int, float] = defaultdict(float)
+        for term in set(char_ngrams(query, self.ngrams)):
+            plist = self.postings.get(term)
+            if not plist:
+                continue
+            idf = self.idf[term]
+            for doc_id, tf in plist:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_len[doc_id] / (self.avgdl or 1))
+                scores[doc_id] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        ranked = sorted(((s, d) for d, s in scores.items()), reverse=True)
+        return ranked[:k]
+
+    def select_passages(self, queries: List[str], k_per_query: int = 2,
+                        max_chars: int = 6000) -> List[int]:
+        """
+        为一组查询挑选相关段落
+
+        按查询轮流取各自的最佳段落，直至达到字符预算；返回按原文顺序排列的段落编号。
+        """
+        ranked = [self.search(q, k_per_query) for q in queries]
+        chosen: List[int] = []
+        total = 0
+        for rank in range(k_per_query):
+            for hits in ranked:
+                if rank >= len(hits):
+                    continue
+                doc_id = hits[rank][1]
+                if doc_id in chosen:
+                    continue
+                start, end = self.passages[doc_id]
+                if chosen and total + (end - start) > max_chars:
+                    continue
+                chosen.append(doc_id)
+                total += end - start
+        return sorted(chosen)
+
+    def render_passages(self, doc_ids: List[int]) -> str:
+        """将选中的段落拼接为提示词片段"""
+        return "\n\n".join(f"[片段{i}]\n{self.passage(i).strip()}" for i in doc_ids)
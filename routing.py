@@ -0,0 +1,106 @@
+import json
+import os
+import logging
+from contextvars import ContextVar
+from typing import Optional, Dict, NamedTuple, Iterable
+
+logger = logging.getLogger("DeepSeekAPI")
+
+# 可路由的阶段；编辑操作模式的调用（如 compress_patch）沿用对应基础阶段的路由
+STAGES = ("repair", "compress", "question", "solve", "parse", "refine")
+
+class Route(NamedTuple):
+    """单个阶段的模型设置；为 None 的字段沿用调用处的默认值"""
+    model: Optional[str] = None
+    temperature: Optional[float] = None
+    max_tokens: Optional[int] = None
+
+# 预设路由表：default 保持各阶段原有设置；fast 让只需整理格式或出题的辅助阶段使用非推理模型
+PRESETS: Dict[str, Dict[str, Route]] = {
+    "default": {},
+    "fast": {
+        "question": Route("deepseek-chat", None, 8192),
+        "parse": Route("deepseek-chat", 0.0, 8192),
+    },
+}
+
+# 路由表随上下文传递，服务中并发执行的任务可以各自使用不同的路由
+_table: ContextVar[Optional["RoutingTable"]] = ContextVar("routing_table", default=None)
+
+def configure(table: Optional["RoutingTable"]) -> None:
+    """为当前上下文设置路由表，None 表示各阶段使用调用处指定的模型和参数"""
+    _table.set(table)
+
+def get_table() -> Optional["RoutingTable"]:
+    return _table.get()
+
+def base_stage(stage: Optional[str]) -> Optional[str]:
+    if stage and stage.endswith("_patch"):
+        return stage[:-len("_patch")]
+    return stage
+
+def parse_route_spec(spec: str) -> tuple:
+    """
+    解析命令行路由覆盖：STAGE=MODEL[:TEMPERATURE[:MAX_TOKENS]]
+
+    留空的字段沿用默认值，例如 parse=deepseek-chat:0:4096、solve=:0.3。
+    """
+    stage, sep, value = spec.partition("=")
+    stage = stage.strip()
+    if not sep or stage not in STAGES:
+        raise ValueError(f"无效的路由 {spec!r}：格式为 STAGE=MODEL[:TEMPERATURE[:MAX_TOKENS]]，"
+                         f"STAGE 可选 {', '.join(STAGES)}")
+    fields = value.split(":")
+    if len(fields) > 3:
+        raise ValueError(f"无效的路由 {spec!r}：字段过多")
+    fields += [""] * (3 - len(fields))
+    model, temperature, max_tokens = (f.strip() for f in fields)
+    return stage, Route(
+        model or None,
+        float(temperature) if temperature else None,
+        int(max_tokens) if max_tokens else None,
+    )
+
+class RoutingTable:
+    """各阶段的模型、temperature 和 max_tokens 路由表"""
+
+    def __init__(self, routes: Optional[Dict[str, Route]] = None, name: str = "custom"):
+        self.routes: Dict[str, Route] = dict(routes or {})
+        self.name = name
+
+    @classmethod
+    def from_preset(cls, preset: str) -> "RoutingTable":
+        """由预设名或 JSON 文件路径构造路由表"""
+        if preset in PRESETS:
+            return cls(PRESETS[preset], preset)
+        if not os.path.exists(preset):
+            raise ValueError(f"未知的路由预设 {preset!r}（可选 {', '.join(PRESETS)}，或 JSON 文件路径）")
+        with open(preset, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        routes = {}
+        for stage, fields in data.items():
+            if stage not in STAGES:
+                raise ValueError(f"路由文件 {preset} 中的阶段 {stage!r} 无效")
+            routes[stage] = Route(fields.get("model"), fields.get("temperature"), fields.get("max_tokens"))
+        return cls(routes, os.path.basename(preset))
+
+    def override(self, specs: Iterable[str]) -> "RoutingTable":
+        """应用命令行覆盖，未留空的字段替换原路由中的对应字段"""
+        for spec in specs:
+            stage, route = parse_route_spec(spec)
+            current = self.routes.get(stage, Route())
+            self.routes[stage] = Route(*(new if new is not None else old
+                                         for new, old in zip(route, current)))
+        return self
+
+    def resolve(self, stage: Optional[str], model: str, temperature: float,
+                max_tokens: int) -> Route:
+        """返回阶段实际使用的模型和参数；未配置的字段沿用传入值"""
+        route = self.routes.get(base_stage(stage))
+        if route is None:
+            return Route(model, temperature, max_tokens)
+        return Route(
+            route.model or model,
+            temperature if route.temperature is None else route.temperature,
+            max_tokens if route.max_tokens is None else route.max_tokens,
+        )
@@ -0,0 +1,417 @@
+import argparse
+import glob
+import json
+import os
+import re
+import sqlite3
+import sys
+import time
+import zlib
+import logging
+from typing import Optional, List, Dict, Any
+
+import telemetry
+from mdtext import count_visible_chars
+
+logger = logging.getLogger("DeepSeekAPI")
+
+SCHEMA_VERSION = 2
+PARAMS_FILE = "params.json"
+# 运行目录中原始文本的位置（多个字数限制时位于共用阶段目录）
+RAW_FILES = ("gen0_raw.txt", os.path.join("shared", "gen0_raw.txt"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_dir TEXT UNIQUE,
+    course TEXT,
+    input_path TEXT,
+    status TEXT,
+    started REAL,
+    finished REAL,
+    duration REAL,
+    params TEXT,
+    calls INTEGER,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    cache_hit_tokens INTEGER,
+    loops INTEGER,
+    best_accuracy REAL,
+    final_accuracy REAL,
+    final_chars INTEGER
+);
+CREATE INDEX IF NOT EXISTS runs_course ON runs(course, started);
+CREATE TABLE IF NOT EXISTS calls (
+    run_id INTEGER REFERENCES runs(id) ON DELETE CASCADE,
+    time REAL,
+    stage TEXT,
+    model TEXT,
+    latency REAL,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    cache_hit_tokens INTEGER,
+    cache_miss_tokens INTEGER,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS calls_run_stage ON calls(run_id, stage);
+CREATE TABLE IF NOT EXISTS scores (
+    run_id INTEGER REFERENCES runs(id) ON DELETE CASCADE,
+    budget INTEGER,
+    loop INTEGER,
+    correct INTEGER,
+    incorrect INTEGER,
+    unsolved INTEGER,
+    total INTEGER,
+    accuracy REAL,
+    PRIMARY KEY (run_id, budget, loop)
+);
+CREATE TABLE IF NOT EXISTS artifacts (
+    run_id INTEGER REFERENCES runs(id) ON DELETE CASCADE,
+    name TEXT,
+    size INTEGER,
+    data BLOB,
+    PRIMARY KEY (run_id, name)
+);
+"""
+
+# 可用于排序的运行指标
+METRICS = {
+    "accuracy": "best_accuracy",
+    "accuracy_per_second": "best_accuracy / NULLIF(duration, 0)",
+    "accuracy_per_ktoken": "best_accuracy * 1000.0 / NULLIF(prompt_tokens + completion_tokens, 0)",
+    "duration": "-duration",
+}
+
+_RESULT_FILE = re.compile(r'result(\d+)\.json$')
+# 多个字数限制时，非主限制的分支目录
+_BRANCH_DIR = re.compile(r'maxtoken_(\d+)$')
+
+def course_name(input_path: str) -> str:
+    """由输入文件名推断课程名：去掉扩展名和 fix.py 追加的 _input 后缀"""
+    stem = os.path.splitext(os.path.basename(input_path))[0]
+    return stem[:-len("_input")] if stem.endswith("_input") else stem
+
+def primary_budget(params: Dict[str, Any]) -> Optional[int]:
+    """主输出（final_summary.txt）对应的字数限制：maxtoken 的第一个值"""
+    limit = params.get("maxtoken")
+    if isinstance(limit, list):
+        limit = limit[0] if limit else None
+    return limit
+
+def _read_scores(result_dir: str) -> List[tuple]:
+    """读取目录中各轮的 resultN.json，返回按轮次排列的 (轮次, 正确, 错误, 无法解答, 总数, 正确率)"""
+    scores = []
+    for path in glob.glob(os.path.join(result_dir, "result*.json")):
+        match = _RESULT_FILE.search(os.path.basename(path))
+        if not match:
+            continue
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                result = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"跳过无法读取的结果文件 {path}: {str(e)}")
+            continue
+        total = len(result.get("details") or [])
+        correct = int(result.get("correct_count") or 0)
+        scores.append((int(match.group(1)), correct, int(result.get("incorrect_count") or 0),
+                       int(result.get("unsolved_count") or 0), total,
+                       correct / total if total else 0.0))
+    return sorted(scores)
+
+def write_params(output_dir: str, params: Dict[str, Any]) -> str:
+    """将本次运行参数写入输出目录，供入库和以后的运行比较使用"""
+    path = os.path.join(output_dir, PARAMS_FILE)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(params, f, ensure_ascii=False, indent=2)
+    return path
+
+def _artifact_names(run_dir: str) -> List[str]:
+    """运行目录及其子目录中的所有文件，返回以 / 分隔的相对路径"""
+    names = []
+    for root, dirs, files in os.walk(run_dir):
+        dirs.sort()
+        rel = os.path.relpath(root, run_dir)
+        for name in sorted(files):
+            names.append(name if rel == "." else "/".join(rel.split(os.sep) + [name]))
+    return names
+
+class RunStore:
+    """
+    运行记录库：单个 SQLite 文件，保存每次运行的参数、调用记录、验证得分和产物
+
+    产物（genN.txt、resultN.json 等，包括 shared/、maxtoken_<限制>/ 等子目录中的文件，按相对路径命名）
+    以 zlib 压缩的二进制块保存，删除输出目录后仍可取回。多个字数限制的运行按限制分别记录验证得分，
+    运行汇总（轮数、最佳与最终正确率）取主限制。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        self.conn.executescript(_SCHEMA)
+        if version == 1:
+            self._migrate_scores()
+        self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def _migrate_scores(self) -> None:
+        """版本 1 的验证得分不区分字数限制；重建表并把旧记录归入各运行的主限制"""
+        rows = self.conn.execute(
+            "SELECT s.*, r.params FROM scores s JOIN runs r ON r.id = s.run_id"
+        ).fetchall()
+        with self.conn:
+            self.conn.execute("DROP TABLE scores")
+        self.conn.executescript(_SCHEMA)
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO scores VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(r["run_id"], primary_budget(json.loads(r["params"] or "{}")), r["loop"], r["correct"],
+                  r["incorrect"], r["unsolved"], r["total"], r["accuracy"]) for r in rows]
+            )
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self) -> "RunStore":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def ingest_run(self, run_dir: str, params: Optional[Dict[str, Any]] = None,
+                   course: Optional[str] = None, status: Optional[str] = None,
+                   started: Optional[float] = None, finished: Optional[float] = None) -> int:
+        """
+        将一个输出目录入库，返回运行编号；同一目录重复入库时覆盖旧记录
+
+        params 缺省时读取目录中的 params.json；起止时间缺省时由调用记录推算。
+        """
+        run_dir = os.path.abspath(run_dir)
+        if params is None:
+            params_path = os.path.join(run_dir, PARAMS_FILE)
+            if os.path.exists(params_path):
+                with open(params_path, "r", encoding="utf-8") as f:
+                    params = json.load(f)
+        params = params or {}
+        input_path = params.get("filename")
+        if course is None:
+            course = params.get("course") or (course_name(input_path) if input_path else None)
+
+        records = telemetry.load_records(os.path.join(run_dir, "telemetry.jsonl"))
+        usage = telemetry.summarize(records)
+        if records:
+            if started is None:
+                started = min(r["time"] - (r.get("latency") or 0) for r in records)
+            if finished is None:
+                finished = max(r["time"] for r in records)
+
+        # 主限制的验证得分在运行目录下，其余限制在各自的 maxtoken_<限制>/ 分支目录下
+        scores = _read_scores(run_dir)
+        budget = primary_budget(params)
+        branch_scores = [(budget, s) for s in scores]
+        for name in sorted(os.listdir(run_dir)):
+            match = _BRANCH_DIR.match(name)
+            if match and os.path.isdir(os.path.join(run_dir, name)):
+                branch_scores.extend((int(match.group(1)), s) for s in _read_scores(os.path.join(run_dir, name)))
+
+        final_path = os.path.join(run_dir, "final_summary.txt")
+        final_chars = None
+        if os.path.exists(final_path):
+            with open(final_path, "r", encoding="utf-8") as f:
+                final_chars = count_visible_chars(f.read())
+        if status is None:
+            status = "completed" if final_chars is not None else "incomplete"
+
+        with self.conn:
+            self.conn.execute("DELETE FROM runs WHERE run_dir = ?", (run_dir,))
+            cur = self.conn.execute(
+                "INSERT INTO runs (run_dir, course, input_path, status, started, finished, duration,"
+                " params, calls, prompt_tokens, completion_tokens, cache_hit_tokens, loops,"
+                " best_accuracy, final_accuracy, final_chars)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (run_dir, course, input_path, status, started, finished,
+                 finished - started if started is not None and finished is not None else None,
+                 json.dumps(params, ensure_ascii=False), usage["calls"], usage["prompt_tokens"],
+                 usage["completion_tokens"], usage["prompt_cache_hit_tokens"], len(scores),
+                 max((s[5] for s in scores), default=None),
+                 scores[-1][5] if scores else None, final_chars)
+            )
+            run_id = cur.lastrowid
+            known = {"time", "stage", "model", "latency", *telemetry.USAGE_FIELDS}
+            self.conn.executemany(
+                "INSERT INTO calls VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(run_id, r.get("time"), r.get("stage"), r.get("model"), r.get("latency"),
+                  r.get("prompt_tokens"), r.get("completion_tokens"),
+                  r.get("prompt_cache_hit_tokens"), r.get("prompt_cache_miss_tokens"),
+                  json.dumps({k: v for k, v in r.items() if k not in known}, ensure_ascii=False))
+                 for r in records]
+            )
+            self.conn.executemany(
+                "INSERT INTO scores VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(run_id, budget, *s) for budget, s in branch_scores]
+            )
+            # 子目录（共用阶段 shared/、各分支 maxtoken_<限制>/）中的产物按相对路径保存
+            for name in _artifact_names(run_dir):
+                with open(os.path.join(run_dir, name), "rb") as f:
+                    data = f.read()
+                self.conn.execute(
+                    "INSERT INTO artifacts VALUES (?, ?, ?, ?)",
+                    (run_id, name, len(data), zlib.compress(data))
+                )
+        logger.info(f"运行记录已入库: #{run_id} {run_dir}")
+        return run_id
+
+    def list_runs(self, course: Optional[str] = None, limit: int = 20) -> List[sqlite3.Row]:
+        """按开始时间倒序列出运行"""
+        sql = "SELECT * FROM runs"
+        args: List[Any] = []
+        if course:
+            sql += " WHERE course = ?"
+            args.append(course)
+        sql += " ORDER BY started DESC LIMIT ?"
+        args.append(limit)
+        return self.conn.execute(sql, args).fetchall()
+
+    def best_runs(self, metric: str = "accuracy_per_second", course: Optional[str] = None,
+                  limit: int = 5) -> List[sqlite3.Row]:
+        """按指标从高到低列出运行（只含有验证得分的运行）"""
+        expr = METRICS[metric]
+        sql = f"SELECT *, {expr} AS metric FROM runs WHERE best_accuracy IS NOT NULL"
+        args: List[Any] = []
+        if course:
+            sql += " AND course = ?"
+            args.append(course)
+        sql += " ORDER BY metric DESC LIMIT ?"
+        args.append(limit)
+        return self.conn.execute(sql, args).fetchall()
+
+    def get_run(self, run_id: int) -> Optional[sqlite3.Row]:
+        return self.conn.execute("SELECT * FROM runs WHERE id = ?", (run_id,)).fetchone()
+
+    def stage_timings(self, run_id: int) -> List[sqlite3.Row]:
+        """各阶段（按模型分开）的调用次数、耗时和 token 用量"""
+        return self.conn.execute(
+            "SELECT stage, model, COUNT(*) AS calls, SUM(latency) AS latency,"
+            " SUM(prompt_tokens) AS prompt_tokens, SUM(completion_tokens) AS completion_tokens,"
+            " SUM(cache_hit_tokens) AS cache_hit_tokens"
+            " FROM calls WHERE run_id = ? GROUP BY stage, model ORDER BY latency DESC",
+            (run_id,)
+        ).fetchall()
+
+    def scores(self, run_id: int) -> List[sqlite3.Row]:
+        return self.conn.execute(
+            "SELECT * FROM scores WHERE run_id = ? ORDER BY budget, loop", (run_id,)
+        ).fetchall()
+
+    def artifact_names(self, run_id: int) -> List[sqlite3.Row]:
+        return self.conn.execute(
+            "SELECT name, size FROM artifacts WHERE run_id = ? ORDER BY name", (run_id,)
+        ).fetchall()
+
+    def artifact(self, run_id: int, name: str) -> Optional[bytes]:
+        row = self.conn.execute(
+            "SELECT data FROM artifacts WHERE run_id = ? AND name = ?", (run_id, name)
+        ).fetchone()
+        return None if row is None else zlib.decompress(row["data"])
+
+def _fmt(value, spec: str = "") -> str:
+    if value is None:
+        return "-"
+    return format(value, spec) if spec else str(value)
+
+def _print_runs(rows, with_metric: bool = False) -> None:
+    header = f"{'编号':>4} {'课程':<20} {'状态':<10} {'开始时间':<19} {'耗时(s)':>8} {'token':>9} {'最佳正确率':>10} {'字数':>6}"
+    if with_metric:
+        header += f" {'指标':>10}"
+    print(header)
+    for r in rows:
+        started = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(r["started"])) if r["started"] else "-"
+        line = (f"{r['id']:>4} {_fmt(r['course']):<20.20} {r['status']:<10} {started:<19} "
+                f"{_fmt(r['duration'], '.0f'):>8} {(r['prompt_tokens'] or 0) + (r['completion_tokens'] or 0):>9} "
+                f"{_fmt(r['best_accuracy'], '.1%'):>10} {_fmt(r['final_chars']):>6}")
+        if with_metric:
+            line += f" {_fmt(r['metric'], '.6g'):>10}"
+        print(line)
+
+def _print_run(store: RunStore, run_id: int) -> bool:
+    run = store.get_run(run_id)
+    if run is None:
+        print(f"错误: 运行 #{run_id} 不存在。", file=sys.stderr)
+        return False
+    print(f"=== 运行 #{run_id}: {run['course']} ({run['status']}) ===")
+    print(f"目录: {run['run_dir']}")
+    params = json.loads(run["params"] or "{}")
+    print("参数: " + ", ".join(f"{k}={v}" for k, v in sorted(params.items())))
+    print(f"耗时: {_fmt(run['duration'], '.1f')}秒, 调用 {run['calls']}次, "
+          f"输入 token {run['prompt_tokens']}（缓存命中 {run['cache_hit_tokens']}）, "
+          f"输出 token {run['completion_tokens']}")
+    print("\n阶段耗时:")
+    for s in store.stage_timings(run_id):
+        print(f"  {_fmt(s['stage']):<14} {_fmt(s['model']):<18} {s['calls']:>4}次 {s['latency'] or 0:>9.1f}秒 "
+              f"输入 {s['prompt_tokens'] or 0:>8} 输出 {s['completion_tokens'] or 0:>8}")
+    print("\n验证得分:")
+    scores = store.scores(run_id)
+    several = len({s["budget"] for s in scores}) > 1
+    for s in scores:
+        budget = f"[{s['budget']} 字] " if several else ""
+        print(f"  {budget}第 {s['loop']} 轮: {s['correct']}/{s['total']} ({s['accuracy']:.1%})")
+    print("\n产物:")
+    for a in store.artifact_names(run_id):
+        print(f"  {a['name']:<36} {a['size']:>9} 字节")
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(description="查询运行记录库")
+    parser.add_argument("--db", default=os.path.join("output", "runs.db"), help="运行记录库路径 (默认: output/runs.db)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("import", help="将已有的输出目录入库")
+    p.add_argument("dirs", nargs="+", help="输出目录，支持通配符")
+    p.add_argument("--course", help="课程名（默认由输入文件名推断）")
+
+    p = sub.add_parser("list", help="列出最近的运行")
+    p.add_argument("--course")
+    p.add_argument("--limit", type=int, default=20)
+
+    p = sub.add_parser("best", help="按指标列出最佳运行")
+    p.add_argument("--course")
+    p.add_argument("--metric", choices=sorted(METRICS), default="accuracy_per_second")
+    p.add_argument("--limit", type=int, default=5)
+
+    p = sub.add_parser("show", help="显示运行详情")
+    p.add_argument("run_ids", type=int, nargs="+")
+
+    p = sub.add_parser("cat", help="输出运行产物内容")
+    p.add_argument("run_id", type=int)
+    p.add_argument("name", help="产物文件名，例如 final_summary.txt；子目录中的产物用相对路径，例如 shared/gen0_raw.txt")
+
+    args = parser.parse_args()
+    with RunStore(args.db) as store:
+        if args.command == "import":
+            for pattern in args.dirs:
+                for run_dir in sorted(glob.glob(pattern)):
+                    if os.path.isdir(run_dir):
+                        run_id = store.ingest_run(run_dir, course=args.course)
+                        print(f"#{run_id} {run_dir}")
+        elif args.command == "list":
+            _print_runs(store.list_runs(args.course, args.limit))
+        elif args.command == "best":
+            _print_runs(store.best_runs(args.metric, args.course, args.limit), with_metric=True)
+        elif args.command == "show":
+            ok = True
+            for run_id in args.run_ids:
+                ok = _print_run(store, run_id) and ok
+                print()
+            if not ok:
+                sys.exit(1)
+        elif args.command == "cat":
+            data = store.artifact(args.run_id, args.name)
+            if data is None:
+                print(f"错误: 运行 #{args.run_id} 没有产物 {args.name}。", file=sys.stderr)
+                sys.exit(1)
+            sys.stdout.write(data.decode("utf-8", errors="replace"))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+import bisect
+import json
+import os
+import re
+import logging
+from typing import Optional, List, Tuple, NamedTuple
+
+from mdtext import count_visible_chars
+from retrieval import content_hash
+
+logger = logging.getLogger("DeepSeekAPI")
+
+SECTIONS_VERSION = 1
+DEFAULT_CHUNK_CHARS = 2000
+
+_HEADING = re.compile(r'(#{1,6})\s+(.*?)\s*#*\s*$')
+_FENCE = re.compile(r'\s*(```|~~~)')
+# 未转义的单个 $（行内公式定界符），$$ 单独处理
+_INLINE_DOLLAR = re.compile(r'(?<![\\$])\$(?!\$)')
+
+class Section(NamedTuple):
+    """
+    一个小节；start/end 为字符偏移，byte_start/byte_end 为 UTF-8 字节偏移
+
+    [start, end) 覆盖标题及其全部子小节，[start, body_end) 只覆盖标题和到第一个子小节之前的正文。
+    visible_chars / body_visible_chars 分别为两者的可见字符数（与 count_visible_chars 一致）。
+    """
+    level: int
+    title: str
+    path: Tuple[str, ...]
+    parent: int
+    start: int
+    end: int
+    body_end: int
+    byte_start: int
+    byte_end: int
+    visible_chars: int
+    body_visible_chars: int
+
+def cache_path_for(input_path: str) -> str:
+    """小节缓存文件路径：与修复后的文本（*_input.txt）放在同一目录"""
+    return f"{os.path.splitext(input_path)[0]}_sections.json"
+
+def _scan_lines(content: str):
+    """
+    逐行扫描文本，识别标题并标记可安全切分的行首
+
+    返回 (line_starts, line_bytes, headings, breaks)：
+    headings 为 (行号, 级别, 标题)；breaks 为可切分的段落起点（字符偏移），
+    位于代码块、$$ 公式块或跨行的行内公式内部的位置都不会被标记。
+    """
+    line_starts, line_bytes, headings, breaks = [], [], [], []
+    offset = byte_offset = 0
+    in_fence = None
+    in_math_block = False
+    inline_open = False
+    prev_blank = True
+    for lineno, line in enumerate(content.splitlines(keepends=True)):
+        line_starts.append(offset)
+        line_bytes.append(byte_offset)
+        stripped = line.strip()
+        protected = in_fence is not None or in_math_block or inline_open
+
+        if not protected:
+            heading = _HEADING.match(stripped)
+            if heading:
+                headings.append((lineno, len(heading.group(1)), heading.group(2)))
+                breaks.append(offset)
+            elif prev_blank and stripped:
+                breaks.append(offset)
+
+        fence = _FENCE.match(line)
+        if in_fence is not None:
+            if fence and fence.group(1) == in_fence:
+                in_fence = None
+        elif in_math_block:
+            if "$$" in stripped:
+                in_math_block = stripped.count("$$") % 2 == 0
+        elif fence:
+            in_fence = fence.group(1)
+        else:
+            if stripped.count("$$") % 2 == 1:
+                in_math_block = True
+            elif len(_INLINE_DOLLAR.findall(line)) % 2 == 1:
+                inline_open = not inline_open
+
+        prev_blank = not stripped
+        offset += len(line)
+        byte_offset += len(line.encode("utf-8"))
+    line_starts.append(offset)
+    line_bytes.append(byte_offset)
+    return line_starts, line_bytes, headings, breaks
+
+class SectionTree:
+    """Markdown 文本的小节树，解析一次后供修复、摘要和检索共用切分边界"""
+
+    def __init__(self, content: str, sections: List[Section], breaks: List[int]):
+        self.content = content
+        self.sections = sections
+        self.breaks = breaks
+        self._starts = [s.start for s in sections]
+
+    @classmethod
+    def parse(cls, content: str) -> "SectionTree":
+        """解析文本；第 0 个小节为覆盖全文的根节点（级别 0）"""
+        line_starts, line_bytes, headings, breaks = _scan_lines(content)
+        total_bytes = line_bytes[-1]
+
+        raw = [[0, "", (), -1, 0, len(content), len(content), 0, total_bytes]]
+        stack = [0]
+        for lineno, level, title in headings:
+            while len(stack) > 1 and raw[stack[-1]][0] >= level:
+                closed = raw[stack.pop()]
+                closed[5] = line_starts[lineno]
+                closed[8] = line_bytes[lineno]
+            parent = stack[-1]
+            if raw[parent][6] > line_starts[lineno]:
+                raw[parent][6] = line_starts[lineno]
+            path = raw[parent][2] + (title,)
+            raw.append([level, title, path, parent, line_starts[lineno],
+                        len(content), len(content), line_bytes[lineno], total_bytes])
+            stack.append(len(raw) - 1)
+        if len(raw) > 1:
+            raw[0][6] = raw[1][4]
+
+        sections = []
+        for level, title, path, parent, start, end, body_end, byte_start, byte_end in raw:
+            body_end = min(body_end, end)
+            body = count_visible_chars(content[start:body_end])
+            sections.append(Section(level, title, path, parent, start, end, body_end,
+                                    byte_start, byte_end, 0, body))
+        # 自底向上累加子小节的可见字符数
+        totals = [s.body_visible_chars for s in sections]
+        for i in range(len(sections) - 1, 0, -1):
+            totals[sections[i].parent] += totals[i]
+        sections = [s._replace(visible_chars=totals[i]) for i, s in enumerate(sections)]
+        return cls(content, sections, breaks)
+
+    @classmethod
+    def load_or_parse(cls, content: str, cache_path: Optional[str] = None) -> "SectionTree":
+        """读取缓存的小节树；缓存缺失或文本已变化时重新解析并写回"""
+        digest = content_hash(content)
+        if cache_path and os.path.exists(cache_path):
+            try:
+                with open(cache_path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("version") == SECTIONS_VERSION and data.get("hash") == digest:
+                    sections = [
+                        Section(s[0], s[1], tuple(s[2]), *s[3:]) for s in data["sections"]
+                    ]
+                    logger.info(f"已载入小节缓存: {cache_path}")
+                    return cls(content, sections, data["breaks"])
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                logger.warning(f"小节缓存无效，将重新解析: {str(e)}")
+
+        tree = cls.parse(content)
+        if cache_path:
+            tree.save(cache_path, digest)
+        return tree
+
+    def save(self, path: str, digest: Optional[str] = None) -> None:
+        """将小节树写入 JSON 缓存文件"""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({
+                "version": SECTIONS_VERSION,
+                "hash": digest or content_hash(self.content),
+                "sections": [list(s) for s in self.sections],
+                "breaks": self.breaks,
+            }, f, ensure_ascii=False, separators=(",", ":"))
+        logger.info(f"小节缓存已保存至 {path}")
+
+    def __len__(self) -> int:
+        return len(self.sections)
+
+    def text(self, index: int) -> str:
+        """小节全文（含子小节）"""
+        s = self.sections[index]
+        return self.content[s.start:s.end]
+
+    def body(self, index: int) -> str:
+        """小节自身的标题和正文（不含子小节）"""
+        s = self.sections[index]
+        return self.content[s.start:s.body_end]
+
+    def children(self, index: int) -> List[int]:
+        return [i for i, s in enumerate(self.sections) if s.parent == index]
+
+    def section_at(self, offset: int) -> int:
+        """返回包含给定字符偏移的最深小节"""
+        return max(bisect.bisect_right(self._starts, offset) - 1, 0)
+
+    def chunks(self, max_chars: int = DEFAULT_CHUNK_CHARS) -> List[Tuple[int, int]]:
+        """
+        按小节切分为块，返回 (start, end) 字符偏移列表
+
+        相邻小节正文合并到 max_chars 可见字符以内；超长正文只在安全段落边界处切开，
+        因此不会切断公式或代码块。块按原文顺序排列且首尾相接覆盖全文。
+        """
+        pieces = []
+        for s in sorted(self.sections, key=lambda s: s.start):
+            if s.body_end <= s.start:
+                continue
+            if s.body_visible_chars <= max_chars:
+                pieces.append((s.start, s.body_end, s.body_visible_chars))
+                continue
+            lo = bisect.bisect_right(self.breaks, s.start)
+            hi = bisect.bisect_left(self.breaks, s.body_end)
+            cuts = [s.start] + self.breaks[lo:hi] + [s.body_end]
+            for a, b in zip(cuts, cuts[1:]):
+                pieces.append((a, b, count_visible_chars(self.content[a:b])))
+
+        chunks: List[Tuple[int, int]] = []
+        current = None
+        for start, end, visible in pieces:
+            if current and current[2] + visible <= max_chars:
+                current = (current[0], end, current[2] + visible)
+            else:
+                if current:
+                    chunks.append((current[0], current[1]))
+                current = (start, end, visible)
+        if current:
+            chunks.append((current[0], current[1]))
+        return chunks
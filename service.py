@@ -0,0 +1,515 @@
+import argparse
+import contextvars
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Dict, List, Any, TextIO
+from urllib.parse import urlparse, unquote
+
+import fix
+import gen
+import hedge
+import ratelimit
+import telemetry
+import errors
+
+logger = logging.getLogger("DeepSeekAPI")
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_WORKERS = 2
+DEFAULT_DATA_DIR = "service_data"
+
+KINDS = ("fix", "gen", "pipeline")
+
+# 任务可传入的 gen.py 参数；transport、hedge 等影响整个进程的设置由服务统一配置
+GEN_OPTIONS = {
+    "maxtoken": int,
+    "geniter": int,
+    "valiter": int,
+    "valproblems": int,
+    "maxwait": int,
+    "targetacc": float,
+    "patience": int,
+    "candidates": int,
+    "candidate_mode": str,
+    "overshoot": float,
+    "onoverflow": str,
+    "course": str,
+    "routing": str,
+}
+GEN_FLAGS = ("patch", "adaptproblems", "retrieval")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created REAL,
+    started REAL,
+    finished REAL,
+    attempts INTEGER DEFAULT 0,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status, id);
+"""
+
+# 当前线程所执行任务的日志文件；print 和 DeepSeekAPI 日志据此写入各自任务的 job.log
+_job_log: contextvars.ContextVar[Optional[TextIO]] = contextvars.ContextVar("job_log", default=None)
+
+class _JobOutput:
+    """替换 sys.stdout/sys.stderr：任务线程中的输出写入任务日志，其余照常输出"""
+
+    def __init__(self, fallback: TextIO):
+        self.fallback = fallback
+
+    def write(self, text: str) -> int:
+        target = _job_log.get()
+        return (target or self.fallback).write(text)
+
+    def flush(self) -> None:
+        target = _job_log.get()
+        (target or self.fallback).flush()
+
+    def __getattr__(self, name):
+        return getattr(self.fallback, name)
+
+class _JobLogHandler(logging.Handler):
+    def emit(self, record: logging.LogRecord) -> None:
+        target = _job_log.get()
+        if target is not None:
+            try:
+                target.write(self.format(record) + "\n")
+            except Exception:
+                self.handleError(record)
+
+class JobError(ValueError):
+    """任务参数无效"""
+
+def validate_job(kind: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    """检查任务类型和参数，返回规范化后的参数；无效时抛出 JobError"""
+    if kind not in KINDS:
+        raise JobError(f"未知的任务类型: {kind}（可选: {', '.join(KINDS)}）")
+    if not isinstance(params, dict):
+        raise JobError("params 必须是对象")
+    if "apikey" in params or "api_key" in params:
+        raise JobError("API key 由服务统一配置，任务参数中不应包含")
+    clean: Dict[str, Any] = {}
+    source = "filename" if kind == "gen" else "pdf"
+    path = params.get(source)
+    if not path or not os.path.isfile(path):
+        raise JobError(f"{source} 不存在: {path}")
+    clean[source] = os.path.abspath(path)
+    if kind == "fix":
+        gen_only = set(params) & (set(GEN_OPTIONS) | set(GEN_FLAGS))
+        if gen_only:
+            raise JobError(f"fix 任务不支持摘要生成参数: {', '.join(sorted(gen_only))}")
+    else:
+        if "maxtoken" not in params:
+            raise JobError("缺少 maxtoken")
+        for key, cast in GEN_OPTIONS.items():
+            if params.get(key) is not None:
+                try:
+                    clean[key] = cast(params[key])
+                except (TypeError, ValueError):
+                    raise JobError(f"{key} 的值无效: {params[key]}")
+        for key in GEN_FLAGS:
+            if params.get(key):
+                clean[key] = True
+    allowed = {source}
+    if kind != "fix":
+        allowed |= set(GEN_OPTIONS) | set(GEN_FLAGS)
+    unknown = set(params) - allowed
+    if unknown:
+        raise JobError(f"不支持的参数: {', '.join(sorted(unknown))}")
+    return clean
+
+class JobQueue:
+    """保存在 SQLite 中的任务队列，服务重启后未完成的任务重新排队"""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+
+    def recover(self) -> int:
+        """将上次退出时仍在运行的任务放回队列，返回数量"""
+        with self._lock, self.conn:
+            cur = self.conn.execute(
+                "UPDATE jobs SET status = 'queued', started = NULL WHERE status = 'running'"
+            )
+            return cur.rowcount
+
+    def submit(self, kind: str, params: Dict[str, Any]) -> int:
+        with self._lock:
+            with self.conn:
+                cur = self.conn.execute(
+                    "INSERT INTO jobs (kind, params, status, created) VALUES (?, ?, 'queued', ?)",
+                    (kind, json.dumps(params, ensure_ascii=False), time.time())
+                )
+            self._ready.notify()
+            return cur.lastrowid
+
+    def claim(self, stop: threading.Event) -> Optional[sqlite3.Row]:
+        """取出最早排队的任务并标记为运行中；队列为空时等待，服务停止时返回 None"""
+        with self._lock:
+            while not stop.is_set():
+                row = self.conn.execute(
+                    "SELECT * FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1"
+                ).fetchone()
+                if row is not None:
+                    with self.conn:
+                        self.conn.execute(
+                            "UPDATE jobs SET status = 'running', started = ?, attempts = attempts + 1"
+                            " WHERE id = ?", (time.time(), row["id"])
+                        )
+                    return row
+                self._ready.wait(timeout=1.0)
+        return None
+
+    def finish(self, job_id: int, status: str, error: Optional[str] = None) -> None:
+        with self._lock, self.conn:
+            self.conn.execute(
+                "UPDATE jobs SET status = ?, finished = ?, error = ? WHERE id = ?",
+                (status, time.time(), error, job_id)
+            )
+
+    def cancel_queued(self, job_id: int) -> bool:
+        """取消尚未开始的任务；任务不在排队状态时返回 False"""
+        with self._lock, self.conn:
+            cur = self.conn.execute(
+                "UPDATE jobs SET status = 'cancelled', finished = ? WHERE id = ? AND status = 'queued'",
+                (time.time(), job_id)
+            )
+            return cur.rowcount > 0
+
+    def get(self, job_id: int) -> Optional[sqlite3.Row]:
+        with self._lock:
+            return self.conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+    def list(self, status: Optional[str] = None, limit: int = 100) -> List[sqlite3.Row]:
+        sql, args = "SELECT * FROM jobs", []
+        if status:
+            sql += " WHERE status = ?"
+            args.append(status)
+        sql += " ORDER BY id DESC LIMIT ?"
+        args.append(limit)
+        with self._lock:
+            return self.conn.execute(sql, args).fetchall()
+
+    def close(self) -> None:
+        self.conn.close()
+
+class JobService:
+    """
+    本地任务服务：固定数量的工作线程依次执行队列中的 fix、gen 和 pipeline（fix 后接 gen）任务
+
+    所有任务在同一进程中运行，共用 HTTP 连接池、限流器、对冲策略和输入文件旁的
+    小节/检索缓存；每个任务的输出、日志和遥测记录保存在 data_dir/jobs/<编号>/ 下。
+    取消在下一次 API 调用前或流式接收的下一个数据块时生效。
+    """
+
+    def __init__(self, data_dir: str, api_key: str, workers: int = DEFAULT_WORKERS,
+                 gen_args: Optional[List[str]] = None):
+        self.data_dir = os.path.abspath(data_dir)
+        self.api_key = api_key
+        self.workers = workers
+        self.gen_args = list(gen_args or [])
+        self.queue = JobQueue(os.path.join(self.data_dir, "jobs.db"))
+        self._stop = threading.Event()
+        self._cancel: Dict[int, threading.Event] = {}
+        self._cancel_lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+
+    def job_dir(self, job_id: int) -> str:
+        return os.path.join(self.data_dir, "jobs", str(job_id))
+
+    def start(self) -> None:
+        recovered = self.queue.recover()
+        if recovered:
+            logger.info(f"{recovered} 个中断的任务已重新排队")
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self) -> None:
+        self._stop.set()
+        with self._cancel_lock:
+            for event in self._cancel.values():
+                event.set()
+
+    def submit(self, kind: str, params: Dict[str, Any]) -> int:
+        return self.queue.submit(kind, validate_job(kind, params))
+
+    def cancel(self, job_id: int) -> Optional[str]:
+        """请求取消任务，返回任务当前状态；任务不存在时返回 None"""
+        if self.queue.cancel_queued(job_id):
+            return "cancelled"
+        with self._cancel_lock:
+            event = self._cancel.get(job_id)
+        if event is not None:
+            event.set()
+            return "cancelling"
+        job = self.queue.get(job_id)
+        return None if job is None else job["status"]
+
+    def _worker(self) -> None:
+        while not self._stop.is_set():
+            job = self.queue.claim(self._stop)
+            if job is None:
+                return
+            event = threading.Event()
+            with self._cancel_lock:
+                self._cancel[job["id"]] = event
+            try:
+                # 每个任务在独立的上下文中运行，遥测记录、日志和取消事件互不影响
+                status, error = contextvars.copy_context().run(self._execute, job, event)
+            finally:
+                with self._cancel_lock:
+                    self._cancel.pop(job["id"], None)
+            if self._stop.is_set() and status == "cancelled":
+                # 服务停止导致的中断：保持运行状态，下次启动时重新排队
+                return
+            self.queue.finish(job["id"], status, error)
+            logger.info(f"任务 #{job['id']} 结束: {status}" + (f"（{error}）" if error else ""))
+
+    def _execute(self, job: sqlite3.Row, event: threading.Event):
+        job_dir = self.job_dir(job["id"])
+        os.makedirs(job_dir, exist_ok=True)
+        params = json.loads(job["params"])
+        with open(os.path.join(job_dir, "job.log"), "a", encoding="utf-8", buffering=1) as log:
+            _job_log.set(log)
+            fix.bind_cancel_event(event)
+            print(f"=== 任务 #{job['id']} ({job['kind']}) 第 {job['attempts'] + 1} 次执行 ===")
+            try:
+                with telemetry.scope():
+                    if job["kind"] in ("fix", "pipeline"):
+                        telemetry.configure(os.path.join(job_dir, "telemetry.jsonl"))
+                        input_path = fix.process_pdf(params["pdf"], self.api_key, job_dir)
+                        if job["kind"] == "fix":
+                            return "done", None
+                        params = dict(params, filename=input_path)
+                    code = self._run_gen(params, job_dir)
+                if event.is_set():
+                    return "cancelled", None
+                return ("done", None) if code == 0 else ("failed", f"gen.py 退出码 {code}")
+            except errors.CancelledError:
+                return "cancelled", None
+            except Exception as e:
+                traceback.print_exc(file=log)
+                if event.is_set():
+                    return "cancelled", None
+                return "failed", f"{type(e).__name__}: {str(e)}"
+
+    def _run_gen(self, params: Dict[str, Any], job_dir: str) -> int:
+        argv = ["--filename", params["filename"], "--apikey", self.api_key,
+                "--output_dir", job_dir]
+        for key in GEN_OPTIONS:
+            if key in params:
+                argv += [f"--{key}", str(params[key])]
+        for key in GEN_FLAGS:
+            if params.get(key):
+                argv.append(f"--{key}")
+        try:
+            gen.main(argv + self.gen_args)
+        except SystemExit as e:
+            return e.code if isinstance(e.code, int) else 1
+        return 0
+
+    def artifacts(self, job_id: int) -> List[Dict[str, Any]]:
+        root = self.job_dir(job_id)
+        items = []
+        for dirpath, _, filenames in os.walk(root):
+            for name in sorted(filenames):
+                path = os.path.join(dirpath, name)
+                items.append({
+                    "name": os.path.relpath(path, root).replace(os.sep, "/"),
+                    "size": os.path.getsize(path),
+                })
+        return items
+
+    def artifact_path(self, job_id: int, name: str) -> Optional[str]:
+        """产物的本地路径；拒绝指向任务目录之外的名称"""
+        root = os.path.realpath(self.job_dir(job_id))
+        path = os.path.realpath(os.path.join(root, name))
+        if not path.startswith(root + os.sep) or not os.path.isfile(path):
+            return None
+        return path
+
+def _job_json(job: sqlite3.Row) -> Dict[str, Any]:
+    data = dict(job)
+    data["params"] = json.loads(data["params"])
+    return data
+
+class _Handler(BaseHTTPRequestHandler):
+    """
+    HTTP 接口:
+        POST /jobs                        提交任务 {"kind": "gen", "params": {...}}
+        GET  /jobs[?status=queued]        任务列表
+        GET  /jobs/<id>                   任务状态
+        POST /jobs/<id>/cancel            取消任务
+        GET  /jobs/<id>/log               任务日志
+        GET  /jobs/<id>/artifacts         产物列表
+        GET  /jobs/<id>/artifacts/<name>  下载产物
+    """
+    service: JobService
+
+    def log_message(self, format, *args):
+        logger.debug("HTTP " + format % args)
+
+    def _send(self, status: int, body: bytes, content_type: str) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _json(self, status: int, data: Any) -> None:
+        self._send(status, json.dumps(data, ensure_ascii=False).encode("utf-8"),
+                   "application/json; charset=utf-8")
+
+    def _error(self, status: int, message: str) -> None:
+        self._json(status, {"error": message})
+
+    def _route(self):
+        url = urlparse(self.path)
+        parts = [unquote(p) for p in url.path.strip("/").split("/") if p]
+        job_id = None
+        if len(parts) >= 2 and parts[0] == "jobs":
+            try:
+                job_id = int(parts[1])
+            except ValueError:
+                return url, parts, None
+        return url, parts, job_id
+
+    def do_GET(self):
+        url, parts, job_id = self._route()
+        service = self.service
+        if parts == ["jobs"]:
+            status = dict(p.split("=", 1) for p in url.query.split("&") if "=" in p).get("status")
+            self._json(HTTPStatus.OK, [_job_json(j) for j in service.queue.list(status)])
+            return
+        if job_id is None or parts[0] != "jobs":
+            self._error(HTTPStatus.NOT_FOUND, "未知路径")
+            return
+        job = service.queue.get(job_id)
+        if job is None:
+            self._error(HTTPStatus.NOT_FOUND, f"任务 #{job_id} 不存在")
+            return
+        if len(parts) == 2:
+            self._json(HTTPStatus.OK, _job_json(job))
+        elif parts[2:] == ["log"]:
+            path = os.path.join(service.job_dir(job_id), "job.log")
+            data = b""
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    data = f.read()
+            self._send(HTTPStatus.OK, data, "text/plain; charset=utf-8")
+        elif parts[2:] == ["artifacts"]:
+            self._json(HTTPStatus.OK, service.artifacts(job_id))
+        elif len(parts) > 3 and parts[2] == "artifacts":
+            path = service.artifact_path(job_id, "/".join(parts[3:]))
+            if path is None:
+                self._error(HTTPStatus.NOT_FOUND, "产物不存在")
+                return
+            with open(path, "rb") as f:
+                data = f.read()
+            content_type = ("application/json; charset=utf-8" if path.endswith(".json")
+                            else "text/plain; charset=utf-8")
+            self._send(HTTPStatus.OK, data, content_type)
+        else:
+            self._error(HTTPStatus.NOT_FOUND, "未知路径")
+
+    def do_POST(self):
+        url, parts, job_id = self._route()
+        service = self.service
+        if parts == ["jobs"]:
+            try:
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length) or b"{}")
+                new_id = service.submit(body.get("kind", ""), body.get("params") or {})
+            except (ValueError, AttributeError) as e:
+                self._error(HTTPStatus.BAD_REQUEST, str(e))
+                return
+            self._json(HTTPStatus.CREATED, _job_json(service.queue.get(new_id)))
+        elif job_id is not None and parts[2:] == ["cancel"]:
+            status = service.cancel(job_id)
+            if status is None:
+                self._error(HTTPStatus.NOT_FOUND, f"任务 #{job_id} 不存在")
+            else:
+                self._json(HTTPStatus.OK, {"id": job_id, "status": status})
+        else:
+            self._error(HTTPStatus.NOT_FOUND, "未知路径")
+
+def main():
+    parser = argparse.ArgumentParser(description="本地速查表生成任务服务")
+    parser.add_argument("--apikey", default=os.environ.get("DEEPSEEK_API_KEY"),
+                        help="DeepSeek API key (默认读取环境变量 DEEPSEEK_API_KEY)")
+    parser.add_argument("--host", default=DEFAULT_HOST, help=f"监听地址 (默认: {DEFAULT_HOST})")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"监听端口 (默认: {DEFAULT_PORT})")
+    parser.add_argument("--data_dir", default=DEFAULT_DATA_DIR,
+                        help=f"任务队列、日志和输出的保存目录 (默认: {DEFAULT_DATA_DIR})")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help=f"同时执行的任务数 (默认: {DEFAULT_WORKERS})")
+    parser.add_argument("--rpm", type=float, default=None, help="所有任务合计每分钟最多发出的 API 请求数")
+    parser.add_argument("--maxconcurrent", type=int, default=None, help="所有任务合计同时进行的 API 请求数上限")
+    parser.add_argument("--transport", choices=["stream", "plain"], default="stream",
+                        help="API 调用的内部传输方式 (默认: stream)")
+    parser.add_argument("--hedge", action="store_true", help="为出题、解析等辅助调用启用对冲请求")
+    parser.add_argument("--runstore", default=None, help="任务结束后存入的运行记录库路径")
+    args = parser.parse_args()
+
+    if not args.apikey:
+        print("错误: API key 未提供。", file=sys.stderr)
+        sys.exit(1)
+
+    sys.stdout = _JobOutput(sys.stdout)
+    sys.stderr = _JobOutput(sys.stderr)
+    handler = _JobLogHandler()
+    handler.setFormatter(logging.Formatter("%(levelname)s:%(name)s:%(message)s"))
+    logger.addHandler(handler)
+
+    # 所有任务共用的连接池、限流器和对冲策略
+    fix.configure_transport(
+        streaming=args.transport == "stream",
+        session=fix.create_retry_session(pool_maxsize=max(10, args.workers * 4))
+    )
+    if args.rpm or args.maxconcurrent:
+        ratelimit.configure(ratelimit.RateLimiter(args.rpm, args.maxconcurrent))
+    if args.hedge:
+        hedge.configure(hedge.HedgePolicy.from_history(
+            os.path.join(args.data_dir, "jobs", "*", "output_*", "telemetry.jsonl")
+        ))
+
+    gen_args = ["--transport", args.transport]
+    if args.runstore:
+        gen_args += ["--runstore", args.runstore]
+    service = JobService(args.data_dir, args.apikey, args.workers, gen_args)
+    service.start()
+
+    _Handler.service = service
+    server = ThreadingHTTPServer((args.host, args.port), _Handler)
+    logger.info(f"任务服务已启动: http://{args.host}:{args.port}，工作线程 {args.workers} 个，数据目录 {service.data_dir}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
+        logger.info("任务服务已停止，未完成的任务将在下次启动时继续")
+
+if __name__ == "__main__":
+    main()
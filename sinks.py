@@ -0,0 +1,236 @@
+import abc
+import hashlib
+import os
+import sys
+import time
+import logging
+from typing import Optional, Callable, Iterable, List, Dict, Union, NamedTuple, TextIO
+
+logger = logging.getLogger("DeepSeekAPI")
+
+CONTENT = "content"
+REASONING = "reasoning"
+KINDS = (CONTENT, REASONING)
+
+DEFAULT_FILE_BUFFER = 64 * 1024
+DEFAULT_CONSOLE_BUFFER = 256
+DEFAULT_FLUSH_INTERVAL = 0.1
+DEFAULT_GUI_INTERVAL = 0.2
+
+class StreamChunk(NamedTuple):
+    """流式响应中的一个增量块；kind 为 "content"（正文）或 "reasoning"（思考过程）"""
+    kind: str
+    text: str
+
+class StreamSink(abc.ABC):
+    """
+    流式输出的接收端
+
+    write() 接收一个增量块，close() 在流结束（包括异常结束）时调用一次。
+    kinds 限定接收的块类型，None 表示全部接收。
+    """
+
+    def __init__(self, kinds: Optional[Iterable[str]] = None):
+        self.kinds = None if kinds is None else frozenset(kinds)
+
+    def accepts(self, kind: str) -> bool:
+        return self.kinds is None or kind in self.kinds
+
+    @abc.abstractmethod
+    def write(self, text: str, kind: str = CONTENT) -> None:
+        """接收一个增量块"""
+
+    def close(self) -> None:
+        pass
+
+class _BufferedSink(StreamSink):
+    """按字符数和时间间隔攒批后再输出，避免每块都触发一次 I/O"""
+
+    def __init__(self, buffer_chars: int, flush_interval: Optional[float],
+                 kinds: Optional[Iterable[str]] = None):
+        super().__init__(kinds)
+        self.buffer_chars = buffer_chars
+        self.flush_interval = flush_interval
+        self._pending: List[str] = []
+        self._pending_chars = 0
+        self._last_flush = time.monotonic()
+
+    def write(self, text: str, kind: str = CONTENT) -> None:
+        self._pending.append(text)
+        self._pending_chars += len(text)
+        if self._pending_chars >= self.buffer_chars:
+            self.flush()
+        elif self.flush_interval is not None:
+            if time.monotonic() - self._last_flush >= self.flush_interval:
+                self.flush()
+
+    def flush(self) -> None:
+        if self._pending:
+            self._emit("".join(self._pending))
+            self._pending.clear()
+            self._pending_chars = 0
+        self._last_flush = time.monotonic()
+
+    @abc.abstractmethod
+    def _emit(self, text: str) -> None:
+        """输出攒好的一批文本"""
+
+    def close(self) -> None:
+        self.flush()
+
+class FileSink(_BufferedSink):
+    """写入文件；攒满 buffer_chars 个字符后写一次，默认不按时间刷新"""
+
+    def __init__(self, path: str, kinds: Optional[Iterable[str]] = None,
+                 buffer_chars: int = DEFAULT_FILE_BUFFER,
+                 flush_interval: Optional[float] = None):
+        super().__init__(buffer_chars, flush_interval, kinds)
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file = open(path, "w", encoding="utf-8")
+
+    def _emit(self, text: str) -> None:
+        self._file.write(text)
+
+    def flush(self) -> None:
+        super().flush()
+        if self.flush_interval is not None:
+            self._file.flush()
+
+    def close(self) -> None:
+        if not self._file.closed:
+            super().close()
+            self._file.close()
+
+class ConsoleSink(_BufferedSink):
+    """打印到控制台；按字符数或时间间隔刷新，兼顾实时性和开销"""
+
+    def __init__(self, kinds: Optional[Iterable[str]] = None,
+                 buffer_chars: int = DEFAULT_CONSOLE_BUFFER,
+                 flush_interval: Optional[float] = DEFAULT_FLUSH_INTERVAL,
+                 stream: Optional[TextIO] = None):
+        super().__init__(buffer_chars, flush_interval, kinds)
+        self.stream = stream
+
+    def _emit(self, text: str) -> None:
+        stream = self.stream or sys.stdout
+        stream.write(text)
+        stream.flush()
+
+class GuiSink(_BufferedSink):
+    """
+    将增量文本交给 GUI 回调
+
+    callback(text, kind) 最多每 interval 秒调用一次，每种块类型分别攒批；
+    在 Tk 中应在回调里使用 root.after 把更新切回主线程。
+    """
+
+    def __init__(self, callback: Callable[[str, str], None],
+                 kinds: Optional[Iterable[str]] = None,
+                 interval: float = DEFAULT_GUI_INTERVAL,
+                 buffer_chars: int = DEFAULT_FILE_BUFFER):
+        super().__init__(buffer_chars, interval, kinds)
+        self.callback = callback
+        self._kind = CONTENT
+
+    def write(self, text: str, kind: str = CONTENT) -> None:
+        if kind != self._kind:
+            # 切换块类型前先交付已攒的内容，保证回调收到的每段只属于一种类型
+            self.flush()
+            self._kind = kind
+        super().write(text, kind)
+
+    def _emit(self, text: str) -> None:
+        self.callback(text, self._kind)
+
+class CollectSink(StreamSink):
+    """用列表累积各类型的块，结束时一次拼接，避免字符串反复相加"""
+
+    def __init__(self, kinds: Optional[Iterable[str]] = None):
+        super().__init__(kinds)
+        self._parts: Dict[str, List[str]] = {kind: [] for kind in KINDS}
+
+    def write(self, text: str, kind: str = CONTENT) -> None:
+        self._parts.setdefault(kind, []).append(text)
+
+    def text(self, kind: str = CONTENT) -> str:
+        return "".join(self._parts.get(kind, []))
+
+class MetricsSink(StreamSink):
+    """统计块数、字符数、首块延迟和吞吐量"""
+
+    def __init__(self, kinds: Optional[Iterable[str]] = None):
+        super().__init__(kinds)
+        self.start = time.monotonic()
+        self.first = None
+        self.end = None
+        self.chunks = {kind: 0 for kind in KINDS}
+        self.chars = {kind: 0 for kind in KINDS}
+
+    def write(self, text: str, kind: str = CONTENT) -> None:
+        if self.first is None:
+            self.first = time.monotonic()
+        self.chunks[kind] = self.chunks.get(kind, 0) + 1
+        self.chars[kind] = self.chars.get(kind, 0) + len(text)
+
+    def close(self) -> None:
+        self.end = time.monotonic()
+
+    def stats(self) -> Dict:
+        end = self.end or time.monotonic()
+        streaming = end - (self.first or end)
+        total_chunks = sum(self.chunks.values())
+        return {
+            "chunks": dict(self.chunks),
+            "chars": dict(self.chars),
+            "first_chunk_latency": None if self.first is None else round(self.first - self.start, 3),
+            "elapsed": round(end - self.start, 3),
+            "chunks_per_second": round(total_chunks / streaming, 1) if streaming > 0 else None,
+        }
+
+class HashSink(StreamSink):
+    """增量计算内容的 SHA-256，用于校验或去重，无需保留全文"""
+
+    def __init__(self, kinds: Optional[Iterable[str]] = (CONTENT,)):
+        super().__init__(kinds)
+        self._hash = hashlib.sha256()
+
+    def write(self, text: str, kind: str = CONTENT) -> None:
+        self._hash.update(text.encode("utf-8"))
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
+
+def drain(stream: Iterable[Union[str, StreamChunk]], sinks: List[StreamSink]) -> None:
+    """
+    将流式响应分发到各个接收端
+
+    stream 中的 str 视为正文块，StreamChunk 按其 kind 分发；None 和空块被跳过。
+    无论流是否正常结束，都会关闭所有接收端；单个接收端关闭失败不影响其他接收端。
+    """
+    routes = {kind: [s for s in sinks if s.accepts(kind)] for kind in KINDS}
+    try:
+        for chunk in stream:
+            if chunk is None:
+                continue
+            if isinstance(chunk, str):
+                kind, text = CONTENT, chunk
+            else:
+                kind, text = chunk
+            if not text:
+                continue
+            targets = routes.get(kind)
+            if targets is None:
+                targets = routes[kind] = [s for s in sinks if s.accepts(kind)]
+            for sink in targets:
+                sink.write(text, kind)
+    finally:
+        close_sinks(sinks)
+
+def close_sinks(sinks: List[StreamSink]) -> None:
+    """关闭所有接收端；单个接收端关闭失败只记录日志，不影响其他接收端"""
+    for sink in sinks:
+        try:
+            sink.close()
+        except Exception as e:
+            logger.error(f"关闭输出端 {type(sink).__name__} 时出错: {str(e)}")
@@ -0,0 +1,166 @@
+import json
+import os
+import logging
+from typing import Optional, List, Dict, Any, Tuple, Iterable
+
+from lectures import allocate_budgets, DIFFICULTY_WEIGHT
+from mdtext import count_visible_chars
+from retrieval import SourceIndex
+from sections import SectionTree
+
+logger = logging.getLogger("DeepSeekAPI")
+
+# 出题时原文最多切分的部分数，即每轮出题的最大并发请求数
+DEFAULT_MAX_STRATA = 8
+# 每部分至少的可见字符数，避免把很短的原文切得过碎
+MIN_STRATUM_CHARS = 1500
+# 每个出题的部分至少的题目数；题目数较少时合并部分，避免每道题单独发一次携带全文的请求
+MIN_STRATUM_QUESTIONS = 3
+# 正确率低于该值的部分视为薄弱，反馈优化时重点补充
+WEAK_ACCURACY = 0.6
+
+def strata_limit(val_problems: int, max_strata: int = DEFAULT_MAX_STRATA) -> int:
+    """每轮 val_problems 道题时的部分数上限：不超过 max_strata，且每部分至少 MIN_STRATUM_QUESTIONS 道题"""
+    return max(1, min(max_strata, val_problems // MIN_STRATUM_QUESTIONS))
+
+def stratify(content: str, max_strata: int = DEFAULT_MAX_STRATA,
+             tree: Optional[SectionTree] = None) -> List[Tuple[int, int]]:
+    """
+    按小节边界把原文切分为不超过 max_strata 个部分，返回 (start, end) 偏移列表
+
+    相邻小节合并到大致相同的篇幅；max_strata 为 1 或原文很短时整体为一个部分。
+    tree 为已解析的小节树，缺省时重新解析。
+    """
+    if max_strata <= 1:
+        return [(0, len(content))]
+    tree = tree or SectionTree.parse(content)
+    total = count_visible_chars(content)
+    size = max(MIN_STRATUM_CHARS, -(-total // max_strata))
+    strata = tree.chunks(size)
+    # 超长小节按段落切开后可能多出几块，合并最短的相邻两块直到不超过上限
+    while len(strata) > max_strata:
+        sizes = [count_visible_chars(content[a:b]) for a, b in strata]
+        i = min(range(len(strata) - 1), key=lambda i: sizes[i] + sizes[i + 1])
+        strata[i:i + 2] = [(strata[i][0], strata[i + 1][1])]
+    return strata or [(0, len(content))]
+
+def _status_key(status: str) -> Optional[str]:
+    if "正确" in status:
+        return "correct"
+    if "错误" in status:
+        return "incorrect"
+    if "无法解答" in status:
+        return "unsolved"
+    return None
+
+class CoverageMap:
+    """
+    原文各部分的验证覆盖情况
+
+    记录每一部分被出过多少题、摘要在这些题上的表现。下一轮出题按篇幅和该部分最近一次的
+    正确率分配题目数（未测过的部分按 0.5 计），反馈优化时列出薄弱部分，无需从头重新测试。
+    """
+
+    def __init__(self, content: str, strata: List[Tuple[int, int]], tree: Optional[SectionTree] = None):
+        self.content = content
+        self.strata = strata
+        tree = tree or SectionTree.parse(content)
+        self.titles = []
+        for start, _ in strata:
+            path = tree.sections[tree.section_at(start)].path
+            self.titles.append(" > ".join(path) if path else "（开头）")
+        self.sizes = [count_visible_chars(content[a:b]) for a, b in strata]
+        self.totals = [{"questions": 0, "correct": 0, "incorrect": 0, "unsolved": 0} for _ in strata]
+        self.last_accuracy: List[Optional[float]] = [None] * len(strata)
+        self._index: Optional[SourceIndex] = None
+
+    def text(self, i: int) -> str:
+        start, end = self.strata[i]
+        return self.content[start:end]
+
+    def attribute(self, question: str) -> int:
+        """把一道题归属到最相关的部分（BM25 检索）；没有共同的字符 n-gram 时归入第 0 部分"""
+        if len(self.strata) == 1:
+            return 0
+        if self._index is None:
+            self._index = SourceIndex.build(self.content, self.strata)
+        hits = self._index.search(question, k=1)
+        return hits[0][1] if hits else 0
+
+    def _weight(self, i: int) -> float:
+        acc = self.last_accuracy[i]
+        return max(self.sizes[i], 1) * (1 + DIFFICULTY_WEIGHT * (1 - (0.5 if acc is None else acc)))
+
+    def allocate(self, total: int, only: Optional[Iterable[int]] = None,
+                 minimum: int = MIN_STRATUM_QUESTIONS) -> List[int]:
+        """
+        把 total 道题分配到各部分，返回每部分的题目数
+
+        提供 only 时只在这些部分之间分配。出题的部分每部分至少 minimum 道题；题目不够分时
+        只在权重（篇幅、最近的错误率）最高的几个部分出题，其余部分本轮不出题。
+        """
+        chosen = sorted(set(only)) if only is not None else list(range(len(self.strata)))
+        counts = [0] * len(self.strata)
+        if not chosen or total <= 0:
+            return counts
+        slots = max(1, total // minimum)
+        if len(chosen) > slots:
+            chosen = sorted(sorted(chosen, key=self._weight, reverse=True)[:slots])
+        shares = allocate_budgets([self.sizes[i] for i in chosen],
+                                  [self.last_accuracy[i] for i in chosen], total,
+                                  minimum=min(minimum, total))
+        for i, n in zip(chosen, shares):
+            counts[i] = n
+        return counts
+
+    def record(self, owners: List[int], results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        记录一轮解答结果，返回本轮各部分的统计
+
+        owners[i] 为第 i 道题所属的部分。解析出的结果数与题目数一致时按顺序对应，
+        否则按结果中的题目内容重新归属。
+        """
+        loop = [{"questions": 0, "correct": 0, "incorrect": 0, "unsolved": 0} for _ in self.strata]
+        positional = len(results) == len(owners)
+        for i, r in enumerate(results):
+            if not isinstance(r, dict):
+                continue
+            if positional:
+                owner = owners[i]
+            else:
+                owner = self.attribute(r.get("question") or "")
+            key = _status_key(r.get("status") or "")
+            loop[owner]["questions"] += 1
+            if key:
+                loop[owner][key] += 1
+        for i, stats in enumerate(loop):
+            for k, v in stats.items():
+                self.totals[i][k] += v
+            if stats["questions"]:
+                self.last_accuracy[i] = stats["correct"] / stats["questions"]
+        return loop
+
+    def weak(self) -> List[int]:
+        """最近一次测试正确率低于 WEAK_ACCURACY 的部分，正确率从低到高排列"""
+        weak = [i for i, acc in enumerate(self.last_accuracy) if acc is not None and acc < WEAK_ACCURACY]
+        return sorted(weak, key=lambda i: self.last_accuracy[i])
+
+    def save(self, output_dir: str, iteration: int, loop: List[Dict[str, Any]]) -> str:
+        """写出 coverage{iteration}.json（与 result{iteration}.json 同目录）"""
+        sections = []
+        for i, (start, end) in enumerate(self.strata):
+            sections.append({
+                "index": i,
+                "title": self.titles[i],
+                "start": start,
+                "end": end,
+                "chars": self.sizes[i],
+                "tested": self.totals[i]["questions"] > 0,
+                "loop": loop[i],
+                "total": self.totals[i],
+                "accuracy": self.last_accuracy[i],
+            })
+        path = os.path.join(output_dir, f"coverage{iteration}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"sections": sections, "weak": self.weak()}, f, ensure_ascii=False, indent=2)
+        return path
@@ -0,0 +1,159 @@
+import json
+import os
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional, Dict, List, Any, Iterator
+
+logger = logging.getLogger("DeepSeekAPI")
+
+class _Log:
+    """一组调用记录，同时（可选）追加写入 JSONL 文件"""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.records: List[Dict[str, Any]] = []
+
+# 进程内默认的调用记录；scope() 可为当前上下文（如服务中的单个任务）绑定独立的记录
+_lock = threading.Lock()
+_default = _Log()
+_current: ContextVar[_Log] = ContextVar("telemetry_log", default=_default)
+
+# usage 中需要记录的字段（DeepSeek 上下文缓存会返回 prompt_cache_hit/miss_tokens）
+USAGE_FIELDS = (
+    "prompt_tokens",
+    "completion_tokens",
+    "total_tokens",
+    "prompt_cache_hit_tokens",
+    "prompt_cache_miss_tokens",
+)
+
+def configure(path: Optional[str]) -> None:
+    """设置遥测记录文件路径（JSONL），传入 None 则只保留内存记录"""
+    with _lock:
+        _current.get().path = path
+    if path:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+def record_call(
+    stage: Optional[str],
+    model: str,
+    latency: float,
+    usage: Optional[Dict] = None,
+    **extra
+) -> Dict[str, Any]:
+    """
+    记录一次 API 调用
+
+    参数:
+        stage: 调用所属阶段（如 compress、question、refine），可为空
+        model: 模型名称
+        latency: 调用耗时（秒）
+        usage: API 响应中的 usage 字段
+        extra: 其他需要一并记录的字段
+
+    返回:
+        写入的记录
+    """
+    usage = usage or {}
+    entry = {
+        "time": time.time(),
+        "stage": stage,
+        "model": model,
+        "latency": round(latency, 3),
+    }
+    for field in USAGE_FIELDS:
+        entry[field] = int(usage.get(field) or 0)
+    entry.update(extra)
+
+    log = _current.get()
+    with _lock:
+        log.records.append(entry)
+        path = log.path
+        if path:
+            try:
+                with open(path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            except OSError as e:
+                logger.warning(f"写入遥测记录失败: {str(e)}")
+    return entry
+
+def get_records(stage: Optional[str] = None) -> List[Dict[str, Any]]:
+    """获取内存中的调用记录，可按阶段过滤"""
+    with _lock:
+        records = list(_current.get().records)
+    if stage is not None:
+        records = [r for r in records if r.get("stage") == stage]
+    return records
+
+def load_records(path: str) -> List[Dict[str, Any]]:
+    """从 JSONL 文件读取调用记录，跳过损坏的行"""
+    records = []
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+    except FileNotFoundError:
+        pass
+    return records
+
+def summarize(records: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+    """汇总调用次数、耗时、token 用量及上下文缓存命中率"""
+    if records is None:
+        records = get_records()
+    summary = {"calls": len(records), "latency": 0.0}
+    for field in USAGE_FIELDS:
+        summary[field] = 0
+    for r in records:
+        summary["latency"] += float(r.get("latency") or 0)
+        for field in USAGE_FIELDS:
+            summary[field] += int(r.get(field) or 0)
+    cached = summary["prompt_cache_hit_tokens"] + summary["prompt_cache_miss_tokens"]
+    summary["cache_hit_ratio"] = (
+        summary["prompt_cache_hit_tokens"] / cached if cached else 0.0
+    )
+    summary["latency"] = round(summary["latency"], 3)
+    return summary
+
+def summarize_stages(records: Optional[List[Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
+    """按阶段和模型汇总调用次数、平均耗时和输出 token，用于比较不同路由的耗时"""
+    if records is None:
+        records = get_records()
+    groups: Dict[tuple, Dict[str, Any]] = {}
+    for r in records:
+        key = (r.get("stage"), r.get("model"))
+        g = groups.setdefault(key, {"stage": key[0], "model": key[1], "calls": 0,
+                                    "latency": 0.0, "completion_tokens": 0})
+        g["calls"] += 1
+        g["latency"] += float(r.get("latency") or 0)
+        g["completion_tokens"] += int(r.get("completion_tokens") or 0)
+    for g in groups.values():
+        g["mean_latency"] = round(g["latency"] / g["calls"], 3)
+        g["latency"] = round(g["latency"], 3)
+    return sorted(groups.values(), key=lambda g: -g["latency"])
+
+def reset() -> None:
+    """清空内存中的调用记录"""
+    with _lock:
+        _current.get().records.clear()
+
+@contextmanager
+def scope(path: Optional[str] = None) -> Iterator[None]:
+    """
+    在当前上下文中使用一组独立的调用记录，退出后恢复原记录
+
+    线程池中的任务需通过 contextvars.copy_context().run 提交才能继承该记录。
+    """
+    token = _current.set(_Log(path))
+    try:
+        yield
+    finally:
+        _current.reset(token)
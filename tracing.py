@@ -0,0 +1,172 @@
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional, Dict, List, Any, Iterator, Callable
+
+logger = logging.getLogger("DeepSeekAPI")
+
+# 当前上下文的追踪器；为 None 时 span() 不做任何记录
+_tracer: ContextVar[Optional["Tracer"]] = ContextVar("tracer", default=None)
+
+def configure(tracer: Optional["Tracer"]) -> None:
+    """为当前上下文设置追踪器，None 表示关闭追踪"""
+    _tracer.set(tracer)
+
+def get_tracer() -> Optional["Tracer"]:
+    return _tracer.get()
+
+class _Frame:
+    __slots__ = ("start_size", "max_peak")
+
+    def __init__(self, start_size: int):
+        self.start_size = start_size
+        self.max_peak = start_size
+
+class Tracer:
+    """
+    记录嵌套的耗时区间，导出为 Chrome / Perfetto 可读的 trace 文件
+
+    memory 为真时启用 tracemalloc，主线程上的区间额外记录区间内的内存峰值增量（mem_peak_kb）
+    和结束时的净增量（mem_delta_kb）。tracemalloc 的峰值是整个进程的，重置峰值会影响
+    所有线程，因此其他线程上的区间不记录内存；主线程区间的数值包含同时运行的工作线程的分配。
+    """
+
+    def __init__(self, memory: bool = False):
+        self.memory = memory
+        self.events: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+        self._pid = os.getpid()
+        self._threads: Dict[int, str] = {}
+        self._local = threading.local()
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def _now_us(self) -> float:
+        return (time.perf_counter() - self._origin) * 1e6
+
+    def _stack(self, attr: str) -> list:
+        stack = getattr(self._local, attr, None)
+        if stack is None:
+            stack = []
+            setattr(self._local, attr, stack)
+        return stack
+
+    def annotate(self, **args) -> None:
+        """向当前线程最内层的未结束区间补充参数"""
+        open_args = self._stack("args")
+        if open_args:
+            open_args[-1].update(args)
+
+    @contextmanager
+    def span(self, name: str, cat: str = "pipeline", **args) -> Iterator[Dict[str, Any]]:
+        """
+        记录一个区间；产出的字典可在区间内补充参数，结束时写入事件的 args
+        """
+        tid = threading.get_ident()
+        if tid not in self._threads:
+            with self._lock:
+                self._threads.setdefault(tid, threading.current_thread().name)
+        frame = None
+        if self.memory and threading.current_thread() is threading.main_thread():
+            current, peak = tracemalloc.get_traced_memory()
+            stack = self._stack("frames")
+            if stack:
+                stack[-1].max_peak = max(stack[-1].max_peak, peak)
+            tracemalloc.reset_peak()
+            frame = _Frame(current)
+            stack.append(frame)
+        open_args = self._stack("args")
+        open_args.append(args)
+        start = self._now_us()
+        try:
+            yield args
+        finally:
+            end = self._now_us()
+            open_args.pop()
+            if frame is not None:
+                current, peak = tracemalloc.get_traced_memory()
+                frame.max_peak = max(frame.max_peak, peak)
+                stack = self._stack("frames")
+                stack.pop()
+                if stack:
+                    stack[-1].max_peak = max(stack[-1].max_peak, frame.max_peak)
+                args["mem_peak_kb"] = round((frame.max_peak - frame.start_size) / 1024, 1)
+                args["mem_delta_kb"] = round((current - frame.start_size) / 1024, 1)
+            event = {"name": name, "cat": cat, "ph": "X", "ts": round(start, 1),
+                     "dur": round(end - start, 1), "pid": self._pid, "tid": tid,
+                     "args": {k: v for k, v in args.items() if v is not None}}
+            with self._lock:
+                self.events.append(event)
+                if frame is not None:
+                    self.events.append({"name": "traced_memory", "ph": "C", "ts": round(end, 1),
+                                        "pid": self._pid, "args": {"current_kb": round(current / 1024, 1)}})
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """按区间名汇总次数和总耗时（毫秒），总耗时从高到低排列"""
+        totals: Dict[str, Dict[str, Any]] = {}
+        with self._lock:
+            events = [e for e in self.events if e["ph"] == "X"]
+        for e in events:
+            t = totals.setdefault(e["name"], {"name": e["name"], "count": 0, "total_ms": 0.0,
+                                              "max_mem_peak_kb": None})
+            t["count"] += 1
+            t["total_ms"] += e["dur"] / 1000
+            peak = e["args"].get("mem_peak_kb")
+            if peak is not None:
+                t["max_mem_peak_kb"] = max(peak, t["max_mem_peak_kb"] or 0)
+        for t in totals.values():
+            t["total_ms"] = round(t["total_ms"], 1)
+        return sorted(totals.values(), key=lambda t: -t["total_ms"])
+
+    def save(self, path: str) -> str:
+        """写出 Chrome trace（JSON 对象格式），可在 chrome://tracing 或 ui.perfetto.dev 打开"""
+        with self._lock:
+            events = list(self.events)
+            threads = dict(self._threads)
+        metadata = [{"name": "thread_name", "ph": "M", "pid": self._pid, "tid": tid,
+                     "args": {"name": name}} for tid, name in threads.items()]
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": metadata + events, "displayTimeUnit": "ms"},
+                      f, ensure_ascii=False)
+        logger.info(f"追踪记录已保存至 {path}")
+        return path
+
+@contextmanager
+def _null_span() -> Iterator[Dict[str, Any]]:
+    yield {}
+
+def span(name: str, cat: str = "pipeline", **args):
+    """在当前追踪器中记录一个区间；未启用追踪时几乎没有开销"""
+    tracer = _tracer.get()
+    if tracer is None:
+        return _null_span()
+    return tracer.span(name, cat, **args)
+
+def annotate(**args) -> None:
+    """向当前区间补充参数（如区间开始时尚未确定的模型名）；未启用追踪时忽略"""
+    tracer = _tracer.get()
+    if tracer is not None:
+        tracer.annotate(**args)
+
+def traced(name: Optional[str] = None, cat: str = "pipeline") -> Callable:
+    """把整个函数调用记录为一个区间的装饰器"""
+    def decorator(func):
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            tracer = _tracer.get()
+            if tracer is None:
+                return func(*args, **kwargs)
+            with tracer.span(span_name, cat):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
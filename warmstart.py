@@ -0,0 +1,104 @@
+import glob
+import hashlib
+import os
+import re
+import logging
+from typing import List, Tuple, NamedTuple
+
+from retrieval import SourceIndex
+from runstore import RAW_FILES
+from sections import SectionTree
+
+logger = logging.getLogger("DeepSeekAPI")
+
+# 题目以行首题号开始（如 "1." "2、" "3．"）
+_QUESTION_START = re.compile(r'^\s*\d+\s*[.．、]', re.M)
+
+def split_questions(text: str) -> List[str]:
+    """按行首题号把题目文本拆成单题，去掉题号"""
+    starts = [m.start() for m in _QUESTION_START.finditer(text or "")]
+    questions = []
+    for start, end in zip(starts, starts[1:] + [len(text or "")]):
+        block = _QUESTION_START.sub("", text[start:end], count=1).strip()
+        if block:
+            questions.append(block)
+    return questions
+
+def join_questions(questions: List[str]) -> str:
+    """重新编号并拼接题目，格式与 generate_questions 的输出一致"""
+    return "\n\n".join(f"{i}. {q}" for i, q in enumerate(questions, start=1))
+
+def _unit_hash(text: str) -> str:
+    # 忽略空白差异，重新排版不算内容变化
+    return hashlib.sha256(re.sub(r'\s+', '', text).encode("utf-8")).hexdigest()
+
+def _units(content: str) -> List[Tuple[int, int]]:
+    """比较的单位：各小节的标题和正文（不含子小节）；根节点的正文即第一个标题之前的内容"""
+    tree = SectionTree.parse(content)
+    units = [(s.start, s.body_end) for s in tree.sections if content[s.start:s.body_end].strip()]
+    return units or [(0, len(content))]
+
+class WarmStart(NamedTuple):
+    """热启动的素材：上一次的摘要、可复用的题目，以及新原文中有变化的小节 (start, end)"""
+    summary: str
+    questions: List[str]
+    changed_spans: List[Tuple[int, int]]
+    total_units: int
+
+def load_question_bank(run_dir: str) -> List[str]:
+    """读取上一次运行各轮验证的题目（valN.txt），去除重复题目"""
+    seen, bank = set(), []
+    for path in sorted(glob.glob(os.path.join(run_dir, "val*.txt"))):
+        with open(path, "r", encoding="utf-8") as f:
+            for question in split_questions(f.read()):
+                key = _unit_hash(question)
+                if key not in seen:
+                    seen.add(key)
+                    bank.append(question)
+    return bank
+
+def reusable_questions(questions: List[str], old_content: str, new_content: str) -> Tuple[List[str], List[str]]:
+    """
+    挑出出处未变的题目
+
+    每道题通过 BM25 检索归属到旧原文中最相关的小节；该小节的内容在新原文中仍然存在
+    （忽略空白后逐字相同）时保留该题。返回 (可复用的题目, 新原文中有变化的小节偏移)。
+    """
+    old_units = _units(old_content)
+    new_units = _units(new_content)
+    new_hashes = {_unit_hash(new_content[a:b]) for a, b in new_units}
+    old_hashes = {_unit_hash(old_content[a:b]) for a, b in old_units}
+    unchanged = [_unit_hash(old_content[a:b]) in new_hashes for a, b in old_units]
+    changed = [(a, b) for a, b in new_units if _unit_hash(new_content[a:b]) not in old_hashes]
+
+    index = SourceIndex.build(old_content, old_units)
+    kept = []
+    for question in questions:
+        hits = index.search(question, k=1)
+        if hits and unchanged[hits[0][1]]:
+            kept.append(question)
+    return kept, changed
+
+def prepare_warm_start(summary_path: str, new_content: str) -> WarmStart:
+    """
+    读取上一次运行的最终摘要及同目录下的原文和题库，准备热启动
+
+    上一次运行目录中缺少原文（gen0_raw.txt）时无法判断哪些小节未变，不复用题目，
+    并把新原文整体视为有变化。
+    """
+    with open(summary_path, "r", encoding="utf-8") as f:
+        summary = f.read()
+    run_dir = os.path.dirname(os.path.abspath(summary_path))
+    old_content = None
+    for name in RAW_FILES:
+        path = os.path.join(run_dir, name)
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                old_content = f.read()
+            break
+    total = len(_units(new_content))
+    if old_content is None:
+        logger.warning(f"{run_dir} 中没有上一次的原文，不复用题目")
+        return WarmStart(summary, [], _units(new_content), total)
+    kept, changed = reusable_questions(load_question_bank(run_dir), old_content, new_content)
+    return WarmStart(summary, kept, changed, total)